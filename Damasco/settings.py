@@ -82,7 +82,11 @@ WSGI_APPLICATION = "Damasco.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        # SQLITE_PATH permite usar otra base (p. ej. en pruebas de carga)
+        "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+        # Esperar hasta 20 s a que se libere el bloqueo de escritura en lugar de
+        # fallar con "database is locked" (WAL se activa en main.apps)
+        "OPTIONS": {"timeout": 20},
     }
 }
 
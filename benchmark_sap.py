@@ -0,0 +1,202 @@
+"""
+Benchmark de rendimiento contra un Service Layer simulado
+
+Levanta main.sap_mock_server (en otro proceso) con 1k/10k/100k facturas y mide:
+- Throughput de paginación de SAPServiceLayer.query (registros/s, páginas, bytes)
+- Pico de memoria (tracemalloc)
+- Tiempo de punta a punta de get_top_selling_products, get_top_customers
+  y get_sales_person_performance
+
+Los resultados se guardan en JSON para compararlos entre versiones.
+
+Uso:
+    python benchmark_sap.py
+    python benchmark_sap.py --sizes 1000 10000 --latency 0.005
+    python benchmark_sap.py --baseline bench_results/sap_20260115-120000.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Instantáneas de meses cerrados en una carpeta propia: las pasadas las borran
+# y no deben tocar las del Service Layer real
+SNAPSHOT_DIR = tempfile.mkdtemp(prefix='bench_snapshots_')
+os.environ['DOCUMENT_SNAPSHOT_DIR'] = SNAPSHOT_DIR
+
+from main import document_cache, master_data
+from main.sap_mock_server import MockDataset, fetch_mock_stats, spawn_mock_server
+from main.sap_service_layer import (
+    SAPServiceLayer, get_top_selling_products, get_top_customers, get_sales_person_performance
+)
+
+METRICS_TO_COMPARE = ('seconds', 'peak_mb')
+
+
+def run_silently(func, *args, **kwargs):
+    """Ejecutar una función descartando sus prints (no queremos medir la consola)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def clear_caches():
+    """Vaciar las cachés para que cada pasada vuelva a consultar el Service Layer"""
+    document_cache.clear()
+    master_data.clear()
+    shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+
+
+def measure(func, *args, memory=True, **kwargs):
+    """Medir tiempo (sin tracemalloc) y, opcionalmente, pico de memoria en una segunda pasada"""
+    clear_caches()
+    start = time.perf_counter()
+    result = run_silently(func, *args, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    peak_mb = None
+    if memory:
+        clear_caches()
+        tracemalloc.start()
+        run_silently(func, *args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_mb = round(peak / (1024 * 1024), 2)
+
+    return result, {"seconds": round(elapsed, 4), "peak_mb": peak_mb}
+
+
+def bench_size(documents, args):
+    """Ejecutar todos los benchmarks para un tamaño de dataset"""
+    # Mismo dataset que genera el servidor: sólo se usa para rangos y conteos esperados
+    dataset = MockDataset(documents=documents, days=args.days)
+    date_from, date_to = dataset.date_range()
+    filters = f"DocDate ge '{date_from}' and DocDate le '{date_to}'"
+    results = {}
+
+    config_path = os.path.join(tempfile.mkdtemp(prefix='sap_bench_'), 'sap_config.json')
+    server = spawn_mock_server(config_path, documents=documents, latency=args.latency,
+                               page_size=args.page_size, days=args.days)
+    os.environ['SAP_CONFIG_PATH'] = config_path
+    try:
+        # 1. Paginación pura de SAPServiceLayer.query
+        sap = SAPServiceLayer()
+        run_silently(sap.login)
+        fetch_mock_stats(sap.base_url, reset=True)
+        query_result, timing = measure(
+            sap.query, '/Invoices', filters=filters, select='DocumentLines', memory=not args.no_memory
+        )
+        stats = fetch_mock_stats(sap.base_url)
+        passes = 1 if args.no_memory else 2
+        pages = stats['pages'] // passes
+        bytes_sent = stats['bytes_sent'] // passes
+        run_silently(sap.logout)
+
+        records = query_result.get('count', 0)
+        expected = dataset.count('Invoices')
+        results['query'] = dict(
+            timing,
+            records=records,
+            expected_records=expected,
+            complete=records == expected,
+            pages=pages,
+            megabytes=round(bytes_sent / (1024 * 1024), 2),
+            records_per_second=round(records / timing['seconds'], 1) if timing['seconds'] else None,
+        )
+        print(f"   query: {records}/{expected} registros en {timing['seconds']}s "
+              f"({results['query']['records_per_second']} reg/s, {pages} páginas, pico {timing['peak_mb']} MB)")
+
+        # 2. Analíticas de punta a punta
+        analytics = {
+            'get_top_selling_products': (get_top_selling_products, (date_from, date_to, 10)),
+            'get_top_customers': (get_top_customers, (date_from, date_to, 10)),
+            'get_sales_person_performance': (get_sales_person_performance, ('1', date_from, date_to)),
+        }
+        for name, (func, func_args) in analytics.items():
+            output, timing = measure(func, *func_args, memory=not args.no_memory)
+            success = bool(json.loads(output).get('success'))
+            results[name] = dict(timing, success=success)
+            print(f"   {name}: {timing['seconds']}s (pico {timing['peak_mb']} MB){'' if success else ' ❌'}")
+    finally:
+        server.terminate()
+        server.wait()
+
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """Comparar contra un resultado previo. Retorna la cantidad de regresiones"""
+    regressions = 0
+    print("\n" + "=" * 60)
+    print(f"COMPARACIÓN CONTRA BASELINE (tolerancia {tolerance:.0%})")
+    print("=" * 60)
+    for size, benchmarks in current['results'].items():
+        base_benchmarks = baseline.get('results', {}).get(size)
+        if not base_benchmarks:
+            continue
+        for name, metrics in benchmarks.items():
+            for metric in METRICS_TO_COMPARE:
+                new = metrics.get(metric)
+                old = base_benchmarks.get(name, {}).get(metric)
+                if not new or not old:
+                    continue
+                change = (new - old) / old
+                flag = "⚠️ REGRESIÓN" if change > tolerance else ("🚀" if change < -tolerance else "")
+                if change > tolerance:
+                    regressions += 1
+                print(f"   {size:>7} {name:<30} {metric:<8} {old:>10} → {new:>10} ({change:+.1%}) {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de SAPServiceLayer contra un Service Layer simulado")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Cantidades de facturas a simular")
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--latency', type=float, default=0.0, help="Latencia simulada por petición (s)")
+    parser.add_argument('--page-size', type=int, default=20, help="Tamaño de página del servidor simulado")
+    parser.add_argument('--no-memory', action='store_true', help="No medir pico de memoria (más rápido)")
+    parser.add_argument('--output', default=None, help="Archivo de resultados (default: bench_results/sap_<fecha>.json)")
+    parser.add_argument('--baseline', default=None, help="Resultados previos para detectar regresiones")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Empeoramiento tolerado antes de marcar regresión")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("BENCHMARK SAP SERVICE LAYER (simulado)")
+    print("=" * 60)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "config": {"days": args.days, "latency": args.latency, "page_size": args.page_size},
+        "results": {},
+    }
+    for size in args.sizes:
+        print(f"\n📦 {size} facturas")
+        report['results'][str(size)] = bench_size(size, args)
+
+    output = args.output or os.path.join('bench_results', f"sap_{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Resultados guardados en {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
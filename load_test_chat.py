@@ -0,0 +1,248 @@
+"""
+Prueba de carga del endpoint /send/ con usuarios concurrentes
+
+Simula N usuarios que envían mensajes a send_message al mismo tiempo, con un
+modelo guionado (main.genai_stub) en lugar de Vertex AI y el Service Layer
+simulado (main.sap_mock_server), sobre una base SQLite temporal.
+
+Reporta latencia p50/p95/p99, throughput, errores de bloqueo de SQLite y el
+tiempo por etapa (modelo, cada herramienta, base de datos). Las escrituras que
+hacen las herramientas (QueryCache) cuentan también dentro de "db".
+
+Uso:
+    python load_test_chat.py --users 1 5 10 20 --messages 5
+    python load_test_chat.py --users 10 --model-latency 0.8 --sap-latency 0.02 --output carga.json
+    python load_test_chat.py --users 10 --no-router   # sin el enrutador de preguntas frecuentes
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Agregar el directorio raíz al path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOOL_NAMES = [
+    'query_sap_service_layer', 'get_sap_metadata', 'get_cached_queries',
+    'get_top_selling_products', 'get_top_customers', 'get_sales_person_performance',
+    'get_sales_leaderboard', 'compare_periods', 'lookup_master_data', 'find_code_by_name',
+    'query_sap_service_layer_many', 'create_export_link', 'get_stock', 'create_table_view',
+]
+
+QUESTIONS = [
+    "dame los 5 productos más vendidos de enero",
+    "top 5 clientes de enero",
+    "desempeño del vendedor 1 en enero",
+    "artículos con stock",
+    "hola",
+]
+
+
+def percentile(values, pct):
+    """Percentil por rango más cercano (values no vacío)"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class StageRecorder:
+    """Acumula tiempos por etapa para la petición en curso de cada hilo"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.requests = []
+
+    def begin(self):
+        self._local.stages = defaultdict(float)
+
+    def add(self, stage, seconds):
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[stage] += seconds
+
+    def end(self, total):
+        stages = dict(self._local.stages)
+        stages['otros'] = max(0.0, total - sum(stages.values()))
+        with self._lock:
+            self.requests.append(stages)
+        self._local.stages = None
+
+    def timed(self, stage, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - start)
+
+
+def run_level(users, args, recorder):
+    """Ejecutar una ronda con `users` usuarios concurrentes"""
+    from django.db import connection
+    from django.test import Client
+
+    outcomes = []
+    outcomes_lock = threading.Lock()
+
+    def simulate_user(user_index):
+        client = Client(SERVER_NAME='127.0.0.1')
+        try:
+            for i in range(args.messages):
+                question = QUESTIONS[(user_index + i) % len(QUESTIONS)]
+                recorder.begin()
+                start = time.perf_counter()
+                with connection.execute_wrapper(recorder.db_wrapper):
+                    response = client.post('/send/', data=json.dumps({"message": question}),
+                                           content_type='application/json')
+                elapsed = time.perf_counter() - start
+                recorder.end(elapsed)
+                try:
+                    error = response.json().get('error', '')
+                except ValueError:
+                    error = response.content[:200].decode('utf-8', 'replace')
+                with outcomes_lock:
+                    outcomes.append({
+                        "latency": elapsed,
+                        "ok": response.status_code == 200 and not error,
+                        "locked": 'database is locked' in (error or ''),
+                    })
+                if args.think_time:
+                    time.sleep(args.think_time)
+        finally:
+            connection.close()
+
+    recorder.requests = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(simulate_user, range(users)))
+    wall = time.perf_counter() - start
+
+    latencies = [o['latency'] for o in outcomes]
+    stage_totals = defaultdict(list)
+    for stages in recorder.requests:
+        for stage, seconds in stages.items():
+            stage_totals[stage].append(seconds)
+
+    return {
+        "users": users,
+        "requests": len(outcomes),
+        "ok": sum(o['ok'] for o in outcomes),
+        "errors": sum(not o['ok'] for o in outcomes),
+        "sqlite_lock_errors": sum(o['locked'] for o in outcomes),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(outcomes) / wall, 2) if wall else None,
+        "latency": {
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+            "max": round(max(latencies), 4),
+        },
+        "stages": {
+            stage: {
+                "mean": round(sum(values) / len(outcomes), 4),
+                "p95": round(percentile(values, 95), 4),
+            }
+            for stage, values in sorted(stage_totals.items())
+        },
+    }
+
+
+def print_level(result):
+    latency = result['latency']
+    print(f"\n👥 {result['users']} usuarios concurrentes — {result['requests']} peticiones en {result['wall_seconds']}s")
+    print(f"   Throughput: {result['throughput_rps']} req/s | OK: {result['ok']} | "
+          f"Errores: {result['errors']} | Bloqueos SQLite: {result['sqlite_lock_errors']}")
+    print(f"   Latencia: p50 {latency['p50']}s | p95 {latency['p95']}s | p99 {latency['p99']}s | máx {latency['max']}s")
+    print("   Tiempo por etapa (promedio por petición / p95):")
+    for stage, values in result['stages'].items():
+        print(f"      {stage:<45} {values['mean']:>8}s {values['p95']:>8}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de /send/ con modelo guionado y SAP simulado")
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 5, 10], help="Niveles de concurrencia")
+    parser.add_argument('--messages', type=int, default=5, help="Mensajes por usuario")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Pausa entre mensajes de un usuario (s)")
+    parser.add_argument('--model-latency', type=float, default=0.3, help="Latencia simulada de cada llamada al modelo (s)")
+    parser.add_argument('--model-jitter', type=float, default=0.1)
+    parser.add_argument('--sap-latency', type=float, default=0.01, help="Latencia simulada por petición a SAP (s)")
+    parser.add_argument('--documents', type=int, default=2000, help="Facturas del Service Layer simulado")
+    parser.add_argument('--db', default=None, help="Base SQLite a usar (default: temporal)")
+    parser.add_argument('--output', default=None, help="Guardar resultados en JSON")
+    parser.add_argument('--no-router', action='store_true',
+                        help="Enviar todas las preguntas al modelo (INTENT_ROUTER=0)")
+    parser.add_argument('--no-answer-cache', action='store_true',
+                        help="No reutilizar respuestas de preguntas repetidas (ANSWER_CACHE_MAX_ENTRIES=0)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='chat_load_')
+    os.environ['SQLITE_PATH'] = args.db or os.path.join(workdir, 'load.sqlite3')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Damasco.settings')
+    if args.no_router:
+        os.environ['INTENT_ROUTER'] = '0'
+    if args.no_answer_cache:
+        os.environ['ANSWER_CACHE_MAX_ENTRIES'] = '0'
+
+    from main.sap_mock_server import MockDataset, spawn_mock_server
+    config_path = os.path.join(workdir, 'sap_config.json')
+    server = spawn_mock_server(config_path, documents=args.documents, latency=args.sap_latency, days=31)
+    os.environ['SAP_CONFIG_PATH'] = config_path
+    date_from, date_to = MockDataset(documents=args.documents, days=31).date_range()
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from main import views
+    from main.genai_stub import StubGenAIClient
+
+    call_command('migrate', verbosity=0)
+
+    recorder = StageRecorder()
+    stub = StubGenAIClient(latency=args.model_latency, jitter=args.model_jitter,
+                           date_from=date_from, date_to=date_to,
+                           on_call=lambda model, seconds: recorder.add('modelo', seconds))
+    views.configure_gemini = lambda: stub
+    for name in TOOL_NAMES:
+        setattr(views, name, recorder.timed(f"herramienta:{name}", getattr(views, name)))
+
+    print("=" * 60)
+    print("PRUEBA DE CARGA /send/ (modelo guionado + SAP simulado)")
+    print("=" * 60)
+    print(f"   Base SQLite: {os.environ['SQLITE_PATH']}")
+
+    results = []
+    try:
+        for users in args.users:
+            # Los prints de las vistas no deben competir con la medición
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_level(users, args, recorder)
+            print_level(result)
+            results.append(result)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Resultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
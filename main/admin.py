@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import ChatMessage
+from django.utils.html import format_html
+from .models import ChatMessage, ProfilingSettings, RequestProfile
 
 # Register your models here.
 
@@ -13,3 +14,51 @@ class ChatMessageAdmin(admin.ModelAdmin):
     def message_preview(self, obj):
         return obj.message[:100] + '...' if len(obj.message) > 100 else obj.message
     message_preview.short_description = 'Mensaje'
+
+
+@admin.register(ProfilingSettings)
+class ProfilingSettingsAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'enabled', 'updated_at']
+    list_editable = ['enabled']
+    list_display_links = ['__str__']
+    
+    def changelist_view(self, request, extra_context=None):
+        # Garantizar que exista la fila única para poder activarla desde la lista
+        ProfilingSettings.load()
+        return super().changelist_view(request, extra_context)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['request_id', 'timestamp', 'duration_ms', 'peak_memory_kb', 'status_code', 'trigger', 'message_preview']
+    list_filter = ['trigger', 'status_code', 'timestamp']
+    search_fields = ['request_id', 'message']
+    date_hierarchy = 'timestamp'
+    fields = ['request_id', 'timestamp', 'path', 'message', 'trigger', 'status_code', 'duration_ms',
+              'peak_memory_kb', 'profile_stats_pre', 'tool_stats_pre', 'top_allocations_pre']
+    readonly_fields = fields
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def message_preview(self, obj):
+        return obj.message[:80] + '...' if len(obj.message) > 80 else obj.message
+    message_preview.short_description = 'Mensaje'
+    
+    def profile_stats_pre(self, obj):
+        return format_html('<pre style="font-size: 12px">{}</pre>', obj.profile_stats)
+    profile_stats_pre.short_description = 'Funciones (tiempo acumulado)'
+    
+    def tool_stats_pre(self, obj):
+        return format_html('<pre style="font-size: 12px">{}</pre>', obj.tool_stats)
+    tool_stats_pre.short_description = 'Herramientas SAP'
+    
+    def top_allocations_pre(self, obj):
+        return format_html('<pre style="font-size: 12px">{}</pre>', obj.top_allocations)
+    top_allocations_pre.short_description = 'Principales asignaciones de memoria'
@@ -0,0 +1,124 @@
+"""
+Caché de respuestas completas del chat
+
+Los usuarios repiten mucho las mismas preguntas ("ventas de ayer", "top 5
+productos de enero"). Cada respuesta se guarda con una clave formada por:
+- la pregunta normalizada (minúsculas, sin acentos ni signos) con la
+  expresión de fecha reemplazada por el rango absoluto que representa, así
+  "top 5 productos de enero" y "Top 5 productos del 1 al 31 de enero"
+  comparten entrada;
+- un token de frescura: los períodos cerrados (terminan antes de hoy) no
+  cambian, los que incluyen hoy dependen del día y viven muy poco.
+
+Sólo se cachean preguntas con un rango de fechas reconocible y que no sean
+una continuación explícita ("y en febrero?", "lo mismo para..."). Si el
+enrutador no entiende la pregunta por sí sola, la respuesta del modelo
+puede depender de la conversación ("el cliente que te dije"): la clave
+incluye entonces un resumen (hash) de los mensajes recientes. Los
+vencimientos siguen a la caché de documentos: una respuesta no puede ser más
+fresca que los documentos con los que se calculó.
+
+Variables de entorno:
+    ANSWER_CACHE_MAX_ENTRIES   respuestas en memoria (default 1000, 0 la desactiva)
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import document_cache, intent_router, metrics
+
+MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 1000))
+
+# Preguntas que se apoyan en la respuesta anterior
+_FOLLOW_UP = re.compile(
+    r'^(?:y|e|tambien|ahora|entonces|pero|ok|vale)\b|'
+    r'\b(?:lo mismo|mismo periodo|eso|esos|esas|ese|esa|anterior(?:es)?|arriba|ultimo que)\b'
+)
+# Preposiciones que quedan colgando al quitar la expresión de fecha
+_DANGLING = re.compile(r'\s*\b(?:de|del|en|el|la|los|las|desde|durante|para)(?:\s+(?:el|la|los|las))?\s*$')
+
+_entries: 'OrderedDict[Tuple[str, str], Tuple[float, str, List[Dict[str, Any]]]]' = OrderedDict()
+_lock = threading.Lock()
+_generation = 0
+
+
+def _clean(text: str) -> str:
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text).split())
+
+
+def question_key(message: str, today: Optional[date] = None,
+                 context: Optional[Sequence[str]] = None) -> Optional[Tuple[str, str, float]]:
+    """
+    Clave de una pregunta
+
+    Args:
+        context: mensajes recientes de la conversación; None si la pregunta
+            se entiende sola (el enrutador la reconoció)
+
+    Returns:
+        (pregunta normalizada, token de frescura, segundos de vida) o None si
+        la pregunta no se puede cachear
+    """
+    if MAX_ENTRIES <= 0:
+        return None
+    today = today or date.today()
+    text = intent_router.normalize(message)
+    if _FOLLOW_UP.search(_clean(text)):
+        return None
+    found = intent_router.find_date_range(text, today)
+    if found is None:
+        return None
+    start, end, (begin, finish) = found
+    before = _DANGLING.sub('', text[:begin])
+    key = ' '.join(filter(None, (_clean(before), f"[{start.isoformat()}..{end.isoformat()}]", _clean(text[finish:]))))
+    if context is not None:
+        digest = hashlib.sha1('\x00'.join(context).encode('utf-8')).hexdigest()[:16]
+        key = f"{key} #contexto:{digest}"
+    if end < today:
+        return key, f"cerrado:{_generation}", document_cache.PAST_TTL
+    return key, f"{today.isoformat()}:{_generation}", document_cache.TODAY_TTL
+
+
+def get(key: Optional[Tuple[str, str, float]]) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+    """Respuesta cacheada (texto, query_logs) para la clave de question_key(), o None"""
+    if key is None:
+        return None
+    with _lock:
+        entry = _entries.get(key[:2])
+        if entry is not None and entry[0] < time.monotonic():
+            del _entries[key[:2]]
+            entry = None
+        if entry is not None:
+            _entries.move_to_end(key[:2])
+    metrics.ANSWER_CACHE.inc(result='hit' if entry else 'miss')
+    return (entry[1], entry[2]) if entry else None
+
+
+def put(key: Optional[Tuple[str, str, float]], response: str, query_logs: List[Dict[str, Any]]):
+    """
+    Guardar una respuesta con la clave calculada al recibir la pregunta
+
+    Si la caché se vació mientras se respondía, la respuesta se descarta.
+    """
+    if key is None:
+        return
+    with _lock:
+        if not key[1].endswith(f":{_generation}"):
+            return
+        _entries.pop(key[:2], None)
+        _entries[key[:2]] = (time.monotonic() + key[2], response, list(query_logs))
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def clear():
+    """Olvidar todas las respuestas (también las que se están calculando)"""
+    global _generation
+    with _lock:
+        _entries.clear()
+        _generation += 1
@@ -0,0 +1,189 @@
+"""
+Capa de codificación JSON
+
+Usa orjson o msgspec cuando están instalados y la librería estándar como
+respaldo (se puede forzar con JSON_BACKEND=json|orjson|msgspec). Todas las
+salidas son UTF-8 sin escapar (equivalente a ensure_ascii=False) y compactas
+salvo que se pida pretty=True: los resultados de herramientas los consume el
+modelo, no una persona.
+
+También incluye:
+- parse_page(): decodifica una página de Service Layer extrayendo sólo los
+  campos necesarios de cada registro de value[], registro por registro, sin
+  materializar la página completa con todos sus campos.
+- RawJSON / CodecJSONEncoder / CodecJSONDecoder: permiten que un JSONField
+  guarde un resultado ya serializado sin codificarlo de nuevo.
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+BACKEND = 'json'
+_requested = os.environ.get('JSON_BACKEND', '').lower()
+
+if _requested in ('', 'orjson'):
+    try:
+        import orjson
+        BACKEND = 'orjson'
+    except ImportError:
+        pass
+if BACKEND == 'json' and _requested in ('', 'msgspec'):
+    try:
+        import msgspec
+        BACKEND = 'msgspec'
+    except ImportError:
+        pass
+
+_stdlib_decoder = json.JSONDecoder()
+
+# Excepciones de decodificación de cualquier backend (para los except)
+DecodeError = (ValueError, msgspec.DecodeError) if BACKEND == 'msgspec' else ValueError
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """Decodificar JSON desde bytes o str"""
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    if BACKEND == 'msgspec':
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any, pretty: bool = False) -> bytes:
+    """Codificar a JSON UTF-8 (bytes)"""
+    if BACKEND == 'orjson':
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option, default=str)
+    if BACKEND == 'msgspec':
+        encoded = msgspec.json.encode(obj, enc_hook=str)
+        return msgspec.json.format(encoded, indent=2) if pretty else encoded
+    return dumps(obj, pretty).encode('utf-8')
+
+
+def dumps(obj: Any, pretty: bool = False) -> str:
+    """Codificar a JSON (str); compacto por defecto"""
+    if BACKEND != 'json':
+        return dumps_bytes(obj, pretty).decode('utf-8')
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, default=str)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+# --- Proyección de registros ---
+
+# Especificación de campos: {"Campo": None} copia el valor; {"DocumentLines": ("ItemCode", ...)}
+# proyecta cada elemento de una colección anidada.
+FieldSpec = Dict[str, Optional[Tuple[str, ...]]]
+
+
+def project(record: Dict[str, Any], fields: FieldSpec) -> Dict[str, Any]:
+    """Quedarse sólo con los campos indicados de un registro"""
+    projected = {}
+    for name, subfields in fields.items():
+        if name not in record:
+            continue
+        value = record[name]
+        if subfields is not None and isinstance(value, list):
+            value = [{k: item[k] for k in subfields if k in item} for item in value]
+        projected[name] = value
+    return projected
+
+
+def _skip_ws(text: str, pos: int) -> int:
+    while pos < len(text) and text[pos] in ' \t\n\r':
+        pos += 1
+    return pos
+
+
+def _iter_stdlib_page(text: str, fields: FieldSpec) -> Tuple[list, Dict[str, Any]]:
+    """Recorrer el objeto de nivel superior decodificando value[] elemento por elemento"""
+    raw_decode = _stdlib_decoder.raw_decode
+    records = []
+    extra = {}
+    pos = _skip_ws(text, 0)
+    if text[pos:pos + 1] != '{':
+        raise ValueError("Se esperaba un objeto JSON")
+    pos = _skip_ws(text, pos + 1)
+    while pos < len(text) and text[pos] != '}':
+        key, pos = raw_decode(text, pos)
+        pos = _skip_ws(text, pos)
+        if text[pos] != ':':
+            raise ValueError("JSON inválido: se esperaba ':'")
+        pos = _skip_ws(text, pos + 1)
+        if key == 'value' and text[pos] == '[':
+            pos = _skip_ws(text, pos + 1)
+            while text[pos] != ']':
+                record, pos = raw_decode(text, pos)
+                records.append(project(record, fields))
+                pos = _skip_ws(text, pos)
+                if text[pos] == ',':
+                    pos = _skip_ws(text, pos + 1)
+            pos += 1
+        else:
+            extra[key], pos = raw_decode(text, pos)
+        pos = _skip_ws(text, pos)
+        if text[pos] == ',':
+            pos = _skip_ws(text, pos + 1)
+    return records, extra
+
+
+def parse_page(raw: Union[bytes, str], fields: Optional[FieldSpec] = None) -> Dict[str, Any]:
+    """
+    Decodificar una página de Service Layer ({"value": [...], "@odata.nextLink": ...})
+
+    Con fields, cada registro de value[] se proyecta a esos campos. Con la
+    librería estándar se decodifica registro por registro para no tener en
+    memoria la página completa con todos sus campos; con orjson/msgspec es más
+    rápido decodificar de una vez y proyectar después.
+    """
+    if not fields:
+        return loads(raw)
+    if BACKEND != 'json':
+        data = loads(raw)
+        data['value'] = [project(record, fields) for record in data.get('value', [])]
+        return data
+    text = raw.decode('utf-8') if isinstance(raw, (bytes, bytearray)) else raw
+    records, extra = _iter_stdlib_page(text, fields)
+    extra['value'] = records
+    return extra
+
+
+def fields_from_select(select: Optional[str], nested: Optional[Dict[str, Iterable[str]]] = None) -> Optional[FieldSpec]:
+    """Construir una especificación de campos a partir de un $select y proyecciones anidadas"""
+    if not select and not nested:
+        return None
+    spec: FieldSpec = {}
+    for name in (select or '').split(','):
+        name = name.strip()
+        if name:
+            spec[name] = None
+    for name, subfields in (nested or {}).items():
+        spec[name] = tuple(subfields)
+    return spec
+
+
+# --- Integración con JSONField ---
+
+class RawJSON:
+    """JSON ya serializado: CodecJSONEncoder lo guarda tal cual"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class CodecJSONEncoder(json.JSONEncoder):
+    """Encoder para JSONField que usa el backend rápido y respeta RawJSON"""
+
+    def encode(self, o):
+        if isinstance(o, RawJSON):
+            return o.text
+        return dumps(o)
+
+
+class CodecJSONDecoder(json.JSONDecoder):
+    """Decoder para JSONField que usa el backend rápido"""
+
+    def decode(self, s, *args, **kwargs):
+        return loads(s)
@@ -0,0 +1,210 @@
+"""
+Control adaptativo de concurrencia hacia el Service Layer (AIMD)
+
+Todas las peticiones GET al Service Layer del proceso pasan por un limitador
+que ajusta cuántas pueden estar en vuelo a la vez:
+
+- Aumento aditivo: mientras la latencia se mantenga cerca de la mínima
+  observada y el límite se esté usando, sube en 1 por cada "ronda" completa
+  (1/límite por respuesta). La latencia de referencia es de cada tipo de
+  petición (endpoint): una búsqueda de /SalesPersons no fija la vara con la
+  que se mide una página completa de /Invoices.
+- Disminución multiplicativa: ante 429/503 o una latencia mayor que
+  LATENCY_TOLERANCE veces la de referencia, el límite se multiplica por
+  BACKOFF (como mucho una vez por intervalo, para no desplomarlo con las
+  respuestas que ya estaban en vuelo).
+
+Opcionalmente el límite se comparte entre procesos (varios workers de
+gunicorn, la prueba de carga...) con archivos de bloqueo en
+SAP_CONCURRENCY_LOCK_DIR: cada petición en vuelo tiene bloqueado uno de
+SAP_GLOBAL_CONCURRENCY archivos.
+
+Variables de entorno:
+    SAP_MAX_CONCURRENCY       límite máximo por proceso (default 8)
+    SAP_INITIAL_CONCURRENCY   límite inicial (default 2)
+    SAP_CONCURRENCY_LOCK_DIR  directorio de los archivos de bloqueo (opcional)
+    SAP_GLOBAL_CONCURRENCY    peticiones en vuelo entre todos los procesos
+                              (default SAP_MAX_CONCURRENCY)
+"""
+import contextlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from . import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+BACKOFF = 0.5
+LATENCY_TOLERANCE = 3.0
+BASELINE_DRIFT = 0.01
+MIN_DECREASE_INTERVAL = 1.0
+OVERLOAD_STATUS = (429, 503)
+
+
+class _FileSlots:
+    """Semáforo entre procesos con N archivos de bloqueo"""
+
+    def __init__(self, directory: str, slots: int):
+        os.makedirs(directory, exist_ok=True)
+        self.paths = [os.path.join(directory, f"sap_slot_{i}.lock") for i in range(slots)]
+
+    @staticmethod
+    def _try_lock(fd) -> bool:
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _unlock(fd):
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def acquire(self) -> int:
+        delay = 0.005
+        while True:
+            for path in self.paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                if self._try_lock(fd):
+                    return fd
+                os.close(fd)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def release(self, fd: int):
+        try:
+            self._unlock(fd)
+        finally:
+            os.close(fd)
+
+
+class Slot:
+    """Una petición en vuelo; quien la usa marca overloaded si el servidor lo indicó"""
+
+    __slots__ = ('start', 'overloaded')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.overloaded = False
+
+
+class AIMDLimiter:
+    """Límite de peticiones en vuelo con aumento aditivo y disminución multiplicativa"""
+
+    def __init__(self, name: str, initial: int = 2, min_limit: int = 1, max_limit: int = 8,
+                 file_slots: Optional[_FileSlots] = None):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.in_flight = 0
+        self.baselines: Dict[str, float] = {}
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._file_slots = file_slots
+        self._publish()
+
+    def _publish(self):
+        metrics.SAP_CONCURRENCY_LIMIT.set(self.limit, limiter=self.name)
+        metrics.SAP_IN_FLIGHT.set(self.in_flight, limiter=self.name)
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            self._publish()
+
+    def release(self, latency: float, overloaded: bool = False, key: str = ''):
+        """Liberar un lugar; key agrupa las peticiones comparables (ej: el endpoint)"""
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            baseline = self.baselines.get(key)
+            if overloaded:
+                self._decrease('overload', baseline)
+            else:
+                if baseline is None or latency < baseline:
+                    baseline = latency
+                else:
+                    # La referencia sube despacio para adaptarse a cambios de carga reales
+                    baseline += (latency - baseline) * BASELINE_DRIFT
+                self.baselines[key] = baseline
+                if latency > baseline * LATENCY_TOLERANCE:
+                    self._decrease('latency', baseline)
+                elif saturated:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._publish()
+            self._cond.notify_all()
+
+    def _decrease(self, reason: str, baseline: Optional[float]):
+        now = time.monotonic()
+        interval = max(MIN_DECREASE_INTERVAL, 2 * (baseline or 0))
+        if now - self._last_decrease < interval:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * BACKOFF)
+        metrics.SAP_CONCURRENCY_DECREASES.inc(limiter=self.name, reason=reason)
+
+    @contextlib.contextmanager
+    def slot(self, key: str = ''):
+        """Ocupar un lugar durante una petición (bloquea hasta que haya uno libre)"""
+        self.acquire()
+        fd = self._file_slots.acquire() if self._file_slots else None
+        slot = Slot()
+        try:
+            yield slot
+        except Exception:
+            # Timeouts y errores de conexión también indican un servidor saturado
+            slot.overloaded = True
+            raise
+        finally:
+            latency = time.perf_counter() - slot.start
+            if fd is not None:
+                self._file_slots.release(fd)
+            self.release(latency, slot.overloaded, key)
+
+
+_limiters: Dict[str, AIMDLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(base_url: str) -> AIMDLimiter:
+    """Limitador compartido por todas las conexiones del proceso a un mismo Service Layer"""
+    with _limiters_lock:
+        limiter = _limiters.get(base_url)
+        if limiter is None:
+            max_limit = int(os.environ.get('SAP_MAX_CONCURRENCY', 8))
+            lock_dir = os.environ.get('SAP_CONCURRENCY_LOCK_DIR')
+            file_slots = None
+            if lock_dir:
+                slots = int(os.environ.get('SAP_GLOBAL_CONCURRENCY', max_limit))
+                file_slots = _FileSlots(lock_dir, slots)
+            limiter = _limiters[base_url] = AIMDLimiter(
+                name=base_url,
+                initial=int(os.environ.get('SAP_INITIAL_CONCURRENCY', 2)),
+                max_limit=max_limit,
+                file_slots=file_slots,
+            )
+        return limiter
+
+
+def retry_delay(response, attempt: int) -> float:
+    """Espera antes de reintentar una respuesta 429/503 (Retry-After si viene en segundos)"""
+    retry_after = response.headers.get('Retry-After', '')
+    if retry_after.isdigit():
+        return min(float(retry_after), 30.0)
+    return min(0.5 * (2 ** attempt), 8.0)
@@ -0,0 +1,275 @@
+"""
+Caché de documentos (facturas y notas de crédito) por día
+
+Las analíticas piden rangos de fechas que se solapan mucho entre una pregunta
+y la siguiente (1-31 de enero, luego 15 de enero-15 de febrero). En lugar de
+cachear cada rango completo, los documentos se guardan en fragmentos de un
+día: un rango nuevo sólo descarga los días que faltan.
+
+- Los días cerrados (anteriores a hoy) viven PAST_TTL segundos; hoy y los
+  días futuros sólo TODAY_TTL, porque todavía pueden recibir documentos.
+- Los días faltantes contiguos se agrupan en tramos de hasta FETCH_CHUNK_DAYS
+  días que se descargan en paralelo (el limitador de concurrencia del
+  Service Layer sigue aplicando).
+- Todos los fragmentos se descargan con el mismo $select (el superconjunto
+  que usan las analíticas), así cualquier analítica puede reutilizarlos.
+- get_documents_for() pide los documentos de un solo vendedor (o cliente):
+  si ningún día del rango está en caché filtra en el servidor en vez de
+  descargar los documentos de todos.
+- Los meses cerrados completos se guardan además en disco como instantáneas
+  columnares (document_snapshot): cuando sus días expiran o en otro worker
+  se leen de ahí sin volver a SAP ni decodificar JSON.
+
+Es una caché por proceso; los documentos que entrega son compartidos y no se
+deben modificar.
+
+Variables de entorno:
+    DOCUMENT_CACHE_PAST_TTL     segundos para días cerrados (default 21600)
+    DOCUMENT_CACHE_TODAY_TTL    segundos para hoy y días futuros (default 60)
+    DOCUMENT_CACHE_MAX_RECORDS  documentos en memoria antes de desalojar (default 500000)
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import codec, document_snapshot, metrics
+
+DOCUMENT_ENDPOINTS = ('/Invoices', '/CreditNotes')
+
+# Campos que necesitan todas las analíticas. Los nombres (CardName,
+# ItemDescription) no se descargan: se resuelven con master_data.
+HEADER_FIELDS = 'DocEntry,DocNum,CardCode,DocDate,DocTotal,SalesPersonCode'
+LINE_FIELDS = ('ItemCode', 'Quantity', 'Price', 'LineTotal')
+# Campos por los que get_documents_for() puede filtrar en el servidor
+FILTER_FIELDS = ('SalesPersonCode', 'CardCode')
+
+PAST_TTL = int(os.environ.get('DOCUMENT_CACHE_PAST_TTL', 6 * 3600))
+TODAY_TTL = int(os.environ.get('DOCUMENT_CACHE_TODAY_TTL', 60))
+MAX_RECORDS = int(os.environ.get('DOCUMENT_CACHE_MAX_RECORDS', 500_000))
+FETCH_CHUNK_DAYS = 7
+FETCH_WORKERS = 4
+
+_ShardKey = Tuple[str, str, date]
+
+
+class _ShardStore:
+    """LRU de fragmentos (base_url, endpoint, día) -> documentos, acotado por cantidad de documentos"""
+
+    def __init__(self, max_records: int):
+        self.max_records = max_records
+        self.records = 0
+        self._shards: 'OrderedDict[_ShardKey, Tuple[float, List[Dict[str, Any]]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: _ShardKey) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._shards.get(key)
+            if entry is None:
+                return None
+            expires, documents = entry
+            if expires < time.monotonic():
+                del self._shards[key]
+                self.records -= len(documents)
+                return None
+            self._shards.move_to_end(key)
+            return documents
+
+    def put(self, key: _ShardKey, documents: List[Dict[str, Any]], ttl: float):
+        with self._lock:
+            previous = self._shards.pop(key, None)
+            if previous is not None:
+                self.records -= len(previous[1])
+            self._shards[key] = (time.monotonic() + ttl, documents)
+            self.records += len(documents)
+            while self.records > self.max_records and len(self._shards) > 1:
+                _, (_, evicted) = self._shards.popitem(last=False)
+                self.records -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._shards.clear()
+            self.records = 0
+
+
+_store = _ShardStore(MAX_RECORDS)
+
+
+def clear():
+    """Vaciar la caché en memoria (las instantáneas en disco se borran con document_snapshot.delete)"""
+    _store.clear()
+
+
+def _cached(sap, endpoint: str, day: date) -> Tuple[Optional[List[Dict[str, Any]]], str]:
+    """Documentos de un día desde memoria ('hit') o desde la instantánea de su mes ('snapshot')"""
+    documents = _store.get((sap.base_url, endpoint, day))
+    if documents is not None:
+        return documents, 'hit'
+    month = document_snapshot.month_of(day)
+    if document_snapshot.is_closed(month):
+        snapshot = document_snapshot.load(sap.base_url, endpoint, month)
+        if snapshot is not None:
+            return snapshot.day(day), 'snapshot'
+    return None, 'miss'
+
+
+def _save_snapshots(sap, endpoint: str, shards: Dict[date, List[Dict[str, Any]]], fetched: List[date]):
+    """Guardar los meses cerrados que quedaron completos con días recién descargados"""
+    for month in sorted({document_snapshot.month_of(day) for day in fetched}):
+        if not document_snapshot.is_closed(month):
+            continue
+        days = document_snapshot.month_days(month)
+        if all(day in shards for day in days):
+            document_snapshot.write(sap.base_url, endpoint, month, [shards[day] for day in days])
+
+
+def _days(date_from: date, date_to: date) -> List[date]:
+    return [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+
+
+def _chunks(missing: List[date]) -> List[Tuple[date, date]]:
+    """Agrupar días faltantes en tramos contiguos de hasta FETCH_CHUNK_DAYS días"""
+    chunks = []
+    for day in missing:
+        if chunks:
+            start, end = chunks[-1]
+            if day == end + timedelta(days=1) and (day - start).days < FETCH_CHUNK_DAYS:
+                chunks[-1] = (start, day)
+                continue
+        chunks.append((day, day))
+    return chunks
+
+
+def _fetch_chunk(sap, endpoint: str, start: date, end: date) -> Dict[str, Any]:
+    return sap.query(
+        endpoint=endpoint,
+        filters=f"DocDate ge '{start.isoformat()}' and DocDate le '{end.isoformat()}'",
+        select=f"{HEADER_FIELDS},DocumentLines",
+        fields=codec.fields_from_select(HEADER_FIELDS, {'DocumentLines': LINE_FIELDS}),
+        top=None
+    )
+
+
+def get_documents(sap, endpoint: str, date_from: str, date_to: str) -> Dict[str, Any]:
+    """
+    Documentos de un endpoint entre dos fechas (inclusive), desde la caché o SAP
+
+    Args:
+        sap: SAPServiceLayer autenticado
+        endpoint: '/Invoices' o '/CreditNotes'
+        date_from, date_to: fechas YYYY-MM-DD
+
+    Returns:
+        Dict con success, data (documentos ordenados por fecha), count y los
+        días que salieron de la caché / de SAP; o success=False y error
+    """
+    try:
+        start = date.fromisoformat(str(date_from)[:10])
+        end = date.fromisoformat(str(date_to)[:10])
+    except ValueError:
+        return {"success": False, "error": f"Rango de fechas inválido: {date_from} - {date_to}", "endpoint": endpoint}
+    if end < start:
+        start, end = end, start
+
+    days = _days(start, end)
+    shards: Dict[date, List[Dict[str, Any]]] = {}
+    missing = []
+    sources = defaultdict(int)
+    for day in days:
+        documents, source = _cached(sap, endpoint, day)
+        sources[source] += 1
+        if documents is None:
+            missing.append(day)
+        else:
+            shards[day] = documents
+    for source in ('hit', 'snapshot', 'miss'):
+        metrics.DOCUMENT_CACHE_SHARDS.inc(sources[source], endpoint=endpoint, result=source)
+
+    if missing:
+        chunks = _chunks(missing)
+        print(f"   🗂️ {endpoint}: {len(shards)} días en caché, descargando {len(missing)} en {len(chunks)} tramos")
+        if len(chunks) == 1:
+            results = [_fetch_chunk(sap, endpoint, *chunks[0])]
+        else:
+            # Cada hilo copia el contexto para que las métricas sigan asociadas a la petición
+            with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(chunks))) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, _fetch_chunk, sap, endpoint, chunk_start, chunk_end)
+                    for chunk_start, chunk_end in chunks
+                ]
+                results = [future.result() for future in futures]
+
+        for result in results:
+            if not result.get('success'):
+                return {"success": False, "error": result.get('error'), "endpoint": endpoint}
+
+        by_day = defaultdict(list)
+        for result in results:
+            for document in result.get('data', []):
+                by_day[str(document.get('DocDate', ''))[:10]].append(document)
+
+        today = date.today()
+        for day in missing:
+            documents = by_day.get(day.isoformat(), [])
+            ttl = PAST_TTL if day < today else TODAY_TTL
+            _store.put((sap.base_url, endpoint, day), documents, ttl)
+            shards[day] = documents
+
+        if document_snapshot.enabled():
+            _save_snapshots(sap, endpoint, shards, missing)
+
+    data = [document for day in days for document in shards[day]]
+    return {
+        "success": True,
+        "data": data,
+        "count": len(data),
+        "endpoint": endpoint,
+        "days_cached": len(days) - len(missing),
+        "days_snapshot": sources['snapshot'],
+        "days_fetched": len(missing),
+    }
+
+
+def get_documents_for(sap, endpoint: str, date_from: str, date_to: str, field: str, value: Any) -> Dict[str, Any]:
+    """
+    Documentos entre dos fechas cuyo `field` vale `value` (ej: SalesPersonCode)
+
+    Si el rango ya tiene días en caché se completa como en get_documents() y se
+    filtra localmente. Con la caché fría del rango se filtra en el servidor y
+    el resultado no se cachea: bajar los documentos de todos para usar los de
+    uno solo cuesta más de lo que ahorra en la pregunta siguiente.
+
+    field debe ser uno de FILTER_FIELDS.
+    """
+    from .sap_service_layer import _odata_literal
+
+    if field not in FILTER_FIELDS:
+        return {"success": False, "error": f"No se puede filtrar documentos por {field}", "endpoint": endpoint}
+    try:
+        start = date.fromisoformat(str(date_from)[:10])
+        end = date.fromisoformat(str(date_to)[:10])
+    except ValueError:
+        return get_documents(sap, endpoint, date_from, date_to)
+    if end < start:
+        start, end = end, start
+
+    if any(_cached(sap, endpoint, day)[0] is not None for day in _days(start, end)):
+        result = get_documents(sap, endpoint, date_from, date_to)
+        if result.get('success'):
+            data = [document for document in result['data'] if str(document.get(field)) == str(value)]
+            result = dict(result, data=data, count=len(data))
+        return result
+
+    literal = _odata_literal(value)
+    print(f"   🎯 {endpoint}: sin días en caché, filtrando {field} en el servidor")
+    return sap.query(
+        endpoint=endpoint,
+        filters=f"DocDate ge '{start.isoformat()}' and DocDate le '{end.isoformat()}' and {field} eq {literal}",
+        select=f"{HEADER_FIELDS},DocumentLines",
+        fields=codec.fields_from_select(HEADER_FIELDS, {'DocumentLines': LINE_FIELDS}),
+        top=None
+    )
@@ -0,0 +1,329 @@
+"""
+Instantáneas columnares en disco de los meses cerrados
+
+Un mes cerrado ya no cambia, pero cada proceso lo vuelve a descargar y a
+decodificar desde JSON cuando su caché de documentos expira. Cuando
+document_cache completa un mes cerrado lo escribe aquí en un archivo por
+(Service Layer, endpoint, mes) con columnas de ancho fijo:
+
+    cabecera   magic, orden de bytes, documentos, líneas, textos
+    int64      DocEntry, DocNum, SalesPersonCode
+    float64    DocTotal, Quantity, Price, LineTotal
+    uint32     CardCode, DocDate (índices en la tabla de textos),
+               inicio de las líneas de cada documento, inicio de cada día,
+               ItemCode, desplazamientos de la tabla de textos
+    utf-8      tabla de textos
+
+El archivo se abre con mmap y cada columna es un memoryview sobre él: leer
+un campo es indexar la columna, sin decodificar JSON ni copiar el archivo a
+la memoria del proceso. Todos los workers comparten las mismas páginas de la
+caché del sistema operativo.
+
+Los documentos se entregan como vistas de sólo lectura con la misma interfaz
+(Mapping) que los dicts de document_cache, así las analíticas no cambian.
+
+Un archivo reemplazado o borrado (write, delete, o desde otro worker) se
+detecta en load() por su inode y fecha de modificación.
+
+No se usa numpy ni pyarrow (no son dependencias del proyecto): el formato es
+propio y se escribe con array.
+
+Variables de entorno:
+    DOCUMENT_SNAPSHOT_DIR          carpeta de las instantáneas (default
+                                   snapshots/ en la raíz; vacío las desactiva)
+    DOCUMENT_SNAPSHOT_GRACE_DAYS   días después de fin de mes antes de
+                                   considerarlo cerrado (default 7)
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from collections.abc import Mapping
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+SNAPSHOT_DIR = os.environ.get(
+    'DOCUMENT_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'snapshots'),
+)
+GRACE_DAYS = int(os.environ.get('DOCUMENT_SNAPSHOT_GRACE_DAYS', 7))
+
+_MAGIC = b'DOCSNAP1'
+_HEADER = struct.Struct('<8sB3xIII8x')  # 32 bytes
+_BYTE_ORDER = 1 if sys.byteorder == 'little' else 0
+_NO_TEXT = 0xFFFFFFFF
+_NO_INT = -(2 ** 63)
+_DAYS = 32  # inicio de cada día del mes + fin
+
+# (nombre, tipo de array, cantidad: 'docs', 'docs+1', 'lines', 'days', 'texts+1')
+_COLUMNS = (
+    ('DocEntry', 'q', 'docs'),
+    ('DocNum', 'q', 'docs'),
+    ('SalesPersonCode', 'q', 'docs'),
+    ('DocTotal', 'd', 'docs'),
+    ('Quantity', 'd', 'lines'),
+    ('Price', 'd', 'lines'),
+    ('LineTotal', 'd', 'lines'),
+    ('CardCode', 'I', 'docs'),
+    ('DocDate', 'I', 'docs'),
+    ('line_start', 'I', 'docs+1'),
+    ('day_start', 'I', 'days'),
+    ('ItemCode', 'I', 'lines'),
+    ('text_start', 'I', 'texts+1'),
+)
+_INT_FIELDS = ('DocEntry', 'DocNum', 'SalesPersonCode')
+_TEXT_FIELDS = ('CardCode', 'DocDate')
+# Los mismos campos que descarga document_cache
+HEADER_FIELDS = ('DocEntry', 'DocNum', 'CardCode', 'DocDate', 'DocTotal', 'SalesPersonCode')
+LINE_FIELDS = ('ItemCode', 'Quantity', 'Price', 'LineTotal')
+
+
+def enabled() -> bool:
+    return bool(SNAPSHOT_DIR)
+
+
+def month_of(day: date) -> date:
+    return day.replace(day=1)
+
+
+def month_days(month: date) -> List[date]:
+    following = (month + timedelta(days=32)).replace(day=1)
+    return [month + timedelta(days=i) for i in range((following - month).days)]
+
+
+def is_closed(month: date, today: Optional[date] = None) -> bool:
+    """El mes terminó hace más de GRACE_DAYS días"""
+    last_day = month_days(month)[-1]
+    return last_day + timedelta(days=GRACE_DAYS) < (today or date.today())
+
+
+def _path(base_url: str, endpoint: str, month: date) -> str:
+    server = hashlib.sha1(base_url.encode('utf-8')).hexdigest()[:10]
+    return os.path.join(SNAPSHOT_DIR, f"{server}_{endpoint.strip('/')}_{month:%Y-%m}.snap")
+
+
+def _counts(docs: int, lines: int, texts: int) -> Dict[str, int]:
+    return {'docs': docs, 'docs+1': docs + 1, 'lines': lines, 'days': _DAYS, 'texts+1': texts + 1}
+
+
+class _Snapshot:
+    """Columnas de un archivo mapeado en memoria"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        magic, byte_order, docs, lines, texts = _HEADER.unpack_from(view)
+        if magic != _MAGIC or byte_order != _BYTE_ORDER:
+            raise ValueError(f"Instantánea con formato desconocido: {path}")
+        counts = _counts(docs, lines, texts)
+        self.columns: Dict[str, memoryview] = {}
+        offset = _HEADER.size
+        for name, typecode, count in _COLUMNS:
+            size = array(typecode).itemsize * counts[count]
+            self.columns[name] = view[offset:offset + size].cast(typecode)
+            offset += size
+        text_start = self.columns['text_start']
+        blob = view[offset:]
+        if len(blob) < text_start[texts]:
+            raise ValueError(f"Instantánea truncada: {path}")
+        # La tabla de textos (códigos y fechas distintos) es chica: se decodifica una vez
+        self.texts = [str(blob[text_start[i]:text_start[i + 1]], 'utf-8') for i in range(texts)]
+        self.docs = docs
+
+    def text(self, index: int) -> Optional[str]:
+        return None if index == _NO_TEXT else self.texts[index]
+
+    def day(self, day: date) -> List['DocumentView']:
+        day_start = self.columns['day_start']
+        return [DocumentView(self, i) for i in range(day_start[day.day - 1], day_start[day.day])]
+
+
+class _LineView(Mapping):
+    """Línea de documento de una instantánea (sólo lectura)"""
+
+    __slots__ = ('_snapshot', '_index')
+
+    def __init__(self, snapshot: _Snapshot, index: int):
+        self._snapshot = snapshot
+        self._index = index
+
+    def __getitem__(self, key):
+        if key not in LINE_FIELDS:
+            raise KeyError(key)
+        value = self._snapshot.columns[key][self._index]
+        if key == 'ItemCode':
+            return self._snapshot.text(value)
+        return None if math.isnan(value) else value
+
+    def __iter__(self):
+        return iter(LINE_FIELDS)
+
+    def __len__(self):
+        return len(LINE_FIELDS)
+
+
+class DocumentView(Mapping):
+    """Documento de una instantánea con la interfaz de los dicts de document_cache"""
+
+    __slots__ = ('_snapshot', '_index')
+
+    def __init__(self, snapshot: _Snapshot, index: int):
+        self._snapshot = snapshot
+        self._index = index
+
+    def __getitem__(self, key):
+        columns = self._snapshot.columns
+        if key == 'DocumentLines':
+            line_start = columns['line_start']
+            return [_LineView(self._snapshot, i) for i in range(line_start[self._index], line_start[self._index + 1])]
+        if key not in HEADER_FIELDS:
+            raise KeyError(key)
+        value = columns[key][self._index]
+        if key in _TEXT_FIELDS:
+            return self._snapshot.text(value)
+        if key in _INT_FIELDS:
+            return None if value == _NO_INT else value
+        return None if math.isnan(value) else value
+
+    def __iter__(self):
+        return iter(HEADER_FIELDS + ('DocumentLines',))
+
+    def __len__(self):
+        return len(HEADER_FIELDS) + 1
+
+
+# ruta -> (identidad del archivo, instantánea o None si es inválida)
+_open: Dict[str, Tuple[Tuple[int, int, int], Optional[_Snapshot]]] = {}
+_open_lock = threading.Lock()
+
+
+def load(base_url: str, endpoint: str, month: date) -> Optional[_Snapshot]:
+    """
+    Instantánea del mes si existe, o None
+
+    Se mapea una vez por proceso; si otro proceso reemplazó o borró el
+    archivo se vuelve a abrir (o se descarta). Las vistas ya entregadas
+    mantienen vivo el mapeo anterior.
+    """
+    if not enabled():
+        return None
+    path = _path(base_url, endpoint, month)
+    with _open_lock:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _open.pop(path, None)
+            return None
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        entry = _open.get(path)
+        if entry is not None and entry[0] == identity:
+            return entry[1]
+        try:
+            snapshot = _Snapshot(path)
+            identity = snapshot.identity
+        except (OSError, ValueError, TypeError, struct.error) as e:
+            print(f"⚠️ Instantánea ignorada ({os.path.basename(path)}): {e}")
+            snapshot = None
+        _open[path] = (identity, snapshot)
+        return snapshot
+
+
+def _encode(days: List[List[Dict[str, Any]]]) -> bytes:
+    columns = {name: array(typecode) for name, typecode, _ in _COLUMNS}
+    texts: Dict[str, int] = {}
+
+    def text(value) -> int:
+        if value is None:
+            return _NO_TEXT
+        return texts.setdefault(str(value), len(texts))
+
+    def number(value) -> float:
+        return math.nan if value is None else float(value)
+
+    columns['day_start'].append(0)
+    for documents in days:
+        for document in documents:
+            for name in _INT_FIELDS:
+                value = document.get(name)
+                columns[name].append(_NO_INT if value is None else int(value))
+            columns['DocTotal'].append(number(document.get('DocTotal')))
+            columns['CardCode'].append(text(document.get('CardCode')))
+            columns['DocDate'].append(text(document.get('DocDate')))
+            columns['line_start'].append(len(columns['ItemCode']))
+            for line in document.get('DocumentLines') or []:
+                columns['ItemCode'].append(text(line.get('ItemCode')))
+                for name in ('Quantity', 'Price', 'LineTotal'):
+                    columns[name].append(number(line.get(name)))
+        columns['day_start'].append(len(columns['DocEntry']))
+    columns['line_start'].append(len(columns['ItemCode']))
+    while len(columns['day_start']) < _DAYS:
+        columns['day_start'].append(len(columns['DocEntry']))
+
+    blob = bytearray()
+    for value in texts:
+        columns['text_start'].append(len(blob))
+        blob += value.encode('utf-8')
+    columns['text_start'].append(len(blob))
+
+    header = _HEADER.pack(_MAGIC, _BYTE_ORDER, len(columns['DocEntry']), len(columns['ItemCode']), len(texts))
+    return header + b''.join(columns[name].tobytes() for name, _, _ in _COLUMNS) + bytes(blob)
+
+
+def write(base_url: str, endpoint: str, month: date, days: List[List[Dict[str, Any]]]) -> bool:
+    """
+    Guardar un mes cerrado completo
+
+    Args:
+        days: documentos de cada día del mes, en orden
+
+    Se escribe en un archivo temporal y se renombra: otro proceso nunca ve
+    un archivo a medio escribir. Si un valor no cabe en el formato (ej: un
+    DocEntry no numérico) no se guarda nada y se sigue usando SAP.
+    """
+    if not enabled():
+        return False
+    path = _path(base_url, endpoint, month)
+    try:
+        data = _encode(days)
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except (OSError, ValueError, TypeError, OverflowError) as e:
+        print(f"⚠️ No se pudo guardar la instantánea de {endpoint} {month:%Y-%m}: {e}")
+        return False
+    with _open_lock:
+        _open.pop(path, None)
+    print(f"💾 Instantánea de {endpoint} {month:%Y-%m} guardada ({len(data) // 1024} KB)")
+    return True
+
+
+def delete(base_url: str, endpoint: str, month: date) -> bool:
+    """
+    Borrar la instantánea de un mes (p.ej. tras corregir documentos de un mes
+    cerrado en SAP); los demás workers lo notan en su próximo load()
+    """
+    if not enabled():
+        return False
+    path = _path(base_url, endpoint, month)
+    with _open_lock:
+        _open.pop(path, None)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+    print(f"🗑️ Instantánea de {endpoint} {month:%Y-%m} borrada")
+    return True
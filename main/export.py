@@ -0,0 +1,232 @@
+"""
+Exportación de resultados grandes a CSV o Parquet
+
+Una lista completa (ej: 20.000 facturas) no cabe en una respuesta del chat.
+La herramienta create_export_link devuelve un enlace firmado con la consulta
+(entidad, filtros, $select) y /export/ la vuelve a ejecutar página por página
+con SAPServiceLayer.iter_pages, escribiendo cada página en la respuesta
+(StreamingHttpResponse) antes de pedir la siguiente: la memoria no depende
+del tamaño del resultado.
+
+Si la sesión ya tiene la misma consulta completa en QueryCache (reciente)
+se exporta desde ahí sin volver a SAP, también página por página.
+
+Parquet requiere pyarrow (opcional, no es dependencia del proyecto); se
+escribe un row group por página.
+
+Variables de entorno:
+    EXPORT_LINK_MAX_AGE   validez en segundos de un enlace (default 3600)
+"""
+import csv
+import os
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.core import signing
+
+from . import codec, metrics, query_reuse
+
+LINK_MAX_AGE = int(os.environ.get('EXPORT_LINK_MAX_AGE', 3600))
+FORMATS = ('csv', 'parquet')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+_SALT = 'main.export'
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def sign(spec: Dict[str, Any]) -> str:
+    """Token firmado (y con vencimiento) para el enlace de exportación"""
+    return signing.dumps(spec, salt=_SALT, compress=True)
+
+
+def load(token: str) -> Dict[str, Any]:
+    """Spec de un token; lanza signing.BadSignature si es inválido o venció"""
+    return signing.loads(token, salt=_SALT, max_age=LINK_MAX_AGE)
+
+
+def _columns(spec: Dict[str, Any], first_page: List[Dict[str, Any]]) -> List[str]:
+    fields = [name.strip() for name in (spec.get('select') or '').split(',') if name.strip()]
+    if fields:
+        return fields
+    return [name for name in first_page[0] if name != 'odata.etag'] if first_page else []
+
+
+def _cell(value):
+    # Valores anidados (ej: DocumentLines) van como JSON en una sola celda
+    if isinstance(value, (dict, list)):
+        return codec.dumps(value)
+    return value
+
+
+def _cached_pages(spec: Dict[str, Any], page_size: int) -> Optional[Iterator[List[Dict[str, Any]]]]:
+    """Páginas de una consulta idéntica ya guardada en QueryCache, o None"""
+    from django.db import connection
+
+    # json_each recorre el arreglo "data" dentro de SQLite: a Python sólo llega una página a la vez
+    if connection.vendor != 'sqlite' or not spec.get('session_id'):
+        return None
+    row_id = query_reuse.find_complete(spec['session_id'], spec['entity'], spec.get('filters'), spec.get('select'))
+    if row_id is None:
+        return None
+    print(f"♻️ Exportando desde la consulta #{row_id}")
+
+    def pages():
+        from main.models import QueryCache
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT item.value FROM {QueryCache._meta.db_table} AS query, "
+                f"json_each(query.result_data, '$.data') AS item WHERE query.id = %s ORDER BY item.key",
+                [row_id],
+            )
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    break
+                yield [codec.loads(value) for value, in rows]
+
+    return pages()
+
+
+class _Echo:
+    """Destino de csv.writer que devuelve la línea en vez de guardarla"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_chunks(spec: Dict[str, Any], pages: Iterator[List[Dict[str, Any]]]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    columns = None
+    for page in pages:
+        if columns is None:
+            columns = _columns(spec, page)
+            # BOM para que Excel abra el archivo como UTF-8
+            yield '\ufeff' + writer.writerow(columns)
+        yield ''.join(writer.writerow([_cell(record.get(name)) for name in columns]) for record in page)
+        metrics.EXPORT_ROWS.inc(len(page), format='csv')
+    if columns is None:
+        yield '\ufeff' + writer.writerow(_columns(spec, []))
+
+
+class _ChunkSink:
+    """Archivo de sólo escritura que acumula lo escrito hasta drain()"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_chunks(spec: Dict[str, Any], pages: Iterator[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    writer = None
+    columns = None
+    try:
+        for page in pages:
+            if columns is None:
+                columns = _columns(spec, page)
+            rows = [{name: _cell(record.get(name)) for name in columns} for record in page]
+            if writer is None:
+                # Esquema de la primera página; columnas sin valores quedan como texto
+                schema = pa.Table.from_pylist(rows).schema
+                schema = pa.schema([pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                                    for field in schema])
+                writer = pq.ParquetWriter(sink, schema)
+            text_columns = [field.name for field in writer.schema if pa.types.is_string(field.type)]
+            for row in rows:
+                for name in text_columns:
+                    if row[name] is not None and not isinstance(row[name], str):
+                        row[name] = str(row[name])
+            table = pa.Table.from_pylist(rows, schema=writer.schema)
+            # Un row group por página
+            writer.write_table(table)
+            metrics.EXPORT_ROWS.inc(len(page), format='parquet')
+            yield sink.drain()
+        if writer is None:
+            writer = pq.ParquetWriter(sink, pa.schema([(name, pa.string()) for name in _columns(spec, [])]))
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def open_stream(spec: Dict[str, Any]) -> Tuple[str, str, Iterator]:
+    """
+    Preparar la exportación de una consulta
+
+    La autenticación en SAP ocurre aquí (antes de empezar la respuesta) para
+    poder devolver un error normal; los errores a mitad de la descarga se
+    propagan y cortan la conexión en vez de entregar un archivo incompleto
+    como si estuviera completo.
+
+    Returns:
+        (Content-Type, nombre del archivo, iterador de fragmentos)
+    """
+    from .sap_service_layer import SAPServiceLayer
+
+    fmt = spec.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    if fmt == 'parquet' and not parquet_available():
+        raise ValueError("La exportación a Parquet requiere pyarrow")
+
+    sap = SAPServiceLayer()
+    endpoint_info = sap.get_endpoint_info(spec['entity'])
+    if not endpoint_info:
+        raise ValueError(f"Entidad '{spec['entity']}' no encontrada")
+
+    pages = _cached_pages(spec, sap.page_size)
+    if pages is None:
+        if not sap.login():
+            raise ConnectionError("No se pudo autenticar en SAP Service Layer")
+        print(f"📤 Exportando {spec['entity']} ({fmt}) página por página")
+        pages = sap.iter_pages(endpoint_info['endpoint'], spec.get('filters') or None,
+                               spec.get('select') or None)
+
+    def chunks():
+        try:
+            if fmt == 'parquet':
+                yield from _parquet_chunks(spec, pages)
+            else:
+                yield from _csv_chunks(spec, pages)
+        except Exception as e:
+            print(f"❌ Exportación interrumpida: {e}")
+            raise
+        finally:
+            sap.logout()
+
+    filename = f"{spec['entity']}_{date.today():%Y%m%d}.{fmt}"
+    return CONTENT_TYPES[fmt], filename, chunks()
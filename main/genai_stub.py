@@ -0,0 +1,118 @@
+"""
+Cliente determinístico que reemplaza a genai.Client en pruebas de carga
+
+Imita la forma de las respuestas del SDK (response.text y
+response.candidates[0].content.parts[i].function_call) con un guion fijo:
+la primera llamada de cada turno pide una herramienta según palabras clave
+del mensaje del usuario y, cuando recibe la function_response, responde con
+una tabla Markdown breve. La latencia de cada llamada es configurable.
+"""
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class StubFunctionCall:
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.args = args
+
+
+class StubPart:
+    def __init__(self, text: Optional[str] = None, function_call: Optional[StubFunctionCall] = None):
+        self.text = text
+        self.function_call = function_call
+
+
+class StubContent:
+    def __init__(self, parts: List[StubPart]):
+        self.role = 'model'
+        self.parts = parts
+
+
+class StubCandidate:
+    def __init__(self, content: StubContent):
+        self.content = content
+
+
+class StubResponse:
+    def __init__(self, parts: List[StubPart]):
+        self.candidates = [StubCandidate(StubContent(parts))]
+
+    @property
+    def text(self) -> Optional[str]:
+        texts = [part.text for part in self.candidates[0].content.parts if part.text]
+        return ''.join(texts) if texts else None
+
+
+def default_script(date_from: str, date_to: str) -> List[tuple]:
+    """Reglas (palabra clave, herramienta, argumentos) usadas por defecto"""
+    return [
+        ('productos', 'get_top_selling_products', {"date_from": date_from, "date_to": date_to, "top": 5}),
+        ('clientes', 'get_top_customers', {"date_from": date_from, "date_to": date_to, "top": 5}),
+        ('vendedor', 'get_sales_person_performance', {"sales_person_code": "1", "date_from": date_from, "date_to": date_to}),
+        ('artículos', 'get_stock', {"min_quantity": 0.01, "top": 20}),
+    ]
+
+
+class _StubModels:
+    def __init__(self, client: 'StubGenAIClient'):
+        self._client = client
+
+    def generate_content(self, model: str, contents: List[Dict[str, Any]], config: Any = None) -> StubResponse:
+        return self._client._generate(model, contents)
+
+
+class StubGenAIClient:
+    """Sustituto de genai.Client con respuestas guionadas y latencia simulada"""
+
+    def __init__(self, script: Optional[List[tuple]] = None, latency: float = 0.0, jitter: float = 0.0,
+                 date_from: str = '2026-01-01', date_to: str = '2026-01-31',
+                 on_call: Optional[Callable[[str, float], None]] = None, seed: int = 0):
+        self.script = script if script is not None else default_script(date_from, date_to)
+        self.latency = latency
+        self.jitter = jitter
+        self.on_call = on_call
+        self.models = _StubModels(self)
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def _sleep(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _generate(self, model: str, contents: List[Dict[str, Any]]) -> StubResponse:
+        start = time.perf_counter()
+        self._sleep()
+        last = contents[-1] if contents else {}
+        parts = last.get('parts', [])
+
+        if parts and isinstance(parts[0], dict) and 'function_response' in parts[0]:
+            response = StubResponse([StubPart(text=self._render(parts))])
+        else:
+            text = ' '.join(p.get('text', '') for p in parts if isinstance(p, dict)).lower()
+            response = None
+            for keyword, tool, args in self.script:
+                if keyword in text:
+                    response = StubResponse([StubPart(function_call=StubFunctionCall(tool, dict(args)))])
+                    break
+            if response is None:
+                response = StubResponse([StubPart(text="Hola, ¿en qué puedo ayudarte con SAP?")])
+
+        if self.on_call:
+            self.on_call(model, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _render(parts: List[Dict[str, Any]]) -> str:
+        rows = []
+        for index, part in enumerate(parts, 1):
+            function_response = part['function_response']
+            result = function_response['response'].get('result', '')
+            rows.append(f"| {index} | {function_response['name']} | {len(result)} |")
+        return "| # | Herramienta | Bytes |\n|---|---|---|\n" + "\n".join(rows)
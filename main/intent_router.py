@@ -0,0 +1,440 @@
+"""
+Enrutador determinístico de preguntas frecuentes
+
+Reconoce con reglas las preguntas más comunes y las resuelve sin pasar por
+el modelo:
+- "top 5 productos más vendidos del 1 al 31 de enero"  -> get_top_selling_products
+- "los 10 clientes que más compraron en febrero"      -> get_top_customers
+- "desempeño del vendedor 1522 en enero"              -> get_sales_person_performance
+- "ranking de vendedores en enero"                    -> get_sales_leaderboard
+
+Incluye un parser de expresiones de fecha en español (rangos con días y
+meses, fechas DD/MM/AAAA o AAAA-MM-DD, "enero", "enero de 2026", "ayer",
+"esta semana", "el mes pasado", "últimos 7 días"...). Si la pregunta trae
+algo que las reglas no entienden (grupos, almacenes, comparaciones,
+negaciones, más de un período...) o falta el rango de fechas, la confianza
+baja y la pregunta va al modelo.
+
+Se desactiva con INTENT_ROUTER=0.
+"""
+import os
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+MIN_CONFIDENCE = 0.8
+MAX_TOP = 50
+
+MONTHS = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+    'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+}
+_MONTH = '(' + '|'.join(MONTHS) + ')'
+
+# Palabras que indican algo que las herramientas no saben filtrar
+UNSUPPORTED_QUALIFIERS = re.compile(
+    r'\b(grupo|almacen|bodega|categoria|marca|compar\w*|versus|vs|excepto|excluy\w*|'
+    r'region|zona|sucursal|proveedor\w*|compras|pedidos?|ordenes|inventario|stock|'
+    r'menos vendid\w*|peores|por dia|por semana|por mes|diario|semanal|mensual|'
+    r'no|sin|nunca|ningun\w*|dejaron de|dejo de)\b'
+)
+
+# Un cliente, vendedor o artículo concreto que la herramienta no sabe filtrar
+# ("top productos de marzo para el cliente C0001")
+SCOPE_QUALIFIERS = {
+    'get_top_selling_products': re.compile(r'\b(clientes?|vendedor(?:a|es)?)\b'),
+    'get_top_customers': re.compile(r'\b(productos?|articulos?|vendedor(?:a|es)?)\b'),
+    'get_sales_person_performance': re.compile(r'\b(clientes?|productos?|articulos?)\b'),
+    'get_sales_leaderboard': re.compile(r'\b(clientes?|productos?|articulos?)\b'),
+}
+
+
+@dataclass
+class Intent:
+    """Intención reconocida: herramienta a llamar y sus argumentos"""
+    tool: str
+    args: Dict[str, Any]
+    confidence: float = 1.0
+    notes: Dict[str, Any] = field(default_factory=dict)
+
+
+def enabled() -> bool:
+    return os.environ.get('INTENT_ROUTER', '1') != '0'
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin acentos y con espacios simples"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().replace('¿', ' ').replace('?', ' ').split())
+
+
+# --- Fechas ---
+
+def _year(value: Optional[str], month: int, today: date) -> int:
+    """Año explícito o el más reciente en el que ese mes ya empezó"""
+    if value:
+        year = int(value)
+        return year + 2000 if year < 100 else year
+    return today.year if month <= today.month else today.year - 1
+
+
+def _month_end(year: int, month: int) -> date:
+    first_next = date(year + (month == 12), month % 12 + 1, 1)
+    return first_next - timedelta(days=1)
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_date_range(text: str, today: Optional[date] = None) -> Optional[Tuple[date, date]]:
+    """
+    Rango de fechas (inclusive) expresado en un texto normalizado, o None
+
+    Ejemplos: "del 1 al 31 de enero", "del 15 de enero al 15 de febrero de 2026",
+    "del 01/01/2026 al 05/01/2026", "de 2026-01-01 a 2026-01-31", "en enero",
+    "enero 2025", "el 5 de enero", "ayer", "hoy", "esta semana", "la semana
+    pasada", "este mes", "el mes pasado", "este ano", "el ano 2025", "ano
+    pasado", "ultimos 7 dias".
+    """
+    found = find_date_range(text, today)
+    return found[:2] if found else None
+
+
+def find_date_range(text: str, today: Optional[date] = None) -> Optional[Tuple[date, date, Tuple[int, int]]]:
+    """Como parse_date_range, pero también devuelve la posición (inicio, fin) de la expresión en el texto"""
+    today = today or date.today()
+
+    # Fechas numéricas: DD/MM/AAAA o AAAA-MM-DD
+    numeric = r'(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{2,4})'
+    match = re.search(rf'\b(?:del?|desde)?\s*{numeric}\s+(?:al?|hasta)\s+{numeric}', text)
+    if match:
+        start, end = _parse_numeric(match.group(1)), _parse_numeric(match.group(2))
+        if start and end:
+            return (start, end, match.span()) if start <= end else (end, start, match.span())
+
+    # "del 1 al 31 de enero", "del 15 de enero al 15 de febrero de 2026"
+    match = re.search(
+        rf'\b(?:del?|desde(?: el)?)\s+(\d{{1,2}})(?:\s+de\s+{_MONTH}(?:\s+(?:de|del)\s+(\d{{4}}))?)?'
+        rf'\s+(?:al?|hasta(?: el)?)\s+(\d{{1,2}})\s+de\s+{_MONTH}(?:\s+(?:de|del)\s+(\d{{4}}))?', text)
+    if match:
+        end_month = MONTHS[match.group(5)]
+        end_year = _year(match.group(6), end_month, today)
+        start_month = MONTHS[match.group(2)] if match.group(2) else end_month
+        start_year = int(match.group(3)) if match.group(3) else (
+            end_year if start_month <= end_month else end_year - 1)
+        start = _safe_date(start_year, start_month, int(match.group(1)))
+        end = _safe_date(end_year, end_month, int(match.group(4)))
+        if start and end and start <= end:
+            return start, end, match.span()
+        return None
+
+    # "el 5 de enero (de 2026)"
+    match = re.search(rf'\b(?:el|del|dia)\s+(\d{{1,2}})\s+de\s+{_MONTH}(?:\s+(?:de|del)\s+(\d{{4}}))?', text)
+    if match:
+        month = MONTHS[match.group(2)]
+        day = _safe_date(_year(match.group(3), month, today), month, int(match.group(1)))
+        return (day, day, match.span()) if day else None
+
+    # Un mes completo: "enero", "enero de 2026", "enero 2026"
+    match = re.search(rf'\b{_MONTH}(?:\s+(?:de|del)?\s*(\d{{4}}))?\b', text)
+    if match:
+        month = MONTHS[match.group(1)]
+        year = _year(match.group(2), month, today)
+        return date(year, month, 1), _month_end(year, month), match.span()
+
+    # Un año completo: "el ano 2025", "del ano 2025" (el año en curso llega hasta hoy)
+    match = re.search(r'\bano\s+(?:de\s+)?(\d{4})\b', text)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), min(date(year, 12, 31), today), match.span()
+
+    match = re.search(r'\bultim[oa]s\s+(\d{1,3})\s+dias\b', text)
+    if match:
+        return today - timedelta(days=int(match.group(1)) - 1), today, match.span()
+
+    yesterday = today - timedelta(days=1)
+    last_week = today - timedelta(days=today.weekday() + 7)
+    last_month_end = today.replace(day=1) - timedelta(days=1)
+    relative = (
+        (r'\bayer\b', yesterday, yesterday),
+        (r'\bhoy\b', today, today),
+        (r'\bsemana pasada\b', last_week, last_week + timedelta(days=6)),
+        (r'\besta semana\b', today - timedelta(days=today.weekday()), today),
+        (r'\bmes pasado\b', last_month_end.replace(day=1), last_month_end),
+        (r'\beste mes\b', today.replace(day=1), today),
+        (r'\b(?:este|en el|del) ano(?: en curso)?\b(?! pasado| \d)', date(today.year, 1, 1), today),
+        (r'\bano pasado\b', date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)),
+    )
+    for pattern, start, end in relative:
+        match = re.search(pattern, text)
+        if match:
+            return start, end, match.span()
+    return None
+
+
+def _parse_numeric(value: str) -> Optional[date]:
+    if '-' in value:
+        year, month, day = (int(part) for part in value.split('-'))
+    else:
+        day, month, year = (int(part) for part in value.split('/'))
+        if year < 100:
+            year += 2000
+    return _safe_date(year, month, day)
+
+
+# --- Intenciones ---
+
+def _top_n(text: str, noun: str) -> int:
+    match = re.search(rf'\btop\s*(\d{{1,3}})\b', text) or \
+        re.search(rf'\b(\d{{1,3}})\s+(?:\w+\s+)?{noun}', text)
+    return max(1, min(int(match.group(1)), MAX_TOP)) if match else 5
+
+
+def _without(text: str, span: Optional[Tuple[int, int]]) -> str:
+    """Texto sin la expresión de fecha (sus números no son códigos ni nombres)"""
+    if not span:
+        return text
+    return ' '.join((text[:span[0]] + ' ' + text[span[1]:]).split())
+
+
+def sales_person_name(text: str, date_span: Optional[Tuple[int, int]] = None) -> Optional[str]:
+    """Nombre (con el código delante, si lo trae) de vendedor mencionado en un texto normalizado"""
+    text = _without(text, date_span)
+    match = re.search(r'\b(?:vendedor(?:a)?|de|del|para|a)\s+((?:-?\d{1,6}\s+)?(?:[a-z]+\s+){1,3}?[a-z]+)\s*'
+                      r'(?=$|\b(?:en|del?|desde|el|este|esta|la|ayer|hoy|ultim)\b)', text)
+    if not match:
+        return None
+    return re.sub(r'^(?:vendedor(?:a)?|el|la)\s+', '', match.group(1))
+
+
+def _search_sales_persons(name: str):
+    """Candidatos (código, nombre, puntuación) del índice de nombres de vendedores"""
+    from . import name_index
+    from .sap_service_layer import SAPServiceLayer
+    sap = SAPServiceLayer()
+    try:
+        return name_index.get_index(sap, 'sales_persons').search(name, limit=2)
+    finally:
+        sap.logout()
+
+
+def _sales_person(text: str, date_span: Optional[Tuple[int, int]] = None) -> Tuple[Optional[str], Optional[str]]:
+    """Código de vendedor mencionado o, si no lo trae, el nombre a buscar"""
+    text = _without(text, date_span)
+    # Un número sólo es un código con "vendedor" o "codigo" delante; "1522 JEAN MORENO"
+    # va por el índice de nombres, que reconoce el código exacto
+    match = re.search(r'\b(?:vendedor(?:a)?|codigo)\s+(?:codigo\s+|#\s*)?(-?\d{1,6})\b', text)
+    if match:
+        return match.group(1), None
+    return None, sales_person_name(text)
+
+
+def route(message: str, today: Optional[date] = None) -> Optional[Intent]:
+    """Intención de la pregunta si se reconoce con suficiente confianza"""
+    text = normalize(message)
+    if not text:
+        return None
+    found = find_date_range(text, today)
+    if found is None:
+        return None
+    start, end, span = found
+    date_from, date_to = start.isoformat(), end.isoformat()
+    penalty = 0.5 if UNSUPPORTED_QUALIFIERS.search(text) else 1.0
+    # Un segundo período ("enero 2020 y febrero 2021") no cabe en una sola llamada
+    if find_date_range(text[:span[0]] + ' ' * (span[1] - span[0]) + text[span[1]:], today):
+        penalty *= 0.5
+
+    intent = None
+    if re.search(r'\bvendedores\b', text) and \
+            re.search(r'\b(ranking|top|mejores|todos|(?:vendio|vendieron) mas)\b', text):
+        intent = Intent('get_sales_leaderboard', {"date_from": date_from, "date_to": date_to})
+    elif re.search(r'\b(vendedor(?:a|es)?|desempeno|rendimiento)\b', text):
+        # El nombre se busca en SAP con resolve(), sólo si la respuesta no está en caché
+        code, name = _sales_person(text, span)
+        if code is not None or name:
+            intent = Intent('get_sales_person_performance',
+                            {"sales_person_code": code, "date_from": date_from, "date_to": date_to},
+                            notes={"sales_person_query": name} if code is None else {})
+    elif re.search(r'\b(productos?|articulos?)\b', text) and \
+            re.search(r'\b(mas vendid\w*|top|mejores|vendid\w*|mas se vend\w*)\b', text):
+        intent = Intent('get_top_selling_products',
+                        {"date_from": date_from, "date_to": date_to, "top": _top_n(text, r'(?:productos?|articulos?)')})
+    elif re.search(r'\bclientes?\b', text) and \
+            re.search(r'\b(top|mejores|principales|mas compr\w*|compraron mas|mas importantes)\b', text):
+        intent = Intent('get_top_customers',
+                        {"date_from": date_from, "date_to": date_to, "top": _top_n(text, r'clientes?')})
+
+    if intent is None or SCOPE_QUALIFIERS[intent.tool].search(_without(text, span)):
+        return None
+    intent.confidence *= penalty
+    return intent if intent.confidence >= MIN_CONFIDENCE else None
+
+
+def resolve(intent: Intent) -> Optional[Intent]:
+    """
+    Completar la intención con lo que hay que buscar en SAP (el código de un
+    vendedor mencionado por nombre); None si no se resuelve con confianza
+    """
+    name = intent.notes.get('sales_person_query')
+    if not name:
+        return intent
+    try:
+        candidates = _search_sales_persons(name)
+    except Exception as e:
+        print(f"⚠️ Enrutador: no se pudo buscar el vendedor '{name}': {e}")
+        return None
+    if not candidates:
+        return None
+    code, display, score = candidates[0]
+    gap = score - candidates[1][2] if len(candidates) > 1 else score
+    confidence = intent.confidence * (score if gap >= 0.05 else score * 0.5)
+    if confidence < MIN_CONFIDENCE:
+        return None
+    return Intent(intent.tool, dict(intent.args, sales_person_code=code), confidence,
+                  {"sales_person_name": display})
+
+
+# --- Respuestas ---
+
+def _money(value: float) -> str:
+    return f"${value:,.2f}"
+
+
+def _qty(value: float) -> str:
+    return f"{value:,.2f}".rstrip('0').rstrip('.') if value % 1 else f"{value:,.0f}"
+
+
+def _date(value: str) -> str:
+    return date.fromisoformat(value).strftime('%d/%m/%Y')
+
+
+def _period(args: Dict[str, Any]) -> str:
+    if args['date_from'] == args['date_to']:
+        return f"el {_date(args['date_from'])}"
+    return f"del {_date(args['date_from'])} al {_date(args['date_to'])}"
+
+
+def render(intent: Intent, result: Dict[str, Any]) -> Optional[str]:
+    """Respuesta Markdown a partir del resultado de la herramienta (None si hubo error)"""
+    if not result.get('success'):
+        return None
+    args = intent.args
+    footer = ("\n\n_Ventas netas = facturas − notas de crédito, excluyendo productos con precio menor a $3. "
+              "Montos en la moneda del sistema (USD)._")
+
+    if intent.tool == 'get_top_selling_products':
+        rows = result.get('top_products', [])
+        if not rows:
+            return f"No encontré ventas {_period(args)}."
+        lines = [
+            f"**Top {len(rows)} productos más vendidos** {_period(args)}",
+            "",
+            "| # | Código | Producto | Cantidad neta | Ventas netas |",
+            "|---|--------|----------|--------------:|-------------:|",
+        ]
+        for i, row in enumerate(rows, 1):
+            lines.append(f"| {i} | {row['ItemCode']} | {row.get('ItemDescription') or '-'} | "
+                         f"{_qty(row['NetQuantitySold'])} | {_money(row['NetSalesAmount'])} |")
+        lines.append("")
+        lines.append(f"Facturas analizadas: {result.get('total_invoices_analyzed', 0):,} · "
+                     f"Notas de crédito: {result.get('total_credit_notes_analyzed', 0):,} · "
+                     f"Productos distintos: {result.get('unique_products', 0):,}")
+        return '\n'.join(lines) + footer
+
+    if intent.tool == 'get_top_customers':
+        rows = result.get('top_customers', [])
+        if not rows:
+            return f"No encontré ventas {_period(args)}."
+        lines = [
+            f"**Top {len(rows)} clientes** {_period(args)}",
+            "",
+            "| # | Código | Cliente | Ventas netas | Facturas |",
+            "|---|--------|---------|-------------:|---------:|",
+        ]
+        for i, row in enumerate(rows, 1):
+            lines.append(f"| {i} | {row['CardCode']} | {row.get('CardName') or '-'} | "
+                         f"{_money(row['NetSalesAmount'])} | {row['InvoiceCount']:,} |")
+        lines.append("")
+        lines.append(f"Facturas analizadas: {result.get('total_invoices_analyzed', 0):,} · "
+                     f"Notas de crédito: {result.get('total_credit_notes_analyzed', 0):,} · "
+                     f"Clientes distintos: {result.get('unique_customers', 0):,}")
+        return '\n'.join(lines) + footer
+
+    if intent.tool == 'get_sales_person_performance':
+        summary = result.get('summary', {})
+        name = intent.notes.get('sales_person_name')
+        title = f"vendedor {args['sales_person_code']}" + (f" ({name})" if name else '')
+        if not summary.get('total_invoices'):
+            return f"El {title} no tiene facturas {_period(args)}."
+        lines = [
+            f"**Desempeño del {title}** {_period(args)}",
+            "",
+            "| Métrica | Valor |",
+            "|---------|------:|",
+            f"| Ventas brutas | {_money(summary['gross_sales'])} |",
+            f"| Devoluciones | {_money(summary['returns'])} |",
+            f"| Ventas netas | {_money(summary['net_sales'])} |",
+            f"| Tasa de devolución | {summary['return_rate_percent']:.2f}% |",
+            f"| Facturas | {summary['total_invoices']:,} |",
+            f"| Notas de crédito | {summary['total_credit_notes']:,} |",
+            f"| Ticket promedio | {_money(summary['average_invoice_amount'])} |",
+            f"| Clientes atendidos | {summary['unique_customers']:,} |",
+            f"| Productos vendidos | {summary['unique_products_sold']:,} |",
+        ]
+        products = result.get('top_products', [])
+        if products:
+            lines += ["", "**Top productos**", "",
+                      "| # | Código | Producto | Cantidad neta | Ventas netas |",
+                      "|---|--------|----------|--------------:|-------------:|"]
+            for i, row in enumerate(products, 1):
+                lines.append(f"| {i} | {row['ItemCode']} | {row.get('ItemDescription') or '-'} | "
+                             f"{_qty(row['NetQuantitySold'])} | {_money(row['NetSalesAmount'])} |")
+        customers = result.get('top_customers', [])
+        if customers:
+            lines += ["", "**Top clientes**", "",
+                      "| # | Código | Cliente | Ventas netas | Facturas |",
+                      "|---|--------|---------|-------------:|---------:|"]
+            for i, row in enumerate(customers, 1):
+                lines.append(f"| {i} | {row['CardCode']} | {row.get('CardName') or '-'} | "
+                             f"{_money(row['NetSalesAmount'])} | {row['InvoiceCount']:,} |")
+        flags = result.get('improvement_opportunities', {})
+        observations = []
+        if flags.get('high_return_rate'):
+            observations.append("- La tasa de devolución supera el 10%.")
+        if flags.get('low_customer_diversity'):
+            observations.append("- Atendió a menos de 10 clientes en el período.")
+        if flags.get('low_product_diversity'):
+            observations.append("- Vendió menos de 20 productos distintos.")
+        if observations:
+            lines += ["", "**Oportunidades de mejora**", ""] + observations
+        return '\n'.join(lines) + footer
+
+    if intent.tool == 'get_sales_leaderboard':
+        rows = result.get('leaderboard', [])[:MAX_TOP]
+        if not rows:
+            return f"No encontré ventas {_period(args)}."
+        lines = [
+            f"**Ranking de vendedores** {_period(args)}",
+            "",
+            "| # | Código | Vendedor | Ventas netas | Participación | Devolución | Ticket promedio | Clientes |",
+            "|---|--------|----------|-------------:|--------------:|-----------:|----------------:|---------:|",
+        ]
+        for row in rows:
+            lines.append(f"| {row['rank']} | {row['SalesPersonCode']} | {row.get('SalesPersonName') or '-'} | "
+                         f"{_money(row['net_sales'])} | {row['share_percent']:.2f}% | "
+                         f"{row['return_rate_percent']:.2f}% | {_money(row['average_invoice_amount'])} | "
+                         f"{row['unique_customers']:,} |")
+        lines.append("")
+        lines.append(f"Facturas analizadas: {result.get('total_invoices_analyzed', 0):,} · "
+                     f"Notas de crédito: {result.get('total_credit_notes_analyzed', 0):,} · "
+                     f"Ventas netas totales: {_money(result.get('total_net_sales', 0))}")
+        return '\n'.join(lines) + footer
+
+    return None
@@ -0,0 +1,222 @@
+"""
+Existencias por artículo y almacén en memoria
+
+Las preguntas de stock ("artículos con stock", "stock del almacén 02")
+consultaban /Items con OnHand gt 0 y descargaban registros completos, a
+veces todas las páginas. Este módulo mantiene por proceso una foto de
+ItemWarehouseInfoCollection (ItemCode x WarehouseCode con InStock,
+Committed y Ordered) en columnas compactas (array) con índices por
+almacén, grupo de artículos y artículo, así filtrar, ordenar y sacar un
+top-k es un recorrido local de milisegundos.
+
+La foto se descarga completa la primera vez que se usa y se refresca cuando
+pasan INVENTORY_TTL segundos. Mientras un hilo la refresca los demás siguen
+respondiendo con la foto anterior; si el refresco falla se sigue usando.
+
+Variables de entorno:
+    INVENTORY_TTL   segundos entre refrescos (default 300)
+"""
+import heapq
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import codec
+
+INVENTORY_TTL = int(os.environ.get('INVENTORY_TTL', 300))
+RETRY_AFTER_ERROR = 60
+
+WAREHOUSE_FIELDS = ('WarehouseCode', 'InStock', 'Committed', 'Ordered')
+QUANTITIES = ('in_stock', 'committed', 'ordered', 'available')
+
+
+class Snapshot:
+    """Filas artículo x almacén en columnas, agrupadas por artículo"""
+
+    def __init__(self, items: List[dict]):
+        self.item_codes: List[str] = []
+        self.item_groups: List[Optional[str]] = []
+        self.warehouses: List[str] = []
+        warehouse_ids: Dict[str, int] = {}
+        self.row_item = array('I')
+        self.row_warehouse = array('H')
+        self.in_stock = array('d')
+        self.committed = array('d')
+        self.ordered = array('d')
+        self.by_item: Dict[str, Tuple[int, int]] = {}
+        self.by_warehouse: Dict[str, array] = {}
+        self.by_group: Dict[str, array] = {}
+
+        for record in items:
+            code = record.get('ItemCode')
+            if code is None:
+                continue
+            item = len(self.item_codes)
+            self.item_codes.append(str(code))
+            group = record.get('ItemsGroupCode')
+            self.item_groups.append(None if group is None else str(group))
+            start = len(self.row_item)
+            for info in record.get('ItemWarehouseInfoCollection') or []:
+                warehouse = str(info.get('WarehouseCode') or '')
+                if warehouse not in warehouse_ids:
+                    warehouse_ids[warehouse] = len(self.warehouses)
+                    self.warehouses.append(warehouse)
+                row = len(self.row_item)
+                self.row_item.append(item)
+                self.row_warehouse.append(warehouse_ids[warehouse])
+                self.in_stock.append(float(info.get('InStock') or 0))
+                self.committed.append(float(info.get('Committed') or 0))
+                self.ordered.append(float(info.get('Ordered') or 0))
+                self.by_warehouse.setdefault(warehouse, array('I')).append(row)
+                if group is not None:
+                    self.by_group.setdefault(str(group), array('I')).append(row)
+            self.by_item[str(code)] = (start, len(self.row_item))
+
+        self.loaded_at = datetime.now()
+
+    def __len__(self):
+        return len(self.row_item)
+
+    def rows(self, warehouse: str = '', group: str = '', item_codes: Iterable[str] = ()) -> Iterable[int]:
+        """Filas que cumplen los filtros, partiendo del índice más selectivo"""
+        candidates = []
+        codes = [str(code).strip() for code in item_codes if str(code).strip()]
+        if codes:
+            candidates.append([row for code in codes for row in range(*self.by_item.get(code, (0, 0)))])
+        if warehouse:
+            candidates.append(self.by_warehouse.get(warehouse, ()))
+        if group:
+            candidates.append(self.by_group.get(group, ()))
+        if not candidates:
+            return range(len(self.row_item))
+        candidates.sort(key=len)
+        rows = candidates[0]
+        if len(candidates) == 1:
+            return rows
+        warehouse_id = self.warehouses.index(warehouse) if warehouse in self.warehouses else -1
+        codes = set(codes)
+        return [row for row in rows
+                if (not warehouse or self.row_warehouse[row] == warehouse_id)
+                and (not group or self.item_groups[self.row_item[row]] == group)
+                and (not codes or self.item_codes[self.row_item[row]] in codes)]
+
+    def quantities(self, row: int) -> Tuple[float, float, float, float]:
+        in_stock, committed, ordered = self.in_stock[row], self.committed[row], self.ordered[row]
+        # Disponible como lo calcula SAP: en stock - comprometido + pedido
+        return in_stock, committed, ordered, in_stock - committed + ordered
+
+
+class _State:
+    def __init__(self):
+        self.snapshot: Optional[Snapshot] = None
+        self.expires = 0.0
+        self.lock = threading.Lock()
+
+
+_states: Dict[str, _State] = {}
+_states_lock = threading.Lock()
+
+
+def _state(base_url: str) -> _State:
+    with _states_lock:
+        state = _states.get(base_url)
+        if state is None:
+            state = _states[base_url] = _State()
+        return state
+
+
+def _download(sap) -> Snapshot:
+    result = sap.query(
+        endpoint='/Items',
+        select='ItemCode,ItemsGroupCode,ItemWarehouseInfoCollection',
+        fields=codec.fields_from_select('ItemCode,ItemsGroupCode', {'ItemWarehouseInfoCollection': WAREHOUSE_FIELDS}),
+        top=None
+    )
+    if not result.get('success'):
+        raise RuntimeError(result.get('error') or "No se pudo descargar /Items")
+    return Snapshot(result.get('data', []))
+
+
+def _refresh_locked(sap, state: _State) -> Optional[Snapshot]:
+    try:
+        snapshot = _download(sap)
+    except Exception as e:
+        print(f"⚠️ Error refrescando el inventario: {e}")
+        state.expires = time.monotonic() + RETRY_AFTER_ERROR
+        return state.snapshot
+    state.snapshot = snapshot
+    state.expires = time.monotonic() + INVENTORY_TTL
+    print(f"📦 Inventario: {len(snapshot.item_codes)} artículos, {len(snapshot)} filas artículo-almacén")
+    return snapshot
+
+
+def get_snapshot(sap) -> Optional[Snapshot]:
+    """Foto del inventario, refrescándola si venció (None si nunca se pudo descargar)"""
+    state = _state(sap.base_url)
+    if state.expires > time.monotonic():
+        return state.snapshot
+    if state.snapshot is not None:
+        # Un solo hilo refresca; el resto responde con la foto anterior
+        if not state.lock.acquire(blocking=False):
+            return state.snapshot
+    else:
+        state.lock.acquire()
+    try:
+        if state.expires > time.monotonic():
+            return state.snapshot
+        return _refresh_locked(sap, state)
+    finally:
+        state.lock.release()
+
+
+def refresh(sap) -> Optional[Snapshot]:
+    """Descargar de nuevo la foto del inventario"""
+    state = _state(sap.base_url)
+    with state.lock:
+        return _refresh_locked(sap, state)
+
+
+def query(snapshot: Snapshot, warehouse: str = '', group: str = '', item_codes: Iterable[str] = (),
+          per_warehouse: bool = False, sort_by: str = 'in_stock', ascending: bool = False,
+          min_quantity: Optional[float] = None, top: int = 20) -> Dict:
+    """
+    Filtrar, agregar y ordenar la foto
+
+    Sin per_warehouse las filas de un artículo se suman entre los almacenes
+    que cumplen el filtro. min_quantity se compara con la columna sort_by;
+    los totales por almacén son de todas las filas filtradas, antes de
+    aplicarlo.
+
+    Returns:
+        Dict con las filas del top (índices de artículo/almacén y cantidades),
+        la cantidad de coincidencias y los totales por almacén
+    """
+    if sort_by not in QUANTITIES:
+        raise ValueError(f"sort_by debe ser uno de {', '.join(QUANTITIES)}")
+    column = QUANTITIES.index(sort_by)
+
+    groups: Dict[Tuple[int, int], List[float]] = {}
+    by_warehouse: Dict[str, List[float]] = {}
+    for row in snapshot.rows(warehouse, group, item_codes):
+        values = snapshot.quantities(row)
+        warehouse_id = snapshot.row_warehouse[row]
+        key = (snapshot.row_item[row], warehouse_id if per_warehouse else -1)
+        totals = groups.setdefault(key, [0.0, 0.0, 0.0, 0.0])
+        warehouse_totals = by_warehouse.setdefault(snapshot.warehouses[warehouse_id], [0.0, 0.0, 0.0, 0.0])
+        for i, value in enumerate(values):
+            totals[i] += value
+            warehouse_totals[i] += value
+
+    if min_quantity is not None:
+        groups = {key: values for key, values in groups.items() if values[column] >= min_quantity}
+    select = heapq.nsmallest if ascending else heapq.nlargest
+    top_rows = select(max(0, int(top)), groups.items(), key=lambda entry: entry[1][column])
+    return {
+        "rows": top_rows,
+        "matches": len(groups),
+        "totals": [round(sum(values[i] for values in groups.values()), 2) for i in range(len(QUANTITIES))],
+        "by_warehouse": by_warehouse,
+    }
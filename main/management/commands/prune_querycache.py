@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from main import retention
+
+
+class Command(BaseCommand):
+    help = "Borrar las consultas de QueryCache que exceden la retención configurada y compactar la base"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=float, default=None,
+                            help=f"Antigüedad máxima (default {retention.MAX_AGE_HOURS})")
+        parser.add_argument('--max-rows-per-session', type=int, default=None,
+                            help=f"Filas por sesión (default {retention.MAX_ROWS_PER_SESSION})")
+        parser.add_argument('--max-total-mb', type=float, default=None,
+                            help=f"Tamaño total de los resultados en MB (default {retention.MAX_TOTAL_MB})")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="Activar auto_vacuum=INCREMENTAL (hace un VACUUM completo la primera vez)")
+
+    def handle(self, *args, **options):
+        if options['vacuum'] and retention.enable_incremental_vacuum():
+            self.stdout.write("🗜️ Base convertida a auto_vacuum=INCREMENTAL")
+        removed = retention.enforce(
+            max_age_hours=options['max_age_hours'],
+            max_rows_per_session=options['max_rows_per_session'],
+            max_total_mb=options['max_total_mb'],
+            vacuum_pages=0,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"🧹 Borradas: {removed['age']} por antigüedad, {removed['session_rows']} por filas por sesión, "
+            f"{removed['total_size']} por tamaño total; {removed['vacuumed_pages']} páginas liberadas"
+        ))
@@ -0,0 +1,162 @@
+"""
+Directorio en memoria de datos maestros
+
+Mantiene por proceso tablas compactas código -> datos descriptivos de:
+- items:          ItemCode -> (ItemName, ItemsGroupCode)
+- customers:      CardCode -> (CardName, CardType)
+- sales_persons:  SalesEmployeeCode -> (SalesEmployeeName, Active)
+
+Así los documentos se pueden descargar sin columnas descriptivas (CardName,
+ItemDescription) y resolver un nombre es una búsqueda en un dict en lugar de
+una consulta HTTP. Cada tabla se descarga completa la primera vez que se usa
+y se refresca cuando pasan MASTER_DATA_TTL segundos; si el refresco falla se
+siguen usando los datos anteriores.
+
+Otros módulos pueden suscribirse a los cambios con add_listener() (el índice
+de nombres los usa para actualizarse de forma incremental).
+
+Variables de entorno:
+    MASTER_DATA_TTL   segundos entre refrescos de cada tabla (default 3600)
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+MASTER_DATA_TTL = int(os.environ.get('MASTER_DATA_TTL', 3600))
+RETRY_AFTER_ERROR = 60
+
+# tipo -> (endpoint, campo código, campos descriptivos)
+SOURCES = {
+    'items': ('/Items', 'ItemCode', ('ItemName', 'ItemsGroupCode')),
+    'customers': ('/BusinessPartners', 'CardCode', ('CardName', 'CardType')),
+    'sales_persons': ('/SalesPersons', 'SalesEmployeeCode', ('SalesEmployeeName', 'Active')),
+}
+
+Entry = Tuple[Any, ...]
+# listener(base_url, kind, cambiados {código: entrada}, eliminados [código])
+Listener = Callable[[str, str, Dict[str, Entry], List[str]], None]
+
+
+class _Table:
+    def __init__(self):
+        self.entries: Dict[str, Entry] = {}
+        self.expires = 0.0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+
+_tables: Dict[Tuple[str, str], _Table] = {}
+_tables_lock = threading.Lock()
+_listeners: List[Listener] = []
+
+
+def add_listener(listener: Listener):
+    """Recibir los cambios de cada refresco"""
+    _listeners.append(listener)
+
+
+def _table(base_url: str, kind: str) -> _Table:
+    with _tables_lock:
+        table = _tables.get((base_url, kind))
+        if table is None:
+            table = _tables[(base_url, kind)] = _Table()
+        return table
+
+
+def _download(sap, kind: str) -> Dict[str, Entry]:
+    endpoint, code_field, name_fields = SOURCES[kind]
+    result = sap.query(endpoint=endpoint, select=','.join((code_field,) + name_fields), top=None)
+    if not result.get('success'):
+        raise RuntimeError(result.get('error') or f"No se pudo descargar {endpoint}")
+    entries = {}
+    for record in result.get('data', []):
+        code = record.get(code_field)
+        if code is None:
+            continue
+        entries[str(code)] = tuple(record.get(field) for field in name_fields)
+    return entries
+
+
+def refresh(sap, kind: str) -> Dict[str, Entry]:
+    """Descargar de nuevo una tabla y notificar los cambios"""
+    table = _table(sap.base_url, kind)
+    with table.lock:
+        return _refresh_locked(sap, kind, table)
+
+
+def _refresh_locked(sap, kind: str, table: _Table) -> Dict[str, Entry]:
+    try:
+        entries = _download(sap, kind)
+    except Exception as e:
+        print(f"⚠️ Error refrescando datos maestros ({kind}): {e}")
+        table.expires = time.monotonic() + RETRY_AFTER_ERROR
+        return table.entries
+
+    previous = table.entries
+    changed = {code: entry for code, entry in entries.items() if previous.get(code) != entry}
+    removed = [code for code in previous if code not in entries]
+    table.entries = entries
+    table.loaded = True
+    table.expires = time.monotonic() + MASTER_DATA_TTL
+    print(f"📇 Datos maestros {kind}: {len(entries)} registros ({len(changed)} cambios, {len(removed)} eliminados)")
+    _notify(sap.base_url, kind, changed, removed)
+    return entries
+
+
+def get_table(sap, kind: str) -> Dict[str, Entry]:
+    """Tabla código -> entrada, refrescándola si venció"""
+    if kind not in SOURCES:
+        raise ValueError(f"Tipo de dato maestro desconocido: {kind}")
+    table = _table(sap.base_url, kind)
+    if table.expires > time.monotonic():
+        return table.entries
+    with table.lock:
+        if table.expires > time.monotonic():
+            return table.entries
+        return _refresh_locked(sap, kind, table)
+
+
+def name(sap, kind: str, code: Any, default: str = '') -> str:
+    """Nombre de un código (o default si no existe)"""
+    entry = get_table(sap, kind).get(str(code))
+    return entry[0] if entry and entry[0] is not None else default
+
+
+def lookup(sap, kind: str, codes: Iterable[Any]) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+    """
+    Buscar varios códigos
+
+    Returns:
+        (encontrados {código: {campo: valor}}, códigos no encontrados)
+    """
+    table = get_table(sap, kind)
+    fields = SOURCES[kind][2]
+    found, missing = {}, []
+    for code in codes:
+        code = str(code).strip()
+        entry = table.get(code)
+        if entry is None:
+            missing.append(code)
+        else:
+            found[code] = dict(zip(fields, entry))
+    return found, missing
+
+
+def _notify(base_url: str, kind: str, changed: Dict[str, Entry], removed: List[str]):
+    for listener in _listeners:
+        try:
+            listener(base_url, kind, changed, removed)
+        except Exception as e:
+            print(f"⚠️ Error notificando cambios de datos maestros: {e}")
+
+
+def clear():
+    """Olvidar todas las tablas (se vuelven a descargar al usarlas)"""
+    with _tables_lock:
+        tables = list(_tables.items())
+        _tables.clear()
+    # Para los suscriptores todos los códigos se eliminaron (el índice de nombres se vacía)
+    for (base_url, kind), table in tables:
+        if table.entries:
+            _notify(base_url, kind, {}, list(table.entries))
@@ -0,0 +1,211 @@
+"""
+Métricas en memoria del pipeline del chat, expuestas en formato Prometheus
+
+Cada etapa (login SAP, GET de cada página, decodificación JSON, agregación,
+inserción en QueryCache, llamadas a Gemini y despacho de herramientas) se mide
+con span() y se acumula en histogramas; los contadores llevan páginas y bytes
+transferidos. Además cada petición del chat acumula sus propias páginas/bytes
+(begin_request/end_request) para poder ver su distribución por petición.
+
+Los valores son por proceso: con varios workers cada uno expone los suyos.
+"""
+import contextvars
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PAGE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+BYTE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Iterable[Tuple[str, str]], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return '\n'.join(lines)
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def collect(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return '\n'.join(lines)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [conteos por bucket..., suma, conteo total]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {state[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {state[-1]}")
+        return '\n'.join(lines)
+
+
+# --- Registro de métricas ---
+
+STAGE_SECONDS = Histogram('damasco_stage_duration_seconds', 'Duración de cada etapa del pipeline')
+SAP_PAGES = Counter('damasco_sap_pages_total', 'Páginas obtenidas del Service Layer')
+SAP_BYTES = Counter('damasco_sap_bytes_total', 'Bytes recibidos del Service Layer')
+SAP_ERRORS = Counter('damasco_sap_errors_total', 'Respuestas de error del Service Layer')
+SAP_COALESCED = Counter('damasco_sap_coalesced_total', 'Llamadas que compartieron una consulta idéntica en curso')
+SAP_CONCURRENCY_LIMIT = Gauge('damasco_sap_concurrency_limit', 'Límite adaptativo de peticiones en vuelo al Service Layer')
+SAP_IN_FLIGHT = Gauge('damasco_sap_in_flight', 'Peticiones en vuelo al Service Layer')
+SAP_CONCURRENCY_DECREASES = Counter('damasco_sap_concurrency_decreases_total', 'Reducciones del límite de concurrencia por sobrecarga o latencia')
+DOCUMENT_CACHE_SHARDS = Counter('damasco_document_cache_shards_total', 'Días de documentos servidos desde la caché (hit), desde una instantánea en disco (snapshot) o descargados (miss)')
+WRITE_BEHIND_PENDING = Gauge('damasco_write_behind_pending', 'Filas encoladas para escritura diferida')
+QUERY_REUSE = Counter('damasco_query_reuse_total', 'Consultas SAP respondidas con una consulta previa de la sesión (exacta o subconjunto)')
+ANSWER_CACHE = Counter('damasco_answer_cache_total', 'Preguntas respondidas desde la caché de respuestas (hit) o calculadas (miss)')
+EXPORT_ROWS = Counter('damasco_export_rows_total', 'Registros enviados por el endpoint de exportación')
+CHAT_REQUESTS = Counter('damasco_chat_requests_total', 'Peticiones al endpoint del chat')
+CHAT_REQUEST_SECONDS = Histogram('damasco_chat_request_duration_seconds', 'Duración total de cada petición del chat')
+CHAT_REQUEST_PAGES = Histogram('damasco_chat_request_sap_pages', 'Páginas SAP obtenidas por petición del chat', PAGE_BUCKETS)
+CHAT_REQUEST_BYTES = Histogram('damasco_chat_request_sap_bytes', 'Bytes SAP recibidos por petición del chat', BYTE_BUCKETS)
+
+REGISTRY = [
+    STAGE_SECONDS, SAP_PAGES, SAP_BYTES, SAP_ERRORS, SAP_COALESCED,
+    SAP_CONCURRENCY_LIMIT, SAP_IN_FLIGHT, SAP_CONCURRENCY_DECREASES, DOCUMENT_CACHE_SHARDS,
+    WRITE_BEHIND_PENDING, QUERY_REUSE, ANSWER_CACHE, EXPORT_ROWS, CHAT_REQUESTS, CHAT_REQUEST_SECONDS, CHAT_REQUEST_PAGES, CHAT_REQUEST_BYTES,
+]
+
+
+class RequestStats:
+    """Acumulado de una petición del chat"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.pages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add_page(self, size: int):
+        with self._lock:
+            self.pages += 1
+            self.bytes += size
+
+
+_current_request: contextvars.ContextVar = contextvars.ContextVar('damasco_request_stats', default=None)
+
+
+def begin_request() -> RequestStats:
+    stats = RequestStats()
+    _current_request.set(stats)
+    return stats
+
+
+def end_request(status: str = 'ok'):
+    stats = _current_request.get()
+    if stats is None:
+        return
+    _current_request.set(None)
+    CHAT_REQUESTS.inc(status=status)
+    CHAT_REQUEST_SECONDS.observe(time.perf_counter() - stats.start)
+    CHAT_REQUEST_PAGES.observe(stats.pages)
+    CHAT_REQUEST_BYTES.observe(stats.bytes)
+
+
+def current_request() -> Optional[RequestStats]:
+    return _current_request.get()
+
+
+def record_sap_page(endpoint: str, size: int):
+    """Registrar una página recibida del Service Layer"""
+    SAP_PAGES.inc(endpoint=endpoint)
+    SAP_BYTES.inc(size, endpoint=endpoint)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.add_page(size)
+
+
+class span:
+    """
+    Mide la duración de una etapa. Se usa como context manager o, cuando la
+    etapa abarca un bloque largo, creándolo y llamando a finish().
+    """
+
+    def __init__(self, stage: str, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+
+    def finish(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, stage=self.stage, **self.labels)
+        return elapsed
+
+
+def render() -> str:
+    """Exposición de todas las métricas en formato de texto de Prometheus"""
+    return '\n'.join(metric.collect() for metric in REGISTRY) + '\n'
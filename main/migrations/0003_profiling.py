@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_querycache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=False, help_text='Perfilar todas las peticiones a /send/')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Configuración de Perfilado',
+                'verbose_name_plural': 'Configuración de Perfilado',
+            },
+        ),
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_id', models.CharField(max_length=32, unique=True)),
+                ('path', models.CharField(max_length=200)),
+                ('message', models.TextField(blank=True)),
+                ('trigger', models.CharField(max_length=20)),
+                ('status_code', models.IntegerField(null=True)),
+                ('duration_ms', models.FloatField()),
+                ('peak_memory_kb', models.FloatField(null=True)),
+                ('profile_stats', models.TextField()),
+                ('tool_stats', models.TextField(blank=True)),
+                ('top_allocations', models.TextField(blank=True)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Perfil de Petición',
+                'verbose_name_plural': 'Perfiles de Peticiones',
+                'ordering': ['-timestamp'],
+            },
+        ),
+    ]
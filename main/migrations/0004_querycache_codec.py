@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:55
+
+import main.codec
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_profiling'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='querycache',
+            name='result_data',
+            field=models.JSONField(decoder=main.codec.CodecJSONDecoder, encoder=main.codec.CodecJSONEncoder),
+        ),
+    ]
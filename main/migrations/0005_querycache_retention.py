@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_querycache_codec'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='querycache',
+            name='result_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='querycache',
+            index=models.Index(fields=['timestamp'], name='main_queryc_timesta_f8634f_idx'),
+        ),
+        # Tamaño de las filas existentes
+        migrations.RunSQL(
+            "UPDATE main_querycache SET result_size = length(result_data)",
+            migrations.RunSQL.noop,
+        ),
+    ]
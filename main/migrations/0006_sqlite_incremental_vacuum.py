@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def enable_incremental_vacuum(apps, schema_editor):
+    # Sin esto "PRAGMA incremental_vacuum" no libera nada después de podar QueryCache
+    from main import retention
+    retention.enable_incremental_vacuum(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # VACUUM no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('main', '0005_querycache_retention'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_incremental_vacuum, migrations.RunPython.noop),
+    ]
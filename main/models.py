@@ -1,6 +1,7 @@
 from django.db import models
 from django.utils import timezone
 import json
+from .codec import CodecJSONDecoder, CodecJSONEncoder
 
 # Create your models here.
 
@@ -31,8 +32,9 @@ class QueryCache(models.Model):
     query_type = models.CharField(max_length=100)  # "Invoices", "Items", etc.
     query_description = models.TextField()  # Descripción legible de la consulta
     query_params = models.JSONField()  # Parámetros de la consulta
-    result_data = models.JSONField()  # Resultados de la consulta
+    result_data = models.JSONField(encoder=CodecJSONEncoder, decoder=CodecJSONDecoder)  # Resultados de la consulta
     result_summary = models.TextField(blank=True)  # Resumen generado por IA
+    result_size = models.PositiveIntegerField(default=0)  # Largo del JSON de result_data (para la retención)
     timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
@@ -41,8 +43,50 @@ class QueryCache(models.Model):
         verbose_name_plural = "Consultas Cacheadas"
         indexes = [
             models.Index(fields=['session_id', '-timestamp']),
+            models.Index(fields=['timestamp']),
         ]
     
     def __str__(self):
         return f"{self.query_type} - {self.query_description[:50]}"
         return f"{self.role}: {self.message[:50]}..."
+
+
+class ProfilingSettings(models.Model):
+    """Interruptor del perfilado por petición (fila única editable desde el admin)"""
+    enabled = models.BooleanField(default=False, help_text="Perfilar todas las peticiones a /send/")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Configuración de Perfilado"
+        verbose_name_plural = "Configuración de Perfilado"
+    
+    def __str__(self):
+        return "Perfilado activo" if self.enabled else "Perfilado inactivo"
+    
+    @classmethod
+    def load(cls):
+        obj, _ = cls.objects.get_or_create(pk=1)
+        return obj
+
+
+class RequestProfile(models.Model):
+    """Perfil (cProfile + tracemalloc) de una petición al chat"""
+    request_id = models.CharField(max_length=32, unique=True)
+    path = models.CharField(max_length=200)
+    message = models.TextField(blank=True)  # Pregunta del usuario (recortada)
+    trigger = models.CharField(max_length=20)  # "header" o "admin"
+    status_code = models.IntegerField(null=True)
+    duration_ms = models.FloatField()
+    peak_memory_kb = models.FloatField(null=True)
+    profile_stats = models.TextField()  # Funciones más costosas (tiempo acumulado)
+    tool_stats = models.TextField(blank=True)  # Sólo funciones de sap_service_layer
+    top_allocations = models.TextField(blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-timestamp']
+        verbose_name = "Perfil de Petición"
+        verbose_name_plural = "Perfiles de Peticiones"
+    
+    def __str__(self):
+        return f"{self.request_id} - {self.duration_ms:.0f} ms"
@@ -0,0 +1,148 @@
+"""
+Índice local de nombres para buscar vendedores y clientes por nombre
+
+Los usuarios preguntan por "JEAN MORENO" o por parte del nombre de un
+cliente; en lugar de hacer consultas substringof() contra SAP, se busca en un
+índice de trigramas y palabras construido sobre el directorio de datos
+maestros (master_data). El índice se actualiza de forma incremental con los
+cambios de cada refresco del directorio.
+
+La puntuación es el coeficiente de Dice entre los trigramas de la consulta y
+los del nombre, con un extra por cada palabra de la consulta que sea prefijo
+de una palabra del nombre (normalizada a 0-1); un código exacto (solo o
+dentro de la consulta) puntúa 1.
+"""
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from . import master_data
+
+INDEXED_KINDS = ('customers', 'sales_persons')
+TOKEN_BONUS = 0.15
+MIN_SCORE = 0.2
+
+
+def normalize(text: str) -> str:
+    """Mayúsculas, sin acentos ni signos, espacios simples"""
+    text = unicodedata.normalize('NFKD', str(text or ''))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(re.sub(r'[^0-9A-Za-z]+', ' ', text).upper().split())
+
+
+def trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Índice de trigramas y palabras de un tipo de dato maestro"""
+
+    def __init__(self):
+        self.names: Dict[str, str] = {}
+        self.display: Dict[str, str] = {}
+        self._trigram_counts: Dict[str, int] = {}
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _remove(self, code: str):
+        normalized = self.names.pop(code, None)
+        self.display.pop(code, None)
+        self._trigram_counts.pop(code, None)
+        if normalized is None:
+            return
+        for gram in trigrams(normalized):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(code)
+                if not postings:
+                    del self._postings[gram]
+
+    def _add(self, code: str, name: str):
+        normalized = normalize(name)
+        if not normalized:
+            return
+        grams = trigrams(normalized)
+        self.names[code] = normalized
+        self.display[code] = name
+        self._trigram_counts[code] = len(grams)
+        for gram in grams:
+            self._postings[gram].add(code)
+
+    def update(self, changed: Dict[str, str], removed: List[str] = ()):
+        """Aplicar cambios {código: nombre} y eliminaciones"""
+        with self._lock:
+            for code in removed:
+                self._remove(code)
+            for code, name in changed.items():
+                self._remove(code)
+                self._add(code, name)
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[str, str, float]]:
+        """Candidatos (código, nombre, puntuación) ordenados por puntuación"""
+        query_text = str(query or '').strip()
+        normalized = normalize(query_text)
+        if not normalized:
+            return []
+        query_grams = trigrams(normalized)
+        query_tokens = normalized.split()
+
+        with self._lock:
+            shared: Dict[str, int] = defaultdict(int)
+            for gram in query_grams:
+                for code in self._postings.get(gram, ()):
+                    shared[code] += 1
+
+            scores = {}
+            for code, count in shared.items():
+                score = 2 * count / (len(query_grams) + self._trigram_counts[code])
+                name_tokens = self.names[code].split()
+                for token in query_tokens:
+                    if any(name_token.startswith(token) for name_token in name_tokens):
+                        score += TOKEN_BONUS / len(query_tokens)
+                scores[code] = score / (1 + TOKEN_BONUS)
+            # "1522 JEAN MORENO": un código exacto dentro de la consulta
+            for token in {query_text, *query_text.split()}:
+                if token in self.names:
+                    scores[token] = 1.0
+
+            ranked = sorted(
+                (item for item in scores.items() if item[1] >= MIN_SCORE),
+                key=lambda item: (-item[1], item[0])
+            )[:limit]
+            return [(code, self.display[code], round(score, 3)) for code, score in ranked]
+
+
+_indexes: Dict[Tuple[str, str], NameIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _on_master_data_change(base_url: str, kind: str, changed, removed):
+    if kind not in INDEXED_KINDS:
+        return
+    with _indexes_lock:
+        index = _indexes.setdefault((base_url, kind), NameIndex())
+    index.update({code: entry[0] for code, entry in changed.items()}, removed)
+
+
+master_data.add_listener(_on_master_data_change)
+
+
+def get_index(sap, kind: str) -> NameIndex:
+    """Índice de un tipo, construyéndolo desde el directorio si todavía no existe"""
+    if kind not in INDEXED_KINDS:
+        raise ValueError(f"Tipo sin índice de nombres: {kind}")
+    table = master_data.get_table(sap, kind)
+    with _indexes_lock:
+        index = _indexes.get((sap.base_url, kind))
+        if index is None:
+            index = _indexes[(sap.base_url, kind)] = NameIndex()
+    # El directorio pudo cargarse antes de que este módulo se suscribiera
+    if not index and table:
+        index.update({code: entry[0] for code, entry in table.items()})
+    return index
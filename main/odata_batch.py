@@ -0,0 +1,90 @@
+"""
+Codificación de peticiones OData $batch (multipart/mixed)
+
+Service Layer acepta en POST /$batch varias peticiones HTTP dentro de un
+cuerpo multipart/mixed y responde con otro multipart con una respuesta por
+parte, en el mismo orden. Aquí sólo se arman peticiones GET (las consultas
+de solo lectura no necesitan changesets).
+"""
+import re
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+CRLF = b'\r\n'
+
+# (status, cabeceras en minúsculas, cuerpo)
+Response = Tuple[int, Dict[str, str], bytes]
+
+
+def encode(paths: List[str], headers: Optional[Dict[str, str]] = None) -> Tuple[str, bytes]:
+    """
+    Cuerpo de un $batch con un GET por ruta
+
+    Args:
+        paths: rutas absolutas con query string (ej: "/b1s/v2/Items?$top=5")
+        headers: cabeceras comunes a cada GET (ej: Prefer)
+
+    Returns:
+        (Content-Type con el boundary, cuerpo)
+    """
+    boundary = f"batch_{uuid.uuid4()}"
+    lines = []
+    for path in paths:
+        lines += [
+            f"--{boundary}",
+            "Content-Type: application/http",
+            "Content-Transfer-Encoding: binary",
+            "",
+            f"GET {path} HTTP/1.1",
+        ]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        lines.append("")
+    lines += [f"--{boundary}--", ""]
+    return f"multipart/mixed;boundary={boundary}", '\r\n'.join(lines).encode('utf-8')
+
+
+def _boundary(content_type: str) -> str:
+    match = re.search(r'boundary="?([^";]+)"?', content_type or '')
+    if not match:
+        raise ValueError(f"Respuesta $batch sin boundary: {content_type}")
+    return match.group(1)
+
+
+def _split_head(block: bytes) -> Tuple[bytes, bytes]:
+    """Separar cabeceras y cuerpo (acepta CRLF o LF)"""
+    for separator in (b'\r\n\r\n', b'\n\n'):
+        head, found, body = block.partition(separator)
+        if found:
+            return head, body
+    return block, b''
+
+
+def _headers(head: bytes) -> Dict[str, str]:
+    headers = {}
+    for line in head.decode('iso-8859-1').splitlines()[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def decode(content_type: str, payload: bytes) -> List[Response]:
+    """Respuestas de cada parte de un multipart $batch, en orden"""
+    delimiter = b'--' + _boundary(content_type).encode('ascii')
+    responses = []
+    for part in payload.split(delimiter)[1:]:
+        if part.startswith(b'--'):
+            break
+        # Cabeceras de la parte (Content-Type: application/http) y luego la respuesta HTTP
+        _, http = _split_head(part.lstrip(b'\r\n'))
+        head, body = _split_head(http.lstrip(b'\r\n'))
+        status_line = head.split(b'\n', 1)[0].decode('iso-8859-1').strip()
+        match = re.match(r'HTTP/\d\.\d\s+(\d{3})', status_line)
+        if not match:
+            raise ValueError(f"Parte $batch sin línea de estado: {status_line[:80]}")
+        if body.endswith(CRLF):
+            body = body[:-2]
+        elif body.endswith(b'\n'):
+            body = body[:-1]
+        responses.append((int(match.group(1)), _headers(head), body))
+    return responses
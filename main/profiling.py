@@ -0,0 +1,163 @@
+"""
+Perfilado bajo demanda de peticiones al chat
+
+Se activa por petición con la cabecera X-Profile o para todas las peticiones
+desde el admin (ProfilingSettings). La petición se ejecuta bajo cProfile y
+tracemalloc y el resultado se guarda en RequestProfile con su request id, que
+se devuelve en la cabecera X-Request-Id.
+
+La cabecera sólo se acepta si coincide con la variable de entorno
+PROFILING_TOKEN o, si ésta no está definida, cuando DEBUG está activo.
+
+tracemalloc rastrea todo el proceso: peak_memory_kb y las asignaciones
+incluyen las de otras peticiones concurrentes. Desde Python 3.12 cProfile
+no admite dos perfiles a la vez; una petición que llega mientras otra se
+perfila se ejecuta sin perfilar.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+
+SETTINGS_CACHE_SECONDS = 5
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+_settings_cache = {"enabled": False, "expires": 0.0}
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _admin_toggle_enabled() -> bool:
+    """Leer el interruptor del admin (cacheado unos segundos para no consultar la base en cada petición)"""
+    now = time.monotonic()
+    if now >= _settings_cache["expires"]:
+        from .models import ProfilingSettings
+        try:
+            _settings_cache["enabled"] = ProfilingSettings.objects.filter(pk=1, enabled=True).exists()
+        except Exception:
+            _settings_cache["enabled"] = False
+        _settings_cache["expires"] = now + SETTINGS_CACHE_SECONDS
+    return _settings_cache["enabled"]
+
+
+def profiling_trigger(request):
+    """Retorna 'header', 'admin' o None según si hay que perfilar la petición"""
+    header = request.META.get('HTTP_X_PROFILE')
+    if header:
+        token = os.environ.get('PROFILING_TOKEN')
+        if (token and header == token) or (not token and settings.DEBUG):
+            return 'header'
+    if _admin_toggle_enabled():
+        return 'admin'
+    return None
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    """Tomar snapshot y pico; sólo el último usuario detiene el rastreo"""
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        _, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    return snapshot, peak
+
+
+def _format_stats(profiler, restriction=None) -> str:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats('cumulative')
+    if restriction:
+        stats.print_stats(restriction, TOP_FUNCTIONS)
+    else:
+        stats.print_stats(TOP_FUNCTIONS)
+    return stream.getvalue()
+
+
+def _format_allocations(snapshot) -> str:
+    if snapshot is None:
+        return ''
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ])
+    lines = []
+    for index, stat in enumerate(snapshot.statistics('lineno')[:TOP_ALLOCATIONS], 1):
+        frame = stat.traceback[0]
+        lines.append(f"{index:>2}. {frame.filename}:{frame.lineno} — {stat.size / 1024:.1f} KiB en {stat.count} bloques")
+    return '\n'.join(lines)
+
+
+def run_profiled(request, view_func, trigger):
+    """Ejecutar la vista bajo cProfile + tracemalloc y guardar el perfil"""
+    from .models import RequestProfile
+
+    request_id = uuid.uuid4().hex[:16]
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Desde Python 3.12 sólo puede haber un perfilador activo por proceso
+        print(f"⚠️ Petición sin perfilar, ya hay otro perfil en curso: {e}")
+        return view_func(request)
+
+    tracing = False
+    start = time.perf_counter()
+    try:
+        _start_tracemalloc()
+        tracing = True
+        response = view_func(request)
+    finally:
+        profiler.disable()
+        duration_ms = (time.perf_counter() - start) * 1000
+        snapshot, peak = _stop_tracemalloc() if tracing else (None, 0)
+
+    try:
+        message = json.loads(request.body or b'{}').get('message', '')
+    except (ValueError, AttributeError):
+        message = ''
+
+    try:
+        RequestProfile.objects.create(
+            request_id=request_id,
+            path=request.path[:200],
+            message=str(message)[:500],
+            trigger=trigger,
+            status_code=getattr(response, 'status_code', None),
+            duration_ms=round(duration_ms, 2),
+            peak_memory_kb=round(peak / 1024, 1),
+            profile_stats=_format_stats(profiler),
+            tool_stats=_format_stats(profiler, 'sap_service_layer'),
+            top_allocations=_format_allocations(snapshot),
+        )
+        print(f"🔬 Perfil guardado: {request_id} ({duration_ms:.0f} ms)")
+    except Exception as e:
+        print(f"⚠️ Error guardando perfil: {e}")
+
+    response['X-Request-Id'] = request_id
+    return response
+
+
+def maybe_profile(request, view_func):
+    """Perfilar la petición si está pedido; si no, ejecutarla tal cual"""
+    trigger = profiling_trigger(request)
+    if not trigger:
+        return view_func(request)
+    return run_profiled(request, view_func, trigger)
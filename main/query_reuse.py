@@ -0,0 +1,243 @@
+"""
+Reutilización de consultas ya guardadas en QueryCache
+
+Durante una investigación el modelo suele repetir la misma consulta en
+varias iteraciones, o pedir un subconjunto de algo que ya trajo (facturas
+del 1 al 10 de enero después de traer todo enero). Antes de ir al Service
+Layer, query_sap_service_layer busca en las consultas recientes de la sesión:
+
+- Coincidencia exacta: misma entidad, filtros, $select y $top.
+- Subconjunto: una consulta completa (sin $top) cuyos filtros quedan
+  implicados por los nuevos y cuyo $select incluye todos los campos
+  pedidos; los registros se filtran, proyectan y recortan localmente.
+
+Sólo se entienden filtros que son conjunciones de comparaciones simples
+(campo eq/ne/gt/ge/lt/le literal unidas por "and"); cualquier otra cosa
+(or, paréntesis, funciones) solo puede reutilizarse por coincidencia exacta.
+Los textos se comparan sin distinguir mayúsculas, como la intercalación
+habitual de la base de SAP; los rangos (gt/ge/lt/le) sobre textos sólo se
+filtran localmente si son fechas AAAA-MM-DD, porque el orden del resto
+depende de la intercalación.
+
+Variables de entorno:
+    QUERY_REUSE_MAX_AGE   antigüedad máxima en segundos de una consulta
+                          reutilizable (default 900, 0 lo desactiva)
+"""
+import os
+import re
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import codec, write_behind
+
+MAX_AGE = int(os.environ.get('QUERY_REUSE_MAX_AGE', 900))
+MAX_CANDIDATES = 20
+
+Condition = Tuple[str, str, Any]
+
+_CONDITION = re.compile(
+    r"^\s*([A-Za-z_][A-Za-z0-9_]*)\s+(eq|ne|gt|ge|lt|le)\s+"
+    r"('(?:[^']|'')*'|-?\d+(?:\.\d+)?|true|false)\s*$"
+)
+_DATE_LITERAL = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def parse_filters(filters: Optional[str]) -> Optional[List[Condition]]:
+    """Condiciones (campo, operador, valor) de un $filter conjuntivo, o None si no se entiende"""
+    if not filters or not filters.strip():
+        return []
+    conditions = []
+    for part in re.split(r'\s+and\s+', filters.strip(), flags=re.IGNORECASE):
+        match = _CONDITION.match(part)
+        if not match:
+            return None
+        field, op, literal = match.groups()
+        if literal.startswith("'"):
+            value = literal[1:-1].replace("''", "'")
+        elif literal in ('true', 'false'):
+            value = literal == 'true'
+        else:
+            value = float(literal) if '.' in literal else int(literal)
+        conditions.append((field, op, value))
+    return conditions
+
+
+def _fold(value):
+    """Texto en minúsculas (sin distinguir mayúsculas, como la base de SAP)"""
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _comparable(a, b) -> bool:
+    return isinstance(a, str) == isinstance(b, str) and isinstance(a, bool) == isinstance(b, bool)
+
+
+def _implies(condition: Condition, required: Condition) -> bool:
+    """¿Cumplir `condition` garantiza cumplir `required` (mismo campo)?"""
+    _, op, value = condition
+    _, required_op, bound = required
+    value, bound = _fold(value), _fold(bound)
+    if not _comparable(value, bound):
+        return False
+    if required_op == 'eq':
+        return op == 'eq' and value == bound
+    if required_op == 'ne':
+        return (op == 'eq' and value != bound) or (op == 'ne' and value == bound)
+    if required_op in ('ge', 'gt'):
+        if op == 'eq':
+            return value >= bound if required_op == 'ge' else value > bound
+        if op in ('ge', 'gt'):
+            return value >= bound if (required_op == 'ge' or op == 'gt') else value > bound
+        return False
+    if required_op in ('le', 'lt'):
+        if op == 'eq':
+            return value <= bound if required_op == 'le' else value < bound
+        if op in ('le', 'lt'):
+            return value <= bound if (required_op == 'le' or op == 'lt') else value < bound
+    return False
+
+
+def subsumes(cached: List[Condition], requested: List[Condition]) -> bool:
+    """¿Todo registro que cumple `requested` cumple también `cached`?"""
+    return all(
+        any(field == required[0] and _implies((field, op, value), required) for field, op, value in requested)
+        for required in cached
+    )
+
+
+def _locally_comparable(conditions: List[Condition]) -> bool:
+    """¿Se pueden evaluar estas condiciones en Python igual que en la base?"""
+    return all(
+        op in ('eq', 'ne') or not isinstance(value, str) or _DATE_LITERAL.match(value)
+        for _, op, value in conditions
+    )
+
+
+def _matches(record: Dict[str, Any], conditions: List[Condition]) -> bool:
+    for field, op, bound in conditions:
+        value = record.get(field)
+        if value is None:
+            return False
+        if isinstance(bound, str) and isinstance(value, str) and _DATE_LITERAL.match(bound):
+            # SAP devuelve fechas como "2026-01-05T00:00:00Z"
+            value = value[:10]
+        if not _comparable(value, bound):
+            return False
+        value, bound = _fold(value), _fold(bound)
+        if op == 'eq' and not value == bound:
+            return False
+        if op == 'ne' and not value != bound:
+            return False
+        if op == 'gt' and not value > bound:
+            return False
+        if op == 'ge' and not value >= bound:
+            return False
+        if op == 'lt' and not value < bound:
+            return False
+        if op == 'le' and not value <= bound:
+            return False
+    return True
+
+
+def _select_fields(select: Optional[str]) -> Optional[set]:
+    fields = {name.strip() for name in (select or '').split(',') if name.strip()}
+    return fields or None
+
+
+def _same(a, b) -> bool:
+    return (a or None) == (b or None)
+
+
+def find_complete(session_id: str, entity: str, filters: str = "", select: str = "") -> Optional[int]:
+    """Id en QueryCache de una consulta reciente de la sesión idéntica y completa (sin $top), o None"""
+    if MAX_AGE <= 0:
+        return None
+    from django.utils import timezone
+    from main.models import QueryCache
+
+    since = timezone.now() - timedelta(seconds=MAX_AGE)
+    for row_id, params in (QueryCache.objects
+                           .filter(session_id=session_id, query_type=entity, timestamp__gte=since)
+                           .order_by('-timestamp')
+                           .values_list('id', 'query_params')[:MAX_CANDIDATES]):
+        params = params or {}
+        if not params.get('top') and _same(params.get('filters'), filters) and _same(params.get('select'), select):
+            return row_id
+    return None
+
+
+def find(session_id: str, entity: str, filters: str = "", select: str = "",
+         top: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Resultado de una consulta reciente de la sesión que responde a esta, o None
+
+    El resultado tiene la misma forma que SAPServiceLayer.query() más
+    "reused_from" (id de la consulta en QueryCache, None si todavía espera su
+    escritura diferida) y "reuse" ('exact' o 'subset').
+    """
+    if MAX_AGE <= 0:
+        return None
+    from django.utils import timezone
+    from main.models import QueryCache
+
+    since = timezone.now() - timedelta(seconds=MAX_AGE)
+    candidates = [
+        {"id": None, "query_params": row.query_params, "instance": row}
+        for row in reversed(write_behind.pending(QueryCache))
+        if row.session_id == session_id and row.query_type == entity and row.timestamp >= since
+    ]
+    candidates += list(
+        QueryCache.objects
+        .filter(session_id=session_id, query_type=entity, timestamp__gte=since)
+        .order_by('-timestamp')
+        .values('id', 'query_params')[:MAX_CANDIDATES]
+    )
+    if not candidates:
+        return None
+
+    def load(candidate) -> Dict[str, Any]:
+        if candidate['id'] is None:
+            data = candidate['instance'].result_data
+            return codec.loads(data.text) if isinstance(data, codec.RawJSON) else data
+        return QueryCache.objects.values_list('result_data', flat=True).get(id=candidate['id'])
+
+    for candidate in candidates:
+        params = candidate['query_params'] or {}
+        if _same(params.get('filters'), filters) and _same(params.get('select'), select) \
+                and _same(params.get('top'), top):
+            return dict(load(candidate), reused_from=candidate['id'], reuse='exact')
+
+    requested = parse_filters(filters)
+    if requested is None or not _locally_comparable(requested):
+        return None
+    requested_fields = _select_fields(select)
+    filter_fields = {field for field, _, _ in requested}
+
+    for candidate in candidates:
+        params = candidate['query_params'] or {}
+        if params.get('top'):
+            continue
+        cached = parse_filters(params.get('filters'))
+        if cached is None or not subsumes(cached, requested):
+            continue
+        cached_fields = _select_fields(params.get('select'))
+        if cached_fields is not None and (
+                requested_fields is None or not (requested_fields | filter_fields) <= cached_fields):
+            continue
+
+        result = load(candidate)
+        records = [record for record in result.get('data', []) if _matches(record, requested)]
+        if top:
+            records = records[:top]
+        projection = codec.fields_from_select(select)
+        if projection and projection.keys() != cached_fields:
+            records = [codec.project(record, projection) for record in records]
+        return {
+            "success": True,
+            "data": records,
+            "count": len(records),
+            "endpoint": result.get('endpoint'),
+            "filters": filters,
+            "reused_from": candidate['id'],
+            "reuse": 'subset',
+        }
+    return None
@@ -0,0 +1,159 @@
+"""
+Retención de QueryCache
+
+Cada fila de QueryCache puede guardar un resultado de varios MB y antes sólo
+se borraban con "limpiar historial", así que db.sqlite3 crecía sin límite.
+enforce() aplica tres reglas, en este orden:
+- antigüedad máxima (QUERYCACHE_MAX_AGE_HOURS);
+- máximo de filas por sesión, conservando las más recientes
+  (QUERYCACHE_MAX_ROWS_PER_SESSION);
+- tamaño total máximo de los resultados, borrando las más antiguas
+  (QUERYCACHE_MAX_TOTAL_MB).
+
+Se ejecuta con `python manage.py prune_querycache` y, de forma oportunista,
+después de escribir filas nuevas (como mucho una vez cada ENFORCE_INTERVAL
+segundos). Las páginas liberadas se devuelven al sistema con
+"PRAGMA incremental_vacuum", que sólo funciona con auto_vacuum=INCREMENTAL:
+la migración 0006 convierte la base (un VACUUM completo, una vez) y, si una
+base no está convertida, se avisa en la primera poda en vez de no hacer nada
+en silencio.
+
+Un límite en 0 desactiva esa regla.
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from . import write_behind
+
+MAX_AGE_HOURS = float(os.environ.get('QUERYCACHE_MAX_AGE_HOURS', 24 * 7))
+MAX_ROWS_PER_SESSION = int(os.environ.get('QUERYCACHE_MAX_ROWS_PER_SESSION', 200))
+MAX_TOTAL_MB = float(os.environ.get('QUERYCACHE_MAX_TOTAL_MB', 200))
+ENFORCE_INTERVAL = 60
+VACUUM_PAGES = 2000
+DELETE_CHUNK = 500
+
+_last_enforced = 0.0
+_lock = threading.Lock()
+_warned_auto_vacuum = False
+
+
+def _delete(ids) -> int:
+    from main.models import QueryCache
+
+    ids = list(ids)
+    deleted = 0
+    for start in range(0, len(ids), DELETE_CHUNK):
+        deleted += QueryCache.objects.filter(id__in=ids[start:start + DELETE_CHUNK]).delete()[0]
+    return deleted
+
+
+def enforce(max_age_hours: Optional[float] = None, max_rows_per_session: Optional[int] = None,
+            max_total_mb: Optional[float] = None, vacuum_pages: int = VACUUM_PAGES) -> Dict[str, int]:
+    """
+    Borrar las filas que exceden los límites (por defecto los de las variables de entorno)
+
+    vacuum_pages limita cuántas páginas libres se devuelven al sistema en esta
+    pasada (0 = todas).
+
+    Returns:
+        Filas borradas por cada regla y páginas liberadas por el vacuum incremental
+    """
+    from django.db.models import Count, Sum
+    from django.utils import timezone
+    from main.models import QueryCache
+
+    max_age_hours = MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+    max_rows_per_session = MAX_ROWS_PER_SESSION if max_rows_per_session is None else max_rows_per_session
+    max_total_mb = MAX_TOTAL_MB if max_total_mb is None else max_total_mb
+    removed = {"age": 0, "session_rows": 0, "total_size": 0}
+
+    if max_age_hours > 0:
+        cutoff = timezone.now() - timedelta(hours=max_age_hours)
+        removed["age"] = QueryCache.objects.filter(timestamp__lt=cutoff).delete()[0]
+
+    if max_rows_per_session > 0:
+        crowded = (QueryCache.objects.values('session_id')
+                   .annotate(rows=Count('id')).filter(rows__gt=max_rows_per_session))
+        for session in crowded:
+            stale = (QueryCache.objects.filter(session_id=session['session_id'])
+                     .order_by('-timestamp').values_list('id', flat=True)[max_rows_per_session:])
+            removed["session_rows"] += _delete(stale)
+
+    if max_total_mb > 0:
+        limit = int(max_total_mb * 1024 * 1024)
+        total = QueryCache.objects.aggregate(total=Sum('result_size'))['total'] or 0
+        if total > limit:
+            stale = []
+            for row_id, size in QueryCache.objects.order_by('timestamp').values_list('id', 'result_size').iterator():
+                if total <= limit:
+                    break
+                stale.append(row_id)
+                total -= size
+            removed["total_size"] = _delete(stale)
+
+    removed["vacuumed_pages"] = incremental_vacuum(vacuum_pages) if any(removed.values()) else 0
+    return removed
+
+
+def incremental_vacuum(pages: int = VACUUM_PAGES) -> int:
+    """Devolver al sistema hasta `pages` páginas libres, 0 = todas (sólo con auto_vacuum=INCREMENTAL)"""
+    global _warned_auto_vacuum
+    from django.db import connection
+
+    if connection.vendor != 'sqlite':
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            if not _warned_auto_vacuum:
+                _warned_auto_vacuum = True
+                print("⚠️⚠️ La base SQLite no usa auto_vacuum=INCREMENTAL: las filas podadas de QueryCache "
+                      "NO devuelven espacio al disco. Ejecuta `python manage.py migrate` o "
+                      "`python manage.py prune_querycache --vacuum`")
+            return 0
+        cursor.execute('PRAGMA freelist_count')
+        free_before = cursor.fetchone()[0]
+        # Con execute() el módulo sqlite3 avanza la pragma un solo paso (una página);
+        # executescript() la ejecuta completa
+        connection.connection.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        cursor.execute('PRAGMA freelist_count')
+        return free_before - cursor.fetchone()[0]
+
+
+def enable_incremental_vacuum(connection=None) -> bool:
+    """Pasar la base a auto_vacuum=INCREMENTAL (VACUUM completo); True si hubo que convertirla"""
+    if connection is None:
+        from django.db import connection
+
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] == 2:
+            return False
+        cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        cursor.execute('VACUUM')
+    return True
+
+
+def _on_write(model, instances):
+    """Poda oportunista tras escribir filas de QueryCache (como mucho cada ENFORCE_INTERVAL)"""
+    global _last_enforced
+    from main.models import QueryCache
+
+    if model is not QueryCache:
+        return
+    now = time.monotonic()
+    with _lock:
+        if now - _last_enforced < ENFORCE_INTERVAL:
+            return
+        _last_enforced = now
+    removed = enforce()
+    if any(removed.values()):
+        print(f"🧹 Retención de QueryCache: {removed}")
+
+
+write_behind.add_listener(_on_write)
@@ -0,0 +1,795 @@
+"""
+Service Layer simulado para pruebas locales y benchmarks
+
+Implementa un subconjunto del protocolo de SAP Business One Service Layer
+(/Login, /Logout y colecciones paginadas de /Invoices, /CreditNotes, /Items,
+/BusinessPartners y /SalesPersons con $top, $skip, $filter, $select y $orderby, también
+dentro de un POST /$batch) sobre un conjunto de datos
+determinístico generado en memoria, con latencia y tamaño configurables.
+
+Uso:
+    python -m main.sap_mock_server --documents 10000 --port 50001 --config sap_config.mock.json
+    set SAP_CONFIG_PATH=sap_config.mock.json  (o export en Linux/Mac)
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+BASE_PATH = '/b1s/v2'
+
+# Campos de relleno de cada línea para que el tamaño de las páginas se parezca al real
+LINE_FILLER_FIELDS = {
+    "WarehouseCode": "01",
+    "TaxCode": "IVA",
+    "Currency": "USD",
+    "DiscountPercent": 0.0,
+    "AccountCode": "_SYS00000000123",
+    "CostingCode": "VENTAS",
+    "ProjectCode": "",
+    "UoMCode": "UND",
+    "LineStatus": "C",
+    "TaxPercentagePerRow": 16.0,
+    "ShipDate": None,
+    "FreeText": "",
+}
+
+CUSTOMER_NAMES = [
+    "EFRAIN CHABASQUEN", "INVERSIONES LA PAZ", "COMERCIAL EL SOL", "DISTRIBUIDORA CENTRAL",
+    "BODEGON LOS ANDES", "FERRETERIA ORIENTE", "MERCADO POPULAR", "SUPERMERCADO NORTE",
+]
+
+SALES_PERSON_NAMES = [
+    "JEAN MORENO", "MARIA PEREZ", "CARLOS GOMEZ", "ANA RODRIGUEZ", "LUIS HERNANDEZ",
+    "CARMEN DIAZ", "JOSE MARTINEZ", "LAURA TORRES",
+]
+
+WAREHOUSES = ("01", "02", "03")
+
+ENDPOINTS_METADATA = {
+    "Items": {
+        "endpoint": "/Items",
+        "description": "Maestro de artículos (simulado)",
+        "common_fields": ["ItemCode", "ItemName", "ItemsGroupCode", "OnHand", "AvgPrice", "Valid",
+                          "ItemWarehouseInfoCollection"],
+    },
+    "Invoices": {
+        "endpoint": "/Invoices",
+        "description": "Facturas de venta (simuladas)",
+        "common_fields": ["DocEntry", "DocNum", "CardCode", "CardName", "DocDate", "DocTotal", "SalesPersonCode", "DocumentLines"],
+    },
+    "CreditNotes": {
+        "endpoint": "/CreditNotes",
+        "description": "Notas de crédito (simuladas)",
+        "common_fields": ["DocEntry", "DocNum", "CardCode", "CardName", "DocDate", "DocTotal", "SalesPersonCode", "DocumentLines"],
+    },
+    "BusinessPartners": {
+        "endpoint": "/BusinessPartners",
+        "description": "Socios de negocio (simulados)",
+        "common_fields": ["CardCode", "CardName", "CardType", "GroupCode", "Phone1"],
+    },
+    "SalesPersons": {
+        "endpoint": "/SalesPersons",
+        "description": "Vendedores (simulados)",
+        "common_fields": ["SalesEmployeeCode", "SalesEmployeeName", "Active"],
+    },
+}
+
+
+class ODataError(Exception):
+    """Error de sintaxis o semántica OData (se responde como HTTP 400)"""
+
+
+class MockDataset:
+    """
+    Conjunto de datos determinístico de documentos y artículos
+
+    Los documentos no se guardan: se generan a partir de su índice, de modo que
+    100k facturas no ocupan memoria y las fechas son monótonas (DocEntry y
+    DocDate crecen juntos), lo que permite acotar rangos con búsqueda binaria.
+    """
+
+    def __init__(self, documents: int = 1000, credit_note_ratio: float = 0.05,
+                 items: int = 500, customers: int = 300, sales_persons: int = 25,
+                 start_date: str = '2026-01-01', days: int = 90, max_lines: int = 5,
+                 seed: int = 42):
+        rng = random.Random(seed)
+        self.start = date.fromisoformat(start_date)
+        self.days = days
+        self.max_lines = max_lines
+        self.num_items = items
+        self.num_customers = customers
+        self.num_sales_persons = sales_persons
+
+        # Precios fijos por artículo (algunos por debajo de $3 para ejercitar la regla)
+        self.item_prices = [round(rng.uniform(0.5, 120.0), 2) for _ in range(items)]
+        self.item_stock = [rng.randint(0, 500) for _ in range(items)]
+
+        self.collections = {
+            'Invoices': (documents, lambda i, lines=True: self._document(i, documents, 1, lines)),
+            'CreditNotes': (max(1, int(documents * credit_note_ratio)),
+                            lambda i, lines=True: self._document(i, max(1, int(documents * credit_note_ratio)), 3, lines)),
+            'Items': (items, lambda i, lines=True: self._item(i)),
+            'BusinessPartners': (customers, lambda i, lines=True: self._partner(i)),
+            'SalesPersons': (sales_persons, lambda i, lines=True: self._sales_person(i)),
+        }
+
+    def count(self, entity: str) -> int:
+        return self.collections[entity][0]
+
+    def build(self, entity: str, index: int, lines: bool = True) -> Dict[str, Any]:
+        return self.collections[entity][1](index, lines)
+
+    def doc_date(self, index: int, total: int) -> str:
+        return (self.start + timedelta(days=(index * self.days) // total)).isoformat()
+
+    def date_range(self) -> tuple:
+        """Primer y último DocDate posibles del conjunto"""
+        return self.start.isoformat(), (self.start + timedelta(days=self.days - 1)).isoformat()
+
+    def _document(self, i: int, total: int, salt: int, lines: bool) -> Dict[str, Any]:
+        customer = (i * 7919 + salt) % self.num_customers
+        doc = {
+            "DocEntry": i + 1,
+            "DocNum": 3400000 + i,
+            "CardCode": f"C{customer:05d}",
+            "CardName": self.customer_name(customer),
+            "DocDate": self.doc_date(i, total),
+            "SalesPersonCode": (i * 31 + salt) % self.num_sales_persons + 1,
+            "DocumentStatus": "C",
+        }
+        document_lines = []
+        doc_total = 0.0
+        for j in range(1 + (i * 13 + salt) % self.max_lines):
+            item = (i * 17 + j * 101 + salt) % self.num_items
+            quantity = float(1 + (i + j * 7) % 12)
+            price = self.item_prices[item]
+            line_total = round(price * quantity, 2)
+            doc_total += line_total
+            if lines:
+                line = {
+                    "LineNum": j,
+                    "ItemCode": f"A{item:06d}",
+                    "ItemDescription": f"ARTICULO {item}",
+                    "Quantity": quantity,
+                    "Price": price,
+                    "UnitPrice": price,
+                    "LineTotal": line_total,
+                }
+                line.update(LINE_FILLER_FIELDS)
+                document_lines.append(line)
+        doc["DocTotal"] = round(doc_total, 2)
+        if lines:
+            doc["DocumentLines"] = document_lines
+        return doc
+
+    @staticmethod
+    def customer_name(i: int) -> str:
+        return f"{CUSTOMER_NAMES[i % len(CUSTOMER_NAMES)]} {i}"
+
+    @staticmethod
+    def sales_person_name(code: int) -> str:
+        base = SALES_PERSON_NAMES[(code - 1) % len(SALES_PERSON_NAMES)]
+        return base if code <= len(SALES_PERSON_NAMES) else f"{base} {code}"
+
+    def _partner(self, i: int) -> Dict[str, Any]:
+        return {
+            "CardCode": f"C{i:05d}",
+            "CardName": self.customer_name(i),
+            "CardType": "cCustomer",
+            "GroupCode": 100 + i % 5,
+            "Phone1": f"0212{i:07d}",
+        }
+
+    def _sales_person(self, i: int) -> Dict[str, Any]:
+        return {
+            "SalesEmployeeCode": i + 1,
+            "SalesEmployeeName": self.sales_person_name(i + 1),
+            "Active": "tYES",
+        }
+
+    def _item(self, i: int) -> Dict[str, Any]:
+        return {
+            "ItemCode": f"A{i:06d}",
+            "ItemName": f"ARTICULO {i}",
+            "ItemsGroupCode": 100 + i % 12,
+            "OnHand": float(self.item_stock[i]),
+            "QuantityOnStock": float(self.item_stock[i]),
+            "AvgPrice": self.item_prices[i],
+            "Valid": "Y",
+            "ItemWarehouseInfoCollection": self._item_warehouses(i),
+        }
+
+    def _item_warehouses(self, i: int) -> List[Dict[str, Any]]:
+        """Reparto determinístico de OnHand entre los almacenes"""
+        stock = self.item_stock[i]
+        shares = (stock * 6 // 10, stock * 3 // 10)
+        rows = []
+        for j, warehouse in enumerate(WAREHOUSES):
+            in_stock = shares[j] if j < len(shares) else stock - sum(shares)
+            rows.append({
+                "ItemCode": f"A{i:06d}",
+                "WarehouseCode": warehouse,
+                "InStock": float(in_stock),
+                "Committed": float(min(in_stock, (i * 7 + j) % 20)),
+                "Ordered": float((i * 13 + j * 5) % 50 if (i + j) % 4 == 0 else 0),
+                "MinimalStock": 0.0,
+            })
+        return rows
+
+
+# --- Parser mínimo de $filter -------------------------------------------------
+
+_TOKEN_RE = re.compile(r"\s*(?:(\()|(\))|(,)|('(?:[^']|'')*')|(-?\d+(?:\.\d+)?)|([A-Za-z_][A-Za-z0-9_/]*))")
+_COMPARATORS = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b,
+    'ge': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b,
+    'le': lambda a, b: a is not None and a <= b,
+}
+
+
+def _tokenize(text: str) -> List[tuple]:
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise ODataError(f"Token inválido en $filter cerca de: {text[pos:pos + 20]}")
+        lparen, rparen, comma, string, number, ident = match.groups()
+        if lparen:
+            tokens.append(('(', None))
+        elif rparen:
+            tokens.append((')', None))
+        elif comma:
+            tokens.append((',', None))
+        elif string is not None:
+            tokens.append(('value', string[1:-1].replace("''", "'")))
+        elif number is not None:
+            tokens.append(('value', float(number) if '.' in number else int(number)))
+        else:
+            tokens.append(('ident', ident))
+        pos = match.end()
+    return tokens
+
+
+class ODataFilter:
+    """
+    Compila un $filter (comparaciones, and/or, paréntesis, substringof) a un predicado
+
+    Además extrae las comparaciones sobre campos monótonos (DocEntry, DocDate)
+    del nivel superior para acotar el rango de índices sin evaluar documentos.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+        self.bounds: List[tuple] = []
+        self.only_bounds = True
+        self.predicate = self._parse_or(top_level=True)
+        if self.pos != len(self.tokens):
+            raise ODataError(f"$filter inválido: {text}")
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _expect(self, kind):
+        token = self._next()
+        if token[0] != kind:
+            raise ODataError(f"$filter inválido: se esperaba '{kind}' en {self.text}")
+        return token
+
+    def _parse_or(self, top_level=False):
+        left = self._parse_and(top_level)
+        while self._peek() == ('ident', 'or'):
+            self._next()
+            self.only_bounds = False
+            right = self._parse_and(False)
+            left = (lambda l, r: lambda doc: l(doc) or r(doc))(left, right)
+        return left
+
+    def _parse_and(self, top_level):
+        start = len(self.bounds)
+        left = self._parse_term(top_level)
+        while self._peek() == ('ident', 'and'):
+            self._next()
+            right = self._parse_term(top_level)
+            left = (lambda l, r: lambda doc: l(doc) and r(doc))(left, right)
+        if self._peek() == ('ident', 'or'):
+            # Las cotas sólo son válidas si toda la expresión es una conjunción
+            del self.bounds[start:]
+        return left
+
+    def _parse_term(self, top_level):
+        kind, value = self._peek()
+        if kind == '(':
+            self._next()
+            inner = self._parse_or(False)
+            self._expect(')')
+            return inner
+        if kind == 'ident' and value == 'not':
+            self._next()
+            self.only_bounds = False
+            inner = self._parse_term(False)
+            return lambda doc: not inner(doc)
+        if kind == 'ident' and value == 'substringof':
+            self._next()
+            self._expect('(')
+            needle = self._expect('value')[1]
+            self._expect(',')
+            field = self._expect('ident')[1]
+            self._expect(')')
+            self.only_bounds = False
+            return lambda doc: needle.lower() in str(doc.get(field) or '').lower()
+        if kind != 'ident':
+            raise ODataError(f"$filter inválido: {self.text}")
+        field = self._next()[1]
+        op = self._expect('ident')[1]
+        if op not in _COMPARATORS:
+            raise ODataError(f"Operador no soportado '{op}' en $filter")
+        literal = self._expect('value')[1]
+        if top_level and field in ('DocEntry', 'DocDate') and op != 'ne':
+            self.bounds.append((field, op, literal))
+        else:
+            self.only_bounds = False
+        compare = _COMPARATORS[op]
+        return lambda doc: compare(doc.get(field), literal)
+
+
+class MockServiceLayer:
+    """Servidor HTTP local que emula SAP B1 Service Layer"""
+
+    def __init__(self, dataset: Optional[MockDataset] = None, host: str = '127.0.0.1',
+                 port: int = 0, latency: float = 0.0, page_size: int = 20,
+                 max_page_size: int = 5000, username: str = 'manager@MOCKDB',
+                 password: str = 'mock', verbose: bool = False, max_concurrent: int = 0):
+        self.dataset = dataset or MockDataset()
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.username = username
+        self.password = password
+        self.verbose = verbose
+        # Con max_concurrent > 0 las consultas por encima de ese número de
+        # peticiones simultáneas reciben 503 (como un Service Layer saturado)
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.sessions = set()
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._index_cache: Dict[tuple, Any] = {}
+        self.reset_stats()
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> 'MockServiceLayer':
+        self._server = ThreadingHTTPServer((self.host, self.port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}{BASE_PATH}"
+
+    def write_config(self, path: str) -> str:
+        """Escribir un sap_config.json que apunta a este servidor"""
+        config = {
+            "service_layer": {
+                "base_url": self.base_url,
+                "username": self.username,
+                "password": self.password,
+                "verify_ssl": False,
+            },
+            "endpoints": ENDPOINTS_METADATA,
+        }
+        # Escritura atómica: otro proceso puede estar esperando el archivo
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    # --- Estadísticas ---
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "logins": 0, "pages": 0, "records": 0, "bytes_sent": 0,
+                          "rejected": 0, "max_in_flight": 0}
+
+    def enter_request(self) -> bool:
+        """Registrar una consulta en curso; False si supera max_concurrent"""
+        with self._lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                self.stats["rejected"] += 1
+                return False
+            self.in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+            return True
+
+    def exit_request(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    # --- Consultas ---
+
+    def _indices(self, entity: str, filters: Optional[str]):
+        """Índices de documentos que cumplen el filtro (cacheados por filtro)"""
+        key = (entity, filters)
+        with self._lock:
+            cached = self._index_cache.get(key)
+        if cached is not None:
+            return cached
+
+        total = self.dataset.count(entity)
+        candidates = range(total)
+        if filters:
+            odata_filter = ODataFilter(filters)
+            low, high = 0, total
+            if entity in ('Invoices', 'CreditNotes'):
+                for field, op, literal in odata_filter.bounds:
+                    if field == 'DocDate':
+                        key_fn = lambda i: self.dataset.doc_date(i, total)
+                        literal = str(literal)[:10]
+                    else:
+                        key_fn = lambda i: i + 1
+                    if op in ('gt', 'le'):
+                        edge = bisect_right(candidates, literal, key=key_fn)
+                    else:
+                        edge = bisect_left(candidates, literal, key=key_fn)
+                    if op in ('gt', 'ge'):
+                        low = max(low, edge)
+                    elif op in ('lt', 'le'):
+                        high = min(high, edge)
+                    else:  # eq
+                        low = max(low, edge)
+                        high = min(high, bisect_right(candidates, literal, key=key_fn))
+                candidates = range(low, max(low, high))
+                bounded = odata_filter.only_bounds
+            else:
+                bounded = False
+            if not bounded:
+                build = self.dataset.build
+                predicate = odata_filter.predicate
+                candidates = [i for i in candidates if predicate(build(entity, i, lines=False))]
+
+        with self._lock:
+            self._index_cache[key] = candidates
+        return candidates
+
+    def handle_collection(self, entity: str, params: Dict[str, str], prefer: str) -> tuple:
+        """Resolver una página de una colección. Retorna (status, body, headers)"""
+        try:
+            top = int(params['$top']) if '$top' in params else None
+            skip = int(params.get('$skip', 0))
+        except ValueError:
+            raise ODataError("$top y $skip deben ser enteros")
+        select = [f.strip() for f in params.get('$select', '').split(',') if f.strip()]
+        orderby = params.get('$orderby', '').strip()
+
+        indices = self._indices(entity, params.get('$filter'))
+        headers = {}
+
+        page_size = self.page_size
+        match = re.search(r'odata\.maxpagesize=(\d+)', prefer or '')
+        if match:
+            page_size = max(1, min(int(match.group(1)), self.max_page_size))
+            headers['Preference-Applied'] = f"odata.maxpagesize={page_size}"
+
+        if orderby:
+            field, _, direction = orderby.partition(' ')
+            descending = direction.strip().lower() == 'desc'
+            if field == 'DocEntry' and entity in ('Invoices', 'CreditNotes'):
+                ordered = indices[::-1] if descending else indices
+            else:
+                build = self.dataset.build
+                ordered = sorted(indices, key=lambda i: build(entity, i, lines=False).get(field), reverse=descending)
+        else:
+            ordered = indices
+
+        limit = page_size if top is None else min(top, page_size)
+        page = [self.dataset.build(entity, i) for i in ordered[skip:skip + limit]]
+
+        if select:
+            sample = self.dataset.build(entity, 0)
+            invalid = [f for f in select if f not in sample]
+            if invalid:
+                raise ODataError(f"Property '{invalid[0]}' of '{entity}' is invalid")
+            page = [{f: doc[f] for f in select} for doc in page]
+
+        body = {"@odata.context": f"$metadata#{entity}", "value": page}
+        remaining = len(ordered) - (skip + len(page))
+        remaining_top = None if top is None else top - len(page)
+        if page and remaining > 0 and (remaining_top is None or remaining_top > 0):
+            next_params = {k: v for k, v in params.items() if k not in ('$skip', '$top')}
+            if remaining_top is not None:
+                next_params['$top'] = remaining_top
+            next_params['$skip'] = skip + len(page)
+            body["@odata.nextLink"] = f"{entity}?{urlencode(next_params)}"
+
+        self._count(pages=1, records=len(page))
+        return 200, body, headers
+
+
+def _error_body(code: int, message: str) -> Dict[str, Any]:
+    return {"error": {"code": code, "message": {"lang": "en-us", "value": message}}}
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Sin esto cada respuesta keep-alive espera el ACK retardado (~40 ms)
+    disable_nagle_algorithm = True
+
+    @property
+    def mock(self) -> MockServiceLayer:
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        if self.mock.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None):
+        payload = b'' if body is None else json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        if payload:
+            self.send_header('Content-Type', 'application/json;odata.metadata=minimal;charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if payload:
+            self.wfile.write(payload)
+        self.mock._count(requests=1, bytes_sent=len(payload))
+
+    def _error(self, status: int, code: int, message: str):
+        self._send(status, _error_body(code, message))
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _session_valid(self) -> bool:
+        cookies = self.headers.get('Cookie', '')
+        match = re.search(r'B1SESSION=([^;]+)', cookies)
+        return bool(match and match.group(1) in self.mock.sessions)
+
+    def _route(self) -> Optional[str]:
+        path = urlsplit(self.path).path
+        if not path.startswith(BASE_PATH + '/'):
+            return None
+        return path[len(BASE_PATH) + 1:]
+
+    def do_POST(self):
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        resource = self._route()
+        body = self._read_body()
+
+        if resource == 'Login':
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                return self._error(400, -1, "Invalid JSON body")
+            user = data.get('UserName', '')
+            company = data.get('CompanyDB', '')
+            expected_user, _, expected_company = self.mock.username.partition('@')
+            if user != expected_user or company != expected_company or data.get('Password') != self.mock.password:
+                return self._error(401, 100000027, "Login failed")
+            session_id = str(uuid.uuid4())
+            self.mock.sessions.add(session_id)
+            self.mock._count(logins=1)
+            return self._send(200, {"SessionId": session_id, "Version": "1000000", "SessionTimeout": 30},
+                              {'Set-Cookie': f"B1SESSION={session_id}; path={BASE_PATH}; HttpOnly"})
+
+        if resource == 'Logout':
+            cookies = self.headers.get('Cookie', '')
+            match = re.search(r'B1SESSION=([^;]+)', cookies)
+            if match:
+                self.mock.sessions.discard(match.group(1))
+            return self._send(204)
+
+        if resource == '$batch':
+            if not self.mock.enter_request():
+                return self._send(503, {"error": {"code": -1, "message": {"lang": "en-us", "value": "Service Unavailable"}}},
+                                  {'Retry-After': '1'})
+            try:
+                return self._batch(body)
+            finally:
+                self.mock.exit_request()
+
+        if resource == 'MockStats/reset':
+            self.mock.reset_stats()
+            return self._send(204)
+
+        return self._error(404, -1, "Unrecognized resource path.")
+
+    def do_GET(self):
+        resource = self._route()
+        if resource == 'MockStats':
+            return self._send(200, dict(self.mock.stats))
+        if not self.mock.enter_request():
+            return self._send(503, {"error": {"code": -1, "message": {"lang": "en-us", "value": "Service Unavailable"}}},
+                              {'Retry-After': '1'})
+        try:
+            if self.mock.latency:
+                time.sleep(self.mock.latency)
+            return self._get_collection(resource)
+        finally:
+            self.mock.exit_request()
+
+    def _get_collection(self, resource: Optional[str]):
+        status, body, headers = self._collection_response(resource, self.path, self.headers.get('Prefer', ''))
+        return self._send(status, body, headers)
+
+    def _collection_response(self, resource: Optional[str], target: str, prefer: str) -> tuple:
+        """(status, body, headers) de un GET a una colección"""
+        if resource not in self.mock.dataset.collections:
+            return 404, _error_body(-1, "Unrecognized resource path."), {}
+        if not self._session_valid():
+            return 401, _error_body(301, "Invalid session or session already timeout."), {}
+
+        query = parse_qs(urlsplit(target).query, keep_blank_values=True)
+        params = {key: values[-1] for key, values in query.items()}
+        try:
+            return self.mock.handle_collection(resource, params, prefer)
+        except ODataError as e:
+            return 400, _error_body(-1000, str(e)), {}
+
+    def _batch(self, body: bytes):
+        """POST /$batch: un GET por parte del multipart, respuestas en el mismo orden"""
+        match = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', ''))
+        if not match:
+            return self._error(400, -1, "Missing multipart boundary")
+        if not self._session_valid():
+            return self._error(401, 301, "Invalid session or session already timeout.")
+
+        response_boundary = f"batchresponse_{uuid.uuid4()}"
+        parts = []
+        for part in body.split(b'--' + match.group(1).encode('ascii'))[1:]:
+            if part.startswith(b'--'):
+                break
+            http = part.lstrip(b'\r\n').split(b'\r\n\r\n', 1)[-1]
+            lines = http.decode('utf-8').split('\r\n')
+            method, _, rest = lines[0].partition(' ')
+            target = rest.rsplit(' HTTP/', 1)[0]
+            headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            path = urlsplit(target).path
+            resource = path[len(BASE_PATH) + 1:] if path.startswith(BASE_PATH + '/') else None
+            if method != 'GET':
+                status, payload, extra = 400, _error_body(-1, "Only GET is supported in the mock $batch"), {}
+            else:
+                status, payload, extra = self._collection_response(resource, target, headers.get('Prefer', ''))
+            encoded = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            head = [f"HTTP/1.1 {status} {self.responses.get(status, ('',))[0]}",
+                    "Content-Type: application/json;odata.metadata=minimal;charset=utf-8",
+                    f"Content-Length: {len(encoded)}"]
+            head += [f"{name}: {value}" for name, value in extra.items()]
+            parts.append(
+                f"--{response_boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-Transfer-Encoding: binary\r\n\r\n".encode('ascii')
+                + '\r\n'.join(head).encode('ascii') + b'\r\n\r\n' + encoded + b'\r\n'
+            )
+        payload = b''.join(parts) + f"--{response_boundary}--\r\n".encode('ascii')
+
+        self.send_response(200)
+        self.send_header('Content-Type', f"multipart/mixed;boundary={response_boundary}")
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.mock._count(requests=1, bytes_sent=len(payload))
+
+
+def spawn_mock_server(config_path: str, documents: int = 1000, latency: float = 0.0,
+                      page_size: int = 20, days: int = 90, max_concurrent: int = 0,
+                      timeout: float = 30.0) -> subprocess.Popen:
+    """
+    Lanzar el servidor simulado en otro proceso (puerto libre) y esperar a que
+    escriba su sap_config.json. Así los benchmarks no comparten GIL ni
+    tracemalloc con el servidor.
+    """
+    if os.path.exists(config_path):
+        os.remove(config_path)
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'main.sap_mock_server', '--port', '0', '--config', config_path,
+         '--documents', str(documents), '--latency', str(latency),
+         '--page-size', str(page_size), '--days', str(days),
+         '--max-concurrent', str(max_concurrent)],
+        cwd=project_root, stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(config_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError("El Service Layer simulado no arrancó")
+        time.sleep(0.05)
+    return process
+
+
+def fetch_mock_stats(base_url: str, reset: bool = False) -> Dict[str, int]:
+    """Leer (y opcionalmente reiniciar) los contadores de un servidor simulado"""
+    with urlopen(f"{base_url}/MockStats") as response:
+        stats = json.loads(response.read())
+    if reset:
+        urlopen(Request(f"{base_url}/MockStats/reset", data=b'', method='POST')).close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service Layer simulado de SAP B1")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=50001)
+    parser.add_argument('--documents', type=int, default=1000, help="Cantidad de facturas")
+    parser.add_argument('--days', type=int, default=90, help="Días que abarcan los documentos desde --start-date")
+    parser.add_argument('--start-date', default='2026-01-01')
+    parser.add_argument('--latency', type=float, default=0.0, help="Latencia por petición en segundos")
+    parser.add_argument('--page-size', type=int, default=20, help="Tamaño de página del servidor (SAP usa 20)")
+    parser.add_argument('--max-concurrent', type=int, default=0,
+                        help="Responder 503 por encima de estas consultas simultáneas (0 = sin límite)")
+    parser.add_argument('--config', default=None, help="Ruta donde escribir un sap_config.json para este servidor")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    dataset = MockDataset(documents=args.documents, days=args.days, start_date=args.start_date)
+    mock = MockServiceLayer(dataset, host=args.host, port=args.port, latency=args.latency,
+                            page_size=args.page_size, verbose=args.verbose,
+                            max_concurrent=args.max_concurrent)
+    mock.start()
+    print(f"🧪 Service Layer simulado en {mock.base_url}")
+    print(f"   Facturas: {dataset.count('Invoices')} | Notas de crédito: {dataset.count('CreditNotes')} | Artículos: {dataset.count('Items')}")
+    if args.config:
+        mock.write_config(args.config)
+        print(f"   Configuración escrita en {args.config} (usa SAP_CONFIG_PATH={args.config})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
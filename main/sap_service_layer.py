@@ -4,8 +4,13 @@ Módulo para interactuar con SAP Business One Service Layer
 import requests
 import json
 import os
-from typing import Dict, List, Optional, Any
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import quote, urlencode, urljoin, urlsplit
 import urllib3
+from . import (codec, concurrency, document_cache, export, inventory, master_data, metrics, name_index, odata_batch,
+               query_reuse, singleflight, table_handles, write_behind)
 
 # Deshabilitar warnings de SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -13,6 +18,19 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Session ID global para el caché
 CURRENT_SESSION_ID = None
 
+# Tamaño de página pedido con "Prefer: odata.maxpagesize" (SAP usa 20 si no se pide)
+PAGE_SIZE = int(os.environ.get('SAP_PAGE_SIZE', 500))
+
+# Reintentos de una página ante 429/503 (ver concurrency.AIMDLimiter)
+OVERLOAD_RETRIES = 3
+
+# Consultas por petición $batch (Service Layer no fija un máximo, pero cada parte
+# se resuelve en serie del lado del servidor)
+BATCH_MAX_REQUESTS = 20
+
+# Consultas idénticas en curso (compartidas entre hilos del proceso)
+_inflight_queries = singleflight.Group()
+
 def get_session_id():
     """Obtener o crear session ID para el caché"""
     global CURRENT_SESSION_ID
@@ -26,11 +44,29 @@ def reset_session():
     global CURRENT_SESSION_ID
     CURRENT_SESSION_ID = None
 
+class _PageError(Exception):
+    """Respuesta de error del Service Layer durante una consulta paginada"""
+
+
+def _odata_literal(value) -> str:
+    """Literal OData de un valor (texto entre comillas, con las comillas duplicadas)"""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
 class SAPServiceLayer:
     """Cliente para SAP Business One Service Layer"""
     
-    def __init__(self, config_path: str = 'sap_config.json'):
-        """Inicializa el cliente con la configuración"""
+    def __init__(self, config_path: str = None):
+        """
+        Inicializa el cliente con la configuración
+
+        Si no se indica config_path se usa la variable de entorno SAP_CONFIG_PATH
+        (útil para apuntar al Service Layer simulado) o 'sap_config.json'.
+        """
+        if config_path is None:
+            config_path = os.environ.get('SAP_CONFIG_PATH', 'sap_config.json')
         with open(config_path, 'r', encoding='utf-8') as f:
             config = json.load(f)
         
@@ -46,18 +82,37 @@ class SAPServiceLayer:
         from requests.packages.urllib3.util.retry import Retry
         
         self.session = requests.Session()
+        # 429/503 de las consultas no se reintentan aquí: _get_page los reporta al
+        # limitador de concurrencia (que reduce el ritmo) y reintenta él mismo
         retry_strategy = Retry(
             total=3,
             backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
+            status_forcelist=[500, 502, 504],
             allowed_methods=["HEAD", "GET", "POST", "PUT", "DELETE", "OPTIONS", "TRACE"]
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
+        # Pedir páginas grandes; SAP responde con Preference-Applied el tamaño real
+        self.page_size = PAGE_SIZE
+        self.session.headers['Prefer'] = f"odata.maxpagesize={PAGE_SIZE}"
+        self.limiter = concurrency.get_limiter(self.base_url)
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10,
+                              pool_maxsize=max(20, self.limiter.max_limit))
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
+        # El login no pasa por el limitador: sí reintenta 429/503 (respetando Retry-After)
+        login_retry = Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"]
+        )
+        self.session.mount(f"{self.base_url}/Login", HTTPAdapter(max_retries=login_retry))
     
     def login(self) -> bool:
         """Autenticarse en Service Layer"""
+        with metrics.span('sap_login'):
+            return self._login()
+
+    def _login(self) -> bool:
         try:
             url = f"{self.base_url}/Login"
             
@@ -83,7 +138,7 @@ class SAPServiceLayer:
             )
             
             if response.status_code == 200:
-                data = response.json()
+                data = codec.loads(response.content)
                 self.session_id = data.get('SessionId')
                 print(f"✅ Login exitoso en SAP Service Layer")
                 print(f"   CompanyDB: {company_db}")
@@ -103,12 +158,59 @@ class SAPServiceLayer:
             if self.session_id:
                 url = f"{self.base_url}/Logout"
                 self.session.post(url, verify=self.verify_ssl, timeout=30)
+                self.session_id = None
                 print("✅ Logout exitoso")
         except Exception as e:
             print(f"⚠️ Error en logout: {e}")
     
+    def _get_page(self, endpoint: str, params: Dict[str, Any], fields: Optional[codec.FieldSpec] = None,
+                  url: Optional[str] = None):
+        """
+        GET de una página de Service Layer (instrumentado)
+
+        Pasa por el limitador de concurrencia del proceso; las respuestas 429/503
+        reducen el límite y se reintentan hasta OVERLOAD_RETRIES veces.
+
+        Con fields sólo se conservan esos campos de cada registro (ver codec.parse_page).
+        Con url (un nextLink) se pide esa URL tal cual en lugar de endpoint + params.
+
+        Returns:
+            (status_code, data decodificada o None, texto de error o None)
+        """
+        # Una página completa y un $top chico del mismo endpoint tardan distinto
+        top = str((params or {}).get('$top', ''))
+        key = f"{endpoint} $top" if not url and top.isdigit() and int(top) < self.page_size else endpoint
+        for attempt in range(OVERLOAD_RETRIES + 1):
+            with self.limiter.slot(key) as slot, metrics.span('sap_page_get', endpoint=endpoint):
+                response = self.session.get(
+                    url or f"{self.base_url}{endpoint}",
+                    params=None if url else params,
+                    verify=self.verify_ssl,
+                    timeout=180
+                )
+                slot.overloaded = response.status_code in concurrency.OVERLOAD_STATUS
+            if not slot.overloaded or attempt == OVERLOAD_RETRIES:
+                break
+            metrics.SAP_ERRORS.inc(endpoint=endpoint, status=response.status_code)
+            time.sleep(concurrency.retry_delay(response, attempt))
+        metrics.record_sap_page(endpoint, len(response.content))
+
+        # Tamaño de página que el servidor aceptó para "Prefer: odata.maxpagesize"
+        applied = re.search(r'odata\.maxpagesize=(\d+)', response.headers.get('Preference-Applied', ''))
+        if applied:
+            self.page_size = int(applied.group(1))
+
+        if response.status_code != 200:
+            metrics.SAP_ERRORS.inc(endpoint=endpoint, status=response.status_code)
+            return response.status_code, None, response.text
+
+        with metrics.span('json_decode', endpoint=endpoint):
+            data = codec.parse_page(response.content, fields)
+        return response.status_code, data, None
+
     def query(self, endpoint: str, filters: Optional[str] = None, 
-              select: Optional[str] = None, top: int = None) -> Dict[str, Any]:
+              select: Optional[str] = None, top: int = None,
+              fields: Optional[codec.FieldSpec] = None) -> Dict[str, Any]:
         """
         Ejecutar una consulta en Service Layer con paginación automática
         
@@ -117,20 +219,183 @@ class SAPServiceLayer:
             filters: Filtros OData (ej: "OnHand gt 0")
             select: Campos a seleccionar (ej: "ItemCode,ItemName")
             top: Cantidad de registros a retornar (None = TODOS los registros)
+            fields: Proyección local de cada registro, útil para quedarse con pocos
+                    campos de colecciones anidadas como DocumentLines (opcional)
         
         Returns:
-            Dict con los resultados de la consulta
+            Dict con los resultados de la consulta. Si otra petición está
+            ejecutando la misma consulta en este momento se espera a ella y se
+            comparte su resultado (no modificarlo).
+        """
+        key = singleflight.query_key(self.base_url, endpoint, filters, select, top, fields)
+        result, shared = _inflight_queries.do(
+            key, lambda: self._query(endpoint, filters, select, top, fields)
+        )
+        if shared:
+            metrics.SAP_COALESCED.inc(endpoint=endpoint)
+        return result
+
+    def batch(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Ejecutar varias consultas en una sola petición $batch
+
+        La primera página de cada consulta con top viaja en el mismo $batch (un
+        solo viaje de ida y vuelta); si alguna necesita más páginas se siguen
+        sus nextLink por separado. Las consultas sin top (colecciones
+        completas) van por query(), que pagina por cursor y comparte las
+        consultas idénticas en curso.
+
+        Args:
+            queries: dicts con endpoint y opcionalmente filters, select, top y
+                     fields (los mismos argumentos de query())
+
+        Returns:
+            Un resultado por consulta, en el mismo orden y con la forma de query()
+        """
+        if not queries:
+            return []
+        if not self.session_id:
+            if not self.login():
+                return [{"success": False, "error": "No se pudo autenticar en SAP Service Layer",
+                         "endpoint": q['endpoint']} for q in queries]
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+        bounded = []
+        for index, query in enumerate(queries):
+            if query.get('top'):
+                bounded.append(index)
+            else:
+                results[index] = self.query(query['endpoint'], query.get('filters'), query.get('select'),
+                                            None, query.get('fields'))
+
+        for start in range(0, len(bounded), BATCH_MAX_REQUESTS):
+            chunk = bounded[start:start + BATCH_MAX_REQUESTS]
+            if len(chunk) == 1:
+                query = queries[chunk[0]]
+                results[chunk[0]] = self.query(query['endpoint'], query.get('filters'), query.get('select'),
+                                               query['top'], query.get('fields'))
+                continue
+            print(f"📦 {len(chunk)} consultas en $batch")
+            try:
+                responses = self._post_batch([queries[index] for index in chunk])
+            except Exception as e:
+                for index in chunk:
+                    results[index] = {"success": False, "error": f"Excepción en $batch: {str(e)}",
+                                      "endpoint": queries[index]['endpoint']}
+                continue
+            for index, (status_code, headers, body) in zip(chunk, responses):
+                results[index] = self._batch_result(queries[index], status_code, body)
+        return results
+
+    def _post_batch(self, queries: List[Dict[str, Any]]) -> List[odata_batch.Response]:
+        base_path = urlsplit(self.base_url).path.rstrip('/')
+        paths = []
+        for query in queries:
+            params = {}
+            if query.get('top'):
+                params['$top'] = query['top']
+            if query.get('select'):
+                params['$select'] = query['select']
+            if query.get('filters'):
+                params['$filter'] = query['filters']
+            path = f"{base_path}{query['endpoint']}"
+            paths.append(f"{path}?{urlencode(params, quote_via=quote)}" if params else path)
+        content_type, body = odata_batch.encode(paths, {'Prefer': f"odata.maxpagesize={self.page_size}"})
+
+        for attempt in range(OVERLOAD_RETRIES + 1):
+            with self.limiter.slot('$batch') as slot, metrics.span('sap_batch'):
+                response = self.session.post(
+                    f"{self.base_url}/$batch",
+                    data=body,
+                    headers={'Content-Type': content_type},
+                    verify=self.verify_ssl,
+                    timeout=180
+                )
+                slot.overloaded = response.status_code in concurrency.OVERLOAD_STATUS
+            if not slot.overloaded or attempt == OVERLOAD_RETRIES:
+                break
+            metrics.SAP_ERRORS.inc(endpoint='/$batch', status=response.status_code)
+            time.sleep(concurrency.retry_delay(response, attempt))
+        metrics.record_sap_page('/$batch', len(response.content))
+
+        if response.status_code not in (200, 202):
+            metrics.SAP_ERRORS.inc(endpoint='/$batch', status=response.status_code)
+            raise _PageError(f"Error {response.status_code}: {response.text}")
+        responses = odata_batch.decode(response.headers.get('Content-Type', ''), response.content)
+        if len(responses) != len(queries):
+            raise _PageError(f"$batch devolvió {len(responses)} respuestas para {len(queries)} consultas")
+        return responses
+
+    def _batch_result(self, query: Dict[str, Any], status_code: int, body: bytes) -> Dict[str, Any]:
+        endpoint = query['endpoint']
+        top = query.get('top')
+        if status_code != 200:
+            metrics.SAP_ERRORS.inc(endpoint=endpoint, status=status_code)
+            return {"success": False, "error": f"Error {status_code}: {body.decode('utf-8', 'replace')}",
+                    "endpoint": endpoint}
+        try:
+            with metrics.span('json_decode', endpoint=endpoint):
+                data = codec.parse_page(body, query.get('fields'))
+            records = data.get('value', [])
+            next_url = self._next_url(data)
+            seen_urls = set()
+            while next_url and (not top or len(records) < top):
+                if next_url in seen_urls:
+                    raise _PageError(f"nextLink repetido en {endpoint}")
+                seen_urls.add(next_url)
+                data = self._fetch_page(endpoint, {}, query.get('fields'), next_url)
+                records.extend(data.get('value', []))
+                next_url = self._next_url(data)
+        except _PageError as e:
+            return {"success": False, "error": str(e), "endpoint": endpoint}
+        except Exception as e:
+            return {"success": False, "error": f"Excepción: {str(e)}", "endpoint": endpoint}
+        if top:
+            records = records[:top]
+        return {
+            "success": True,
+            "data": records,
+            "count": len(records),
+            "endpoint": endpoint,
+            "filters": query.get('filters')
+        }
+
+    def keyset_field(self, endpoint: str) -> Optional[str]:
         """
+        Campo para paginar por cursor en un endpoint: 'key_field' de su
+        metadata o DocEntry en los documentos (facturas, notas de crédito...)
+        """
+        for info in self.endpoints_metadata.values():
+            if info.get('endpoint') == endpoint:
+                if info.get('key_field'):
+                    return info['key_field']
+                if 'DocEntry' in info.get('common_fields', []):
+                    return 'DocEntry'
+        return None
+
+    def _fetch_page(self, endpoint: str, params: Dict[str, Any],
+                    fields: Optional[codec.FieldSpec], url: Optional[str] = None) -> Dict[str, Any]:
+        status_code, data, error_text = self._get_page(endpoint, params, fields, url)
+        if status_code != 200:
+            raise _PageError(f"Error {status_code}: {error_text}")
+        return data
+
+    def _next_url(self, data: Dict[str, Any]) -> Optional[str]:
+        next_link = data.get('@odata.nextLink') or data.get('odata.nextLink')
+        if not next_link:
+            return None
+        # Service Layer devuelve el nextLink relativo a la raíz (ej: "Items?$skip=20")
+        return urljoin(self.base_url.rstrip('/') + '/', next_link)
+
+    def _query(self, endpoint: str, filters: Optional[str], select: Optional[str],
+               top: Optional[int], fields: Optional[codec.FieldSpec]) -> Dict[str, Any]:
         try:
             # Autenticarse si no hay sesión
             if not self.session_id:
                 if not self.login():
                     return {"error": "No se pudo autenticar en SAP Service Layer"}
             
-            all_data = []
-            skip = 0
-            
-            # Si hay top definido, usar ese límite
+            # Si hay top definido, usar ese límite (siguiendo nextLink si SAP lo parte en páginas)
             if top:
                 params = {'$top': top}
                 if select:
@@ -138,77 +403,26 @@ class SAPServiceLayer:
                 if filters:
                     params['$filter'] = filters
                 
-                response = self.session.get(
-                    f"{self.base_url}{endpoint}",
-                    params=params,
-                    verify=self.verify_ssl,
-                    timeout=180
-                )
+                data = self._fetch_page(endpoint, params, fields)
+                records = data.get('value', [])
+                next_url = self._next_url(data)
+                while next_url and len(records) < top:
+                    data = self._fetch_page(endpoint, {}, fields, next_url)
+                    records.extend(data.get('value', []))
+                    next_url = self._next_url(data)
+                records = records[:top]
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    return {
-                        "success": True,
-                        "data": data.get('value', []),
-                        "count": len(data.get('value', [])),
-                        "endpoint": endpoint,
-                        "filters": filters
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": f"Error {response.status_code}: {response.text}",
-                        "endpoint": endpoint
-                    }
+                return {
+                    "success": True,
+                    "data": records,
+                    "count": len(records),
+                    "endpoint": endpoint,
+                    "filters": filters
+                }
             
             # Si no hay top, paginar para obtener TODOS los registros
             print(f"   📄 Paginando para obtener TODOS los registros...")
-            max_pages = 500  # Máximo 10000 registros (SAP devuelve ~20 por página)
-            page = 0
-            page_size = 500  # Intentar 500, SAP puede limitar a menos
-            
-            while page < max_pages:
-                params = {
-                    '$top': page_size,
-                    '$skip': skip
-                }
-                if select:
-                    params['$select'] = select
-                if filters:
-                    params['$filter'] = filters
-                
-                response = self.session.get(
-                    f"{self.base_url}{endpoint}",
-                    params=params,
-                    verify=self.verify_ssl,
-                    timeout=180
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    page_data = data.get('value', [])
-                    
-                    if not page_data:
-                        break  # No hay más datos
-                    
-                    all_data.extend(page_data)
-                    print(f"   📄 Página {page + 1}: {len(page_data)} registros (Total: {len(all_data)})")
-                    
-                    # Verificar si hay más páginas
-                    # SAP indica esto con odata.nextLink o si devuelve menos registros que el page_size solicitado
-                    has_next = 'odata.nextLink' in data or '@odata.nextLink' in data
-                    
-                    if len(page_data) < page_size and not has_next:
-                        break  # Última página
-                    
-                    skip += len(page_data)  # Usar la cantidad real devuelta
-                    page += 1
-                else:
-                    return {
-                        "success": False,
-                        "error": f"Error {response.status_code}: {response.text}",
-                        "endpoint": endpoint
-                    }
+            all_data = [record for page in self._iter_pages(endpoint, filters, select, fields) for record in page]
             
             print(f"   ✅ Total registros obtenidos: {len(all_data)}")
             return {
@@ -220,12 +434,118 @@ class SAPServiceLayer:
                 "paginated": True
             }
                 
+        except _PageError as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "endpoint": endpoint
+            }
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Excepción: {str(e)}",
                 "endpoint": endpoint
             }
+
+    def iter_pages(self, endpoint: str, filters: Optional[str] = None, select: Optional[str] = None,
+                   fields: Optional[codec.FieldSpec] = None) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Recorrer TODOS los registros de una consulta página por página
+
+        A diferencia de query() no acumula los registros: sólo hay una página
+        en memoria a la vez (útil para exportar resultados grandes). Un error
+        del Service Layer a mitad de camino se lanza como excepción.
+        """
+        if not self.session_id:
+            if not self.login():
+                raise _PageError("No se pudo autenticar en SAP Service Layer")
+        yield from self._iter_pages(endpoint, filters, select, fields)
+
+    def _iter_pages(self, endpoint: str, filters: Optional[str], select: Optional[str],
+                    fields: Optional[codec.FieldSpec]) -> Iterator[List[Dict[str, Any]]]:
+        key_field = self.keyset_field(endpoint)
+        if key_field:
+            return self._iter_keyset(endpoint, filters, select, fields, key_field)
+        return self._iter_next_link(endpoint, filters, select, fields)
+
+    def _iter_keyset(self, endpoint: str, filters: Optional[str], select: Optional[str],
+                     fields: Optional[codec.FieldSpec], key_field: str) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Paginación por cursor: ordenar por key_field y pedir cada página con
+        "key_field gt <último>". Cada página le cuesta lo mismo al servidor sin
+        importar cuán profundo se esté (a diferencia de $skip).
+        """
+        if select and key_field not in [f.strip() for f in select.split(',')]:
+            select = f"{select},{key_field}"
+        if fields:
+            fields = {**fields, key_field: None}
+        base_filter = f"({filters})" if filters and ' or ' in filters.lower() else filters
+
+        total = 0
+        last_key = None
+        page = 0
+        while True:
+            cursor_filter = base_filter
+            if last_key is not None:
+                condition = f"{key_field} gt {_odata_literal(last_key)}"
+                cursor_filter = f"{base_filter} and {condition}" if base_filter else condition
+            params = {'$orderby': key_field}
+            if select:
+                params['$select'] = select
+            if cursor_filter:
+                params['$filter'] = cursor_filter
+
+            data = self._fetch_page(endpoint, params, fields)
+            page_data = data.get('value', [])
+            if not page_data:
+                break
+            total += len(page_data)
+            page += 1
+            print(f"   📄 Página {page}: {len(page_data)} registros (Total: {total})")
+
+            new_key = page_data[-1].get(key_field)
+            if new_key is None or (last_key is not None and new_key <= last_key):
+                raise _PageError(f"La paginación por {key_field} no avanza en {endpoint}")
+            last_key = new_key
+            yield page_data
+
+            # Sin nextLink y con una página incompleta ya no quedan registros
+            if not self._next_url(data) and len(page_data) < self.page_size:
+                break
+
+    def _iter_next_link(self, endpoint: str, filters: Optional[str], select: Optional[str],
+                        fields: Optional[codec.FieldSpec]) -> Iterator[List[Dict[str, Any]]]:
+        """Paginación siguiendo @odata.nextLink (endpoints sin campo de cursor)"""
+        params = {}
+        if select:
+            params['$select'] = select
+        if filters:
+            params['$filter'] = filters
+
+        total = 0
+        seen_urls = set()
+        next_url = None
+        page = 0
+        while True:
+            data = self._fetch_page(endpoint, params, fields, next_url)
+            page_data = data.get('value', [])
+            if not page_data:
+                break
+            total += len(page_data)
+            page += 1
+            print(f"   📄 Página {page}: {len(page_data)} registros (Total: {total})")
+            yield page_data
+
+            next_url = self._next_url(data)
+            if next_url:
+                if next_url in seen_urls:
+                    raise _PageError(f"nextLink repetido en {endpoint}")
+                seen_urls.add(next_url)
+            elif len(page_data) >= self.page_size:
+                # Página completa sin nextLink: seguir por offset
+                params['$skip'] = total
+            else:
+                break
     
     def get_endpoint_info(self, entity_name: str) -> Optional[Dict]:
         """Obtener información de un endpoint por nombre de entidad"""
@@ -248,6 +568,70 @@ class SAPServiceLayer:
         return summary
 
 
+_django_ready = False
+
+
+def _setup_django():
+    """Inicializar Django si el módulo se usa fuera del servidor (una sola vez por proceso)"""
+    global _django_ready
+    if _django_ready:
+        return
+    # Importar aquí para evitar circular import
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Damasco.settings')
+    if not django.apps.apps.ready:
+        django.setup()
+    _django_ready = True
+
+
+def _find_reusable(entity: str, filters: str, select: str, top: Optional[int]) -> Optional[str]:
+    """Resultado (JSON) de una consulta reciente de la sesión que ya contiene la respuesta"""
+    try:
+        with metrics.span('query_reuse'):
+            reused = query_reuse.find(get_session_id(), entity, filters, select, top)
+    except Exception as reuse_error:
+        print(f"⚠️ Error buscando consultas reutilizables: {reuse_error}")
+        return None
+    if reused is None:
+        return None
+    metrics.QUERY_REUSE.inc(entity=entity, reuse=reused['reuse'])
+    print(f"♻️ Reutilizando consulta #{reused['reused_from'] or 'pendiente'} ({reused['reuse']}): {reused.get('count', 0)} registros")
+    return codec.dumps(reused)
+
+
+def _save_query_cache(entity: str, filters: str, select: str, top: Optional[int],
+                      result: Dict[str, Any], encoded: str):
+    """Guardar en QueryCache el resultado de una consulta exitosa (escritura diferida)"""
+    try:
+        from main.models import QueryCache
+        
+        session_id = get_session_id()
+        query_desc = f"{entity}"
+        if filters:
+            query_desc += f" con filtros: {filters[:50]}"
+        if select:
+            query_desc += f" (campos: {select[:30]})"
+        
+        write_behind.add(QueryCache(
+            session_id=session_id,
+            query_type=entity,
+            query_description=query_desc,
+            query_params={
+                "entity": entity,
+                "filters": filters,
+                "select": select,
+                "top": top
+            },
+            result_data=codec.RawJSON(encoded),
+            result_summary=f"Consulta a {entity}: {result.get('count', 0)} registros",
+            result_size=len(encoded)
+        ))
+        print(f"💾 Guardado en caché: {query_desc}")
+        
+    except Exception as cache_error:
+        print(f"⚠️ Error guardando en caché: {cache_error}")
+
+
 def query_sap_service_layer(entity: str, filters: str = "", select: str = "", top: int = None) -> str:
     """
     Función para que Gemini consulte SAP Service Layer
@@ -262,72 +646,73 @@ def query_sap_service_layer(entity: str, filters: str = "", select: str = "", to
     Returns:
         JSON string con los resultados
     """
+    return query_sap_service_layer_many([
+        {"entity": entity, "filters": filters, "select": select, "top": top}
+    ])[0]
+
+
+def query_sap_service_layer_many(queries: List[Dict[str, Any]]) -> List[str]:
+    """
+    Varias llamadas a query_sap_service_layer con una sola sesión de SAP
+
+    Las consultas con top que no se pueden responder con la caché de la
+    sesión viajan juntas en una petición $batch; las colecciones completas
+    (sin top) usan query(), que pagina por cursor.
+    
+    Args:
+        queries: dicts con los argumentos de query_sap_service_layer
+    
+    Returns:
+        Un JSON string por consulta, en el mismo orden
+    """
     try:
         sap = SAPServiceLayer()
-        
-        # Obtener información del endpoint
-        endpoint_info = sap.get_endpoint_info(entity)
-        if not endpoint_info:
-            return json.dumps({
-                "error": f"Entidad '{entity}' no encontrada",
-                "available_entities": sap.list_available_endpoints()
-            }, ensure_ascii=False, indent=2)
-        
-        # Ejecutar consulta
-        endpoint = endpoint_info['endpoint']
-        result = sap.query(
-            endpoint=endpoint,
-            filters=filters if filters else None,
-            select=select if select else None,
-            top=top
-        )
-        
-        # Guardar en caché si la consulta fue exitosa
-        if result.get('success'):
-            try:
-                # Importar aquí para evitar circular import
-                import sys
-                import django
-                os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Damasco.settings')
-                if 'django' not in sys.modules or not django.apps.apps.ready:
-                    django.setup()
-                
-                from main.models import QueryCache
-                
-                session_id = get_session_id()
-                query_desc = f"{entity}"
-                if filters:
-                    query_desc += f" con filtros: {filters[:50]}"
-                if select:
-                    query_desc += f" (campos: {select[:30]})"
-                
-                QueryCache.objects.create(
-                    session_id=session_id,
-                    query_type=entity,
-                    query_description=query_desc,
-                    query_params={
-                        "entity": entity,
-                        "filters": filters,
-                        "select": select,
-                        "top": top
-                    },
-                    result_data=result,
-                    result_summary=f"Consulta a {entity}: {result.get('count', 0)} registros"
-                )
-                print(f"💾 Guardado en caché: {query_desc}")
-                
-            except Exception as cache_error:
-                print(f"⚠️ Error guardando en caché: {cache_error}")
+        _setup_django()
+        
+        responses: List[Optional[str]] = [None] * len(queries)
+        pending = []
+        for index, query in enumerate(queries):
+            entity = query.get('entity', '')
+            filters = query.get('filters') or ""
+            select = query.get('select') or ""
+            top = query.get('top')
+            
+            # Obtener información del endpoint
+            endpoint_info = sap.get_endpoint_info(entity)
+            if not endpoint_info:
+                responses[index] = codec.dumps({
+                    "error": f"Entidad '{entity}' no encontrada",
+                    "available_entities": sap.list_available_endpoints()
+                })
+                continue
+            
+            responses[index] = _find_reusable(entity, filters, select, top)
+            if responses[index] is None:
+                pending.append((index, entity, filters, select, top, endpoint_info['endpoint']))
+        
+        # Ejecutar consultas
+        results = sap.batch([
+            {"endpoint": endpoint, "filters": filters or None, "select": select or None, "top": top}
+            for _, _, filters, select, top, endpoint in pending
+        ])
+        
+        for (index, entity, filters, select, top, _), result in zip(pending, results):
+            # Serializar una sola vez: el mismo texto va a la caché y a Gemini
+            encoded = codec.dumps(result)
+            # Guardar en caché si la consulta fue exitosa
+            if result.get('success'):
+                _save_query_cache(entity, filters, select, top, result, encoded)
+            responses[index] = encoded
         
         # Cerrar sesión
         sap.logout()
         
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        return responses
         
     except Exception as e:
-        return json.dumps({
+        return [codec.dumps({
             "error": f"Error ejecutando consulta: {str(e)}"
-        }, ensure_ascii=False, indent=2)
+        })] * len(queries)
 
 
 def get_sap_metadata() -> str:
@@ -356,22 +741,20 @@ def get_cached_queries(summary_only: bool = False) -> str:
         JSON con las consultas cacheadas
     """
     try:
-        import sys
-        import django
-        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Damasco.settings')
-        if 'django' not in sys.modules or not django.apps.apps.ready:
-            django.setup()
-        
+        _setup_django()
         from main.models import QueryCache
         
+        # Incluir las consultas que todavía esperan su escritura diferida
+        write_behind.flush()
+        
         session_id = get_session_id()
         cached_queries = QueryCache.objects.filter(session_id=session_id).order_by('timestamp')
         
         if not cached_queries.exists():
-            return json.dumps({
+            return codec.dumps({
                 "message": "No hay consultas previas en esta sesión",
                 "count": 0
-            }, ensure_ascii=False, indent=2)
+            })
         
         result = {
             "session_id": session_id,
@@ -394,12 +777,12 @@ def get_cached_queries(summary_only: bool = False) -> str:
             
             result["queries"].append(query_info)
         
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        return codec.dumps(result)
         
     except Exception as e:
-        return json.dumps({
+        return codec.dumps({
             "error": f"Error obteniendo caché: {str(e)}"
-        }, ensure_ascii=False, indent=2)
+        })
 
 
 def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
@@ -418,29 +801,22 @@ def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
     """
     from collections import defaultdict
     
+    sap = None
     try:
         print(f"🔍 Calculando top {top} productos vendidos (VENTAS NETAS) del {date_from} al {date_to}...")
         
         sap = SAPServiceLayer()
         if not sap.login():
-            return json.dumps({"error": "No se pudo conectar a SAP"}, ensure_ascii=False)
-        
-        filters = f"DocDate ge '{date_from}' and DocDate le '{date_to}'"
+            return codec.dumps({"error": "No se pudo conectar a SAP"})
         
         # 1. Obtener TODAS las facturas con sus líneas
         print("   📄 Consultando facturas...")
-        invoices_result = sap.query(
-            endpoint='/Invoices',
-            filters=filters,
-            select='DocumentLines',
-            top=None  # Sin límite - obtener TODAS
-        )
+        invoices_result = document_cache.get_documents(sap, '/Invoices', date_from, date_to)
         
         if not invoices_result.get('success'):
-            sap.logout()
-            return json.dumps({
+            return codec.dumps({
                 "error": f"Error consultando facturas: {invoices_result.get('error')}"
-            }, ensure_ascii=False)
+            })
         
         invoices = invoices_result.get('data', [])
         total_invoices = len(invoices)
@@ -448,14 +824,7 @@ def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
         
         # 2. Obtener TODAS las notas de crédito
         print("   📄 Consultando notas de crédito...")
-        credit_notes_result = sap.query(
-            endpoint='/CreditNotes',
-            filters=filters,
-            select='DocumentLines',
-            top=None  # Sin límite - obtener TODAS
-        )
-        
-        sap.logout()
+        credit_notes_result = document_cache.get_documents(sap, '/CreditNotes', date_from, date_to)
         
         credit_notes = []
         total_credit_notes = 0
@@ -466,8 +835,9 @@ def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
         else:
             print(f"   ⚠️ No se pudieron obtener notas de crédito: {credit_notes_result.get('error')}")
         
+        aggregation = metrics.span('aggregation', tool='get_top_selling_products')
         # 3. Sumar cantidades por producto (facturas positivas, notas crédito negativas)
-        product_sales = defaultdict(lambda: {"quantity": 0, "description": "", "total_amount": 0})
+        product_sales = defaultdict(lambda: {"quantity": 0, "total_amount": 0})
         
         # Sumar facturas (solo productos >= $3)
         for invoice in invoices:
@@ -483,12 +853,9 @@ def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
                     
                     quantity = float(line.get('Quantity', 0))
                     line_total = float(line.get('LineTotal', 0))
-                    description = line.get('ItemDescription', '')
                     
                     product_sales[item_code]["quantity"] += quantity
                     product_sales[item_code]["total_amount"] += line_total
-                    if description:
-                        product_sales[item_code]["description"] = description
         
         # Restar notas de crédito (solo productos >= $3)
         for credit_note in credit_notes:
@@ -504,12 +871,9 @@ def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
                     
                     quantity = float(line.get('Quantity', 0))
                     line_total = float(line.get('LineTotal', 0))
-                    description = line.get('ItemDescription', '')
                     
                     product_sales[item_code]["quantity"] -= quantity  # RESTAR
                     product_sales[item_code]["total_amount"] -= line_total  # RESTAR
-                    if description and not product_sales[item_code]["description"]:
-                        product_sales[item_code]["description"] = description
         
         # Ordenar por cantidad descendente
         sorted_products = sorted(
@@ -523,14 +887,15 @@ def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
         for item_code, data in sorted_products:
             products_result.append({
                 "ItemCode": item_code,
-                "ItemDescription": data["description"],
+                "ItemDescription": master_data.name(sap, 'items', item_code),
                 "NetQuantitySold": round(data["quantity"], 2),
                 "NetSalesAmount": round(data["total_amount"], 2)
             })
         
+        aggregation.finish()
         print(f"   ✅ Análisis completado: {len(product_sales)} productos únicos encontrados")
         
-        return json.dumps({
+        return codec.dumps({
             "success": True,
             "date_range": f"{date_from} al {date_to}",
             "total_invoices_analyzed": total_invoices,
@@ -538,12 +903,16 @@ def get_top_selling_products(date_from: str, date_to: str, top: int = 5) -> str:
             "net_sales_calculation": "Facturas - Notas de Crédito",
             "unique_products": len(product_sales),
             "top_products": products_result
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return codec.dumps({
             "error": f"Error calculando productos más vendidos: {str(e)}"
-        }, ensure_ascii=False)
+        })
+    finally:
+        # Al final: resolver nombres con master_data puede haber iniciado sesión de nuevo
+        if sap is not None:
+            sap.logout()
 
 
 def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
@@ -562,29 +931,22 @@ def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
     """
     from collections import defaultdict
     
+    sap = None
     try:
         print(f"🔍 Calculando top {top} clientes (VENTAS NETAS) del {date_from} al {date_to}...")
         
         sap = SAPServiceLayer()
         if not sap.login():
-            return json.dumps({"error": "No se pudo conectar a SAP"}, ensure_ascii=False)
-        
-        filters = f"DocDate ge '{date_from}' and DocDate le '{date_to}'"
+            return codec.dumps({"error": "No se pudo conectar a SAP"})
         
         # 1. Obtener TODAS las facturas (solo campos necesarios)
         print("   📄 Consultando facturas...")
-        invoices_result = sap.query(
-            endpoint='/Invoices',
-            filters=filters,
-            select='CardCode,CardName,DocumentLines',
-            top=None  # Sin límite - obtener TODAS
-        )
+        invoices_result = document_cache.get_documents(sap, '/Invoices', date_from, date_to)
         
         if not invoices_result.get('success'):
-            sap.logout()
-            return json.dumps({
+            return codec.dumps({
                 "error": f"Error consultando facturas: {invoices_result.get('error')}"
-            }, ensure_ascii=False)
+            })
         
         invoices = invoices_result.get('data', [])
         total_invoices = len(invoices)
@@ -592,14 +954,7 @@ def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
         
         # 2. Obtener TODAS las notas de crédito
         print("   📄 Consultando notas de crédito...")
-        credit_notes_result = sap.query(
-            endpoint='/CreditNotes',
-            filters=filters,
-            select='CardCode,CardName,DocumentLines',
-            top=None  # Sin límite - obtener TODAS
-        )
-        
-        sap.logout()
+        credit_notes_result = document_cache.get_documents(sap, '/CreditNotes', date_from, date_to)
         
         credit_notes = []
         total_credit_notes = 0
@@ -610,13 +965,13 @@ def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
         else:
             print(f"   ⚠️ No se pudieron obtener notas de crédito: {credit_notes_result.get('error')}")
         
+        aggregation = metrics.span('aggregation', tool='get_top_customers')
         # 3. Calcular ventas netas por cliente (solo productos >= $3)
-        customer_sales = defaultdict(lambda: {"name": "", "total_amount": 0, "invoice_count": 0})
+        customer_sales = defaultdict(lambda: {"total_amount": 0, "invoice_count": 0})
         
         # Sumar facturas (solo productos >= $3)
         for invoice in invoices:
             card_code = invoice.get('CardCode', '')
-            card_name = invoice.get('CardName', '')
             if card_code:
                 lines = invoice.get('DocumentLines', [])
                 invoice_total = 0
@@ -633,14 +988,12 @@ def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
                 
                 # Solo contar si hubo productos válidos
                 if invoice_total > 0:
-                    customer_sales[card_code]["name"] = card_name
                     customer_sales[card_code]["total_amount"] += invoice_total
                     customer_sales[card_code]["invoice_count"] += 1
         
         # Restar notas de crédito (solo productos >= $3)
         for credit_note in credit_notes:
             card_code = credit_note.get('CardCode', '')
-            card_name = credit_note.get('CardName', '')
             if card_code:
                 lines = credit_note.get('DocumentLines', [])
                 credit_note_total = 0
@@ -657,8 +1010,6 @@ def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
                 
                 # Solo restar si hubo productos válidos
                 if credit_note_total > 0:
-                    if not customer_sales[card_code]["name"]:
-                        customer_sales[card_code]["name"] = card_name
                     customer_sales[card_code]["total_amount"] -= credit_note_total  # RESTAR
         
         # Ordenar por monto total descendente
@@ -673,14 +1024,15 @@ def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
         for card_code, data in sorted_customers:
             customers_result.append({
                 "CardCode": card_code,
-                "CardName": data["name"],
+                "CardName": master_data.name(sap, 'customers', card_code),
                 "NetSalesAmount": round(data["total_amount"], 2),
                 "InvoiceCount": data["invoice_count"]
             })
         
+        aggregation.finish()
         print(f"   ✅ Análisis completado: {len(customer_sales)} clientes únicos encontrados")
         
-        return json.dumps({
+        return codec.dumps({
             "success": True,
             "date_range": f"{date_from} al {date_to}",
             "total_invoices_analyzed": total_invoices,
@@ -688,12 +1040,15 @@ def get_top_customers(date_from: str, date_to: str, top: int = 5) -> str:
             "net_sales_calculation": "Facturas - Notas de Crédito (solo productos >= $3)",
             "unique_customers": len(customer_sales),
             "top_customers": customers_result
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return codec.dumps({
             "error": f"Error calculando top clientes: {str(e)}"
-        }, ensure_ascii=False)
+        })
+    finally:
+        if sap is not None:
+            sap.logout()
 
 
 def get_sales_person_performance(sales_person_code: str, date_from: str, date_to: str) -> str:
@@ -712,29 +1067,25 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
     """
     from collections import defaultdict
     
+    sap = None
     try:
         print(f"🔍 Analizando desempeño del vendedor {sales_person_code} del {date_from} al {date_to}...")
+        code = str(sales_person_code).strip()
+        sales_person_value = int(code) if code.lstrip('-').isdigit() else code
         
         sap = SAPServiceLayer()
         if not sap.login():
-            return json.dumps({"error": "No se pudo conectar a SAP"}, ensure_ascii=False)
-        
-        filters = f"DocDate ge '{date_from}' and DocDate le '{date_to}' and SalesPersonCode eq {sales_person_code}"
+            return codec.dumps({"error": "No se pudo conectar a SAP"})
         
         # 1. Obtener facturas del vendedor
         print("   📄 Consultando facturas del vendedor...")
-        invoices_result = sap.query(
-            endpoint='/Invoices',
-            filters=filters,
-            select='DocEntry,DocNum,CardCode,CardName,DocDate,DocTotal,DocumentLines',
-            top=None
-        )
+        invoices_result = document_cache.get_documents_for(sap, '/Invoices', date_from, date_to,
+                                                           'SalesPersonCode', sales_person_value)
         
         if not invoices_result.get('success'):
-            sap.logout()
-            return json.dumps({
+            return codec.dumps({
                 "error": f"Error consultando facturas: {invoices_result.get('error')}"
-            }, ensure_ascii=False)
+            })
         
         invoices = invoices_result.get('data', [])
         total_invoices = len(invoices)
@@ -742,14 +1093,8 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
         
         # 2. Obtener notas de crédito del vendedor
         print("   📄 Consultando notas de crédito del vendedor...")
-        credit_notes_result = sap.query(
-            endpoint='/CreditNotes',
-            filters=filters,
-            select='DocEntry,DocNum,CardCode,CardName,DocDate,DocTotal,DocumentLines',
-            top=None
-        )
-        
-        sap.logout()
+        credit_notes_result = document_cache.get_documents_for(sap, '/CreditNotes', date_from, date_to,
+                                                               'SalesPersonCode', sales_person_value)
         
         credit_notes = []
         total_credit_notes = 0
@@ -758,16 +1103,16 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
             total_credit_notes = len(credit_notes)
             print(f"   ✅ {total_credit_notes} notas de crédito encontradas")
         
+        aggregation = metrics.span('aggregation', tool='get_sales_person_performance')
         # 3. Calcular métricas
-        product_sales = defaultdict(lambda: {"quantity": 0, "description": "", "amount": 0})
-        customer_sales = defaultdict(lambda: {"name": "", "amount": 0, "invoice_count": 0})
+        product_sales = defaultdict(lambda: {"quantity": 0, "amount": 0})
+        customer_sales = defaultdict(lambda: {"amount": 0, "invoice_count": 0})
         total_sales_amount = 0
         total_returns_amount = 0
         
         # Procesar facturas (solo productos >= $3)
         for invoice in invoices:
             card_code = invoice.get('CardCode', '')
-            card_name = invoice.get('CardName', '')
             lines = invoice.get('DocumentLines', [])
             
             invoice_total = 0
@@ -781,19 +1126,15 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
                 item_code = line.get('ItemCode', '')
                 quantity = float(line.get('Quantity', 0))
                 line_total = float(line.get('LineTotal', 0))
-                description = line.get('ItemDescription', '')
                 
                 if item_code:
                     product_sales[item_code]["quantity"] += quantity
                     product_sales[item_code]["amount"] += line_total
-                    if description:
-                        product_sales[item_code]["description"] = description
                 
                 invoice_total += line_total
             
             # Acumular por cliente
             if invoice_total > 0 and card_code:
-                customer_sales[card_code]["name"] = card_name
                 customer_sales[card_code]["amount"] += invoice_total
                 customer_sales[card_code]["invoice_count"] += 1
                 total_sales_amount += invoice_total
@@ -801,7 +1142,6 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
         # Procesar notas de crédito (solo productos >= $3)
         for credit_note in credit_notes:
             card_code = credit_note.get('CardCode', '')
-            card_name = credit_note.get('CardName', '')
             lines = credit_note.get('DocumentLines', [])
             
             credit_note_total = 0
@@ -815,20 +1155,15 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
                 item_code = line.get('ItemCode', '')
                 quantity = float(line.get('Quantity', 0))
                 line_total = float(line.get('LineTotal', 0))
-                description = line.get('ItemDescription', '')
                 
                 if item_code:
                     product_sales[item_code]["quantity"] -= quantity
                     product_sales[item_code]["amount"] -= line_total
-                    if description and not product_sales[item_code]["description"]:
-                        product_sales[item_code]["description"] = description
                 
                 credit_note_total += line_total
             
             # Restar del cliente
             if credit_note_total > 0 and card_code:
-                if not customer_sales[card_code]["name"]:
-                    customer_sales[card_code]["name"] = card_name
                 customer_sales[card_code]["amount"] -= credit_note_total
                 total_returns_amount += credit_note_total
         
@@ -843,7 +1178,7 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
         for item_code, data in sorted_products:
             top_products.append({
                 "ItemCode": item_code,
-                "ItemDescription": data["description"],
+                "ItemDescription": master_data.name(sap, 'items', item_code),
                 "NetQuantitySold": round(data["quantity"], 2),
                 "NetSalesAmount": round(data["amount"], 2)
             })
@@ -859,7 +1194,7 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
         for card_code, data in sorted_customers:
             top_customers.append({
                 "CardCode": card_code,
-                "CardName": data["name"],
+                "CardName": master_data.name(sap, 'customers', card_code),
                 "NetSalesAmount": round(data["amount"], 2),
                 "InvoiceCount": data["invoice_count"]
             })
@@ -869,9 +1204,10 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
         return_rate = (total_returns_amount / total_sales_amount * 100) if total_sales_amount > 0 else 0
         avg_invoice = net_sales / total_invoices if total_invoices > 0 else 0
         
+        aggregation.finish()
         print(f"   ✅ Análisis completado")
         
-        return json.dumps({
+        return codec.dumps({
             "success": True,
             "sales_person_code": sales_person_code,
             "date_range": f"{date_from} al {date_to}",
@@ -894,10 +1230,629 @@ def get_sales_person_performance(sales_person_code: str, date_from: str, date_to
                 "low_product_diversity": len(product_sales) < 20,
                 "suggestions": []
             }
-        }, ensure_ascii=False, indent=2)
+        })
         
     except Exception as e:
-        return json.dumps({
+        return codec.dumps({
             "error": f"Error analizando vendedor: {str(e)}"
-        }, ensure_ascii=False)
+        })
+    finally:
+        if sap is not None:
+            sap.logout()
+
 
+def get_sales_leaderboard(date_from: str, date_to: str, top_products: int = 3) -> str:
+    """
+    Ranking de TODOS los vendedores en un rango de fechas.
+    Descarga facturas y notas de crédito una sola vez y calcula para cada
+    vendedor lo mismo que get_sales_person_performance (ventas netas, tasa de
+    devolución, ticket promedio, diversidad de clientes y productos).
+    Solo considera productos con precio >= $3.
+    
+    Args:
+        date_from: Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')
+        date_to: Fecha fin en formato YYYY-MM-DD (ej: '2026-01-31')
+        top_products: Productos principales a incluir por vendedor (default: 3)
+    
+    Returns:
+        JSON string con los vendedores ordenados por ventas netas
+    """
+    from collections import defaultdict
+    
+    sap = None
+    try:
+        print(f"🔍 Calculando ranking de vendedores del {date_from} al {date_to}...")
+        
+        sap = SAPServiceLayer()
+        if not sap.login():
+            return codec.dumps({"error": "No se pudo conectar a SAP"})
+        
+        # 1. Obtener TODAS las facturas (una sola vez para todos los vendedores)
+        print("   📄 Consultando facturas...")
+        invoices_result = document_cache.get_documents(sap, '/Invoices', date_from, date_to)
+        
+        if not invoices_result.get('success'):
+            return codec.dumps({
+                "error": f"Error consultando facturas: {invoices_result.get('error')}"
+            })
+        
+        invoices = invoices_result.get('data', [])
+        print(f"   ✅ {len(invoices)} facturas encontradas")
+        
+        # 2. Obtener TODAS las notas de crédito
+        print("   📄 Consultando notas de crédito...")
+        credit_notes_result = document_cache.get_documents(sap, '/CreditNotes', date_from, date_to)
+        
+        credit_notes = []
+        if credit_notes_result.get('success'):
+            credit_notes = credit_notes_result.get('data', [])
+            print(f"   ✅ {len(credit_notes)} notas de crédito encontradas")
+        else:
+            print(f"   ⚠️ No se pudieron obtener notas de crédito: {credit_notes_result.get('error')}")
+        
+        aggregation = metrics.span('aggregation', tool='get_sales_leaderboard')
+        # 3. Acumular por vendedor en una sola pasada (solo productos >= $3)
+        def new_stats():
+            return {
+                "invoices": 0,
+                "credit_notes": 0,
+                "gross_sales": 0,
+                "returns": 0,
+                "customers": set(),
+                "products": defaultdict(lambda: {"quantity": 0, "amount": 0}),
+            }
+        
+        sales_persons = defaultdict(new_stats)
+        
+        for documents, sign in ((invoices, 1), (credit_notes, -1)):
+            for document in documents:
+                stats = sales_persons[str(document.get('SalesPersonCode'))]
+                stats["invoices" if sign > 0 else "credit_notes"] += 1
+                
+                document_total = 0
+                for line in document.get('DocumentLines', []):
+                    price = float(line.get('Price', 0))
+                    
+                    # 🚨 REGLA: Ignorar productos con precio menor a $3
+                    if price < 3:
+                        continue
+                    
+                    item_code = line.get('ItemCode', '')
+                    line_total = float(line.get('LineTotal', 0))
+                    
+                    if item_code:
+                        stats["products"][item_code]["quantity"] += sign * float(line.get('Quantity', 0))
+                        stats["products"][item_code]["amount"] += sign * line_total
+                    
+                    document_total += line_total
+                
+                card_code = document.get('CardCode', '')
+                if document_total > 0 and card_code:
+                    stats["customers"].add(card_code)
+                    stats["gross_sales" if sign > 0 else "returns"] += document_total
+        
+        # 4. Métricas por vendedor y ranking por ventas netas
+        leaderboard = []
+        for code, stats in sales_persons.items():
+            net_sales = stats["gross_sales"] - stats["returns"]
+            return_rate = (stats["returns"] / stats["gross_sales"] * 100) if stats["gross_sales"] > 0 else 0
+            avg_invoice = net_sales / stats["invoices"] if stats["invoices"] > 0 else 0
+            
+            sorted_products = sorted(
+                stats["products"].items(),
+                key=lambda x: x[1]["amount"],
+                reverse=True
+            )[:top_products]
+            
+            leaderboard.append({
+                "SalesPersonCode": code,
+                "SalesPersonName": master_data.name(sap, 'sales_persons', code),
+                "net_sales": round(net_sales, 2),
+                "gross_sales": round(stats["gross_sales"], 2),
+                "returns": round(stats["returns"], 2),
+                "return_rate_percent": round(return_rate, 2),
+                "total_invoices": stats["invoices"],
+                "total_credit_notes": stats["credit_notes"],
+                "average_invoice_amount": round(avg_invoice, 2),
+                "unique_customers": len(stats["customers"]),
+                "unique_products_sold": len(stats["products"]),
+                "top_products": [
+                    {
+                        "ItemCode": item_code,
+                        "ItemDescription": master_data.name(sap, 'items', item_code),
+                        "NetQuantitySold": round(data["quantity"], 2),
+                        "NetSalesAmount": round(data["amount"], 2)
+                    }
+                    for item_code, data in sorted_products
+                ]
+            })
+        
+        leaderboard.sort(key=lambda x: x["net_sales"], reverse=True)
+        for rank, entry in enumerate(leaderboard, start=1):
+            entry["rank"] = rank
+        
+        total_net_sales = sum(entry["net_sales"] for entry in leaderboard)
+        for entry in leaderboard:
+            entry["share_percent"] = round(entry["net_sales"] / total_net_sales * 100, 2) if total_net_sales else 0
+        
+        aggregation.finish()
+        print(f"   ✅ Ranking completado: {len(leaderboard)} vendedores")
+        
+        return codec.dumps({
+            "success": True,
+            "date_range": f"{date_from} al {date_to}",
+            "total_invoices_analyzed": len(invoices),
+            "total_credit_notes_analyzed": len(credit_notes),
+            "net_sales_calculation": "Facturas - Notas de Crédito (solo productos >= $3)",
+            "total_net_sales": round(total_net_sales, 2),
+            "sales_persons": len(leaderboard),
+            "leaderboard": leaderboard
+        })
+        
+    except Exception as e:
+        return codec.dumps({
+            "error": f"Error calculando ranking de vendedores: {str(e)}"
+        })
+    finally:
+        if sap is not None:
+            sap.logout()
+
+
+def _merge_ranges(ranges: List[tuple]) -> List[tuple]:
+    """Unir rangos (inicio, fin) de fechas ISO que se solapan o son contiguos"""
+    from datetime import date, timedelta
+    
+    merged = []
+    for start, end in sorted((date.fromisoformat(a), date.fromisoformat(b)) for a, b in ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start.isoformat(), end.isoformat()) for start, end in merged]
+
+
+def compare_periods(periods: List[Dict[str, str]], top: int = 10) -> str:
+    """
+    Comparar ventas netas entre dos o más períodos (ej: enero vs diciembre).
+    Descarga una sola vez la unión de los períodos (document_cache ya pide en
+    paralelo los días que faltan) y calcula totales y variaciones por
+    producto, cliente y vendedor respecto del PRIMER período.
+    Solo considera productos con precio >= $3.
+    
+    Args:
+        periods: Lista de {"date_from": 'YYYY-MM-DD', "date_to": 'YYYY-MM-DD'}; el primero es la base
+        top: Cantidad de productos, clientes y vendedores con mayor variación a retornar (default: 10)
+    
+    Returns:
+        JSON string con los totales de cada período y las variaciones
+    """
+    from collections import defaultdict
+    
+    sap = None
+    try:
+        ranges = []
+        for period in periods or []:
+            date_from = str(period.get('date_from', ''))[:10]
+            date_to = str(period.get('date_to', ''))[:10] or date_from
+            if date_to < date_from:
+                date_from, date_to = date_to, date_from
+            ranges.append((date_from, date_to))
+        if len(ranges) < 2:
+            return codec.dumps({"error": "Se necesitan al menos dos períodos para comparar"})
+        merged = _merge_ranges(ranges)
+        
+        print(f"🔍 Comparando {len(ranges)} períodos ({len(merged)} tramos a descargar)...")
+        
+        sap = SAPServiceLayer()
+        if not sap.login():
+            return codec.dumps({"error": "No se pudo conectar a SAP"})
+        
+        # 1. Facturas y notas de crédito de la unión de los períodos, una sola vez.
+        # Tramo por tramo: la sesión no se comparte entre hilos y cada llamada ya
+        # descarga sus días faltantes con hasta FETCH_WORKERS peticiones
+        documents = {'/Invoices': [], '/CreditNotes': []}
+        for endpoint in documents:
+            for start, end in merged:
+                result = document_cache.get_documents(sap, endpoint, start, end)
+                if not result.get('success'):
+                    break
+                documents[endpoint].extend(result.get('data', []))
+            if not result.get('success'):
+                if endpoint == '/Invoices':
+                    return codec.dumps({
+                        "error": f"Error consultando facturas: {result.get('error')}"
+                    })
+                print(f"   ⚠️ No se pudieron obtener notas de crédito: {result.get('error')}")
+                documents[endpoint] = []
+        print(f"   ✅ {len(documents['/Invoices'])} facturas y {len(documents['/CreditNotes'])} notas de crédito")
+        
+        aggregation = metrics.span('aggregation', tool='compare_periods')
+        # 2. Ventas netas por período (solo productos >= $3)
+        def new_totals():
+            return {
+                "invoices": 0,
+                "credit_notes": 0,
+                "net_sales": 0,
+                "items": defaultdict(lambda: {"quantity": 0, "amount": 0}),
+                "customers": defaultdict(float),
+                "sales_persons": defaultdict(float),
+            }
+        
+        totals = [new_totals() for _ in ranges]
+        for endpoint, sign in (('/Invoices', 1), ('/CreditNotes', -1)):
+            for document in documents[endpoint]:
+                doc_date = str(document.get('DocDate', ''))[:10]
+                targets = [totals[i] for i, (start, end) in enumerate(ranges) if start <= doc_date <= end]
+                if not targets:
+                    continue
+                
+                document_total = 0
+                line_totals = []
+                for line in document.get('DocumentLines', []):
+                    price = float(line.get('Price', 0))
+                    
+                    # 🚨 REGLA: Ignorar productos con precio menor a $3
+                    if price < 3:
+                        continue
+                    
+                    line_total = float(line.get('LineTotal', 0))
+                    line_totals.append((line.get('ItemCode', ''), float(line.get('Quantity', 0)), line_total))
+                    document_total += line_total
+                
+                card_code = document.get('CardCode', '')
+                sales_person = str(document.get('SalesPersonCode'))
+                for period_totals in targets:
+                    period_totals["invoices" if sign > 0 else "credit_notes"] += 1
+                    period_totals["net_sales"] += sign * document_total
+                    for item_code, quantity, line_total in line_totals:
+                        if item_code:
+                            period_totals["items"][item_code]["quantity"] += sign * quantity
+                            period_totals["items"][item_code]["amount"] += sign * line_total
+                    if document_total > 0 and card_code:
+                        period_totals["customers"][card_code] += sign * document_total
+                        period_totals["sales_persons"][sales_person] += sign * document_total
+        
+        def growth(value, base):
+            return round((value - base) / abs(base) * 100, 2) if base else None
+        
+        def changes(kind, name_kind, amount):
+            """Filas con el valor de cada período y la variación contra el primero"""
+            codes = set()
+            for period_totals in totals:
+                codes.update(period_totals[kind])
+            rows = []
+            for code in codes:
+                values = [amount(period_totals[kind].get(code)) for period_totals in totals]
+                rows.append({
+                    "code": code,
+                    "values": [round(value, 2) for value in values],
+                    "deltas": [round(value - values[0], 2) for value in values[1:]],
+                    "growth_percent": [growth(value, values[0]) for value in values[1:]],
+                })
+            # Mayor variación (absoluta) del último período contra la base
+            rows.sort(key=lambda row: abs(row["deltas"][-1]), reverse=True)
+            return [dict(row, name=master_data.name(sap, name_kind, row["code"])) for row in rows[:top]]
+        
+        base_sales = totals[0]["net_sales"]
+        summary = []
+        for (date_from, date_to), period_totals in zip(ranges, totals):
+            summary.append({
+                "date_range": f"{date_from} al {date_to}",
+                "net_sales": round(period_totals["net_sales"], 2),
+                "delta_vs_first": round(period_totals["net_sales"] - base_sales, 2),
+                "growth_percent_vs_first": growth(period_totals["net_sales"], base_sales),
+                "total_invoices": period_totals["invoices"],
+                "total_credit_notes": period_totals["credit_notes"],
+                "unique_products": len(period_totals["items"]),
+                "unique_customers": len(period_totals["customers"]),
+            })
+        
+        products = changes('items', 'items', lambda data: data["amount"] if data else 0)
+        customers = changes('customers', 'customers', lambda value: value or 0)
+        sales_persons = changes('sales_persons', 'sales_persons', lambda value: value or 0)
+        
+        aggregation.finish()
+        print(f"   ✅ Comparación completada")
+        
+        return codec.dumps({
+            "success": True,
+            "periods": summary,
+            "comparison": "Cada período contra el primero",
+            "net_sales_calculation": "Facturas - Notas de Crédito (solo productos >= $3)",
+            "products": products,
+            "customers": customers,
+            "sales_persons": sales_persons
+        })
+        
+    except Exception as e:
+        return codec.dumps({
+            "error": f"Error comparando períodos: {str(e)}"
+        })
+    finally:
+        if sap is not None:
+            sap.logout()
+
+
+def get_stock(warehouse: str = "", group: str = "", item_codes=None, per_warehouse: bool = False,
+              sort_by: str = "in_stock", ascending: bool = False, min_quantity: float = None,
+              top: int = 20) -> str:
+    """
+    Consultar existencias por artículo y almacén con la foto de inventario en
+    memoria (sin descargar /Items en cada pregunta)
+    
+    Args:
+        warehouse: Código de almacén (ej: '01'); vacío = todos
+        group: ItemsGroupCode (ej: '105'); vacío = todos
+        item_codes: Lista de ItemCode (o string separado por comas); vacío = todos
+        per_warehouse: Una fila por artículo y almacén en vez de sumar los almacenes
+        sort_by: 'in_stock', 'committed', 'ordered' o 'available' (default: 'in_stock')
+        ascending: Ordenar de menor a mayor (ej: artículos con menos stock)
+        min_quantity: Mínimo de la columna sort_by (ej: 0.01 para "con stock")
+        top: Cantidad de filas a retornar (default: 20)
+    
+    Returns:
+        JSON string con las filas, los totales y el stock por almacén
+    """
+    sap = None
+    try:
+        if isinstance(item_codes, str):
+            item_codes = [code for code in item_codes.split(',') if code.strip()]
+        warehouse = str(warehouse or '').strip()
+        group = str(group or '').strip()
+        
+        sap = SAPServiceLayer()
+        snapshot = inventory.get_snapshot(sap)
+        if snapshot is None:
+            return codec.dumps({"error": "No se pudo obtener el inventario de SAP"})
+        
+        result = inventory.query(snapshot, warehouse=warehouse, group=group, item_codes=item_codes or (),
+                                 per_warehouse=per_warehouse, sort_by=sort_by, ascending=ascending,
+                                 min_quantity=min_quantity, top=top)
+        
+        rows = []
+        for (item, warehouse_id), values in result["rows"]:
+            item_code = snapshot.item_codes[item]
+            row = {
+                "ItemCode": item_code,
+                "ItemName": master_data.name(sap, 'items', item_code),
+                "ItemsGroupCode": snapshot.item_groups[item],
+            }
+            if warehouse_id >= 0:
+                row["WarehouseCode"] = snapshot.warehouses[warehouse_id]
+            row.update({
+                "InStock": round(values[0], 2),
+                "Committed": round(values[1], 2),
+                "Ordered": round(values[2], 2),
+                "Available": round(values[3], 2)
+            })
+            rows.append(row)
+        
+        in_stock, committed, ordered, available = result["totals"]
+        return codec.dumps({
+            "success": True,
+            "as_of": snapshot.loaded_at.isoformat(timespec='seconds'),
+            "filters": {"warehouse": warehouse, "group": group, "item_codes": item_codes or []},
+            "matches": result["matches"],
+            "totals": {"InStock": in_stock, "Committed": committed, "Ordered": ordered, "Available": available},
+            "stock_by_warehouse": {
+                code: round(values[0], 2) for code, values in sorted(result["by_warehouse"].items())
+            },
+            "available_calculation": "InStock - Committed + Ordered",
+            "rows": rows
+        })
+        
+    except ValueError as e:
+        return codec.dumps({"error": str(e), "valid_sort_by": list(inventory.QUANTITIES)})
+    except Exception as e:
+        return codec.dumps({
+            "error": f"Error consultando inventario: {str(e)}"
+        })
+    finally:
+        if sap is not None:
+            sap.logout()
+
+
+def lookup_master_data(entity: str, codes) -> str:
+    """
+    Resolver códigos a nombres con el directorio de datos maestros en memoria
+    (sin consultar Items/BusinessPartners/SalesPersons en cada pregunta)
+    
+    Args:
+        entity: 'items', 'customers' o 'sales_persons'
+        codes: Lista de códigos (o string separado por comas)
+    
+    Returns:
+        JSON string con los datos de cada código encontrado y los no encontrados
+    """
+    try:
+        if entity not in master_data.SOURCES:
+            return codec.dumps({
+                "error": f"Tipo '{entity}' no válido",
+                "valid_entities": list(master_data.SOURCES)
+            })
+        if isinstance(codes, str):
+            codes = [code for code in codes.split(',') if code.strip()]
+        
+        sap = SAPServiceLayer()
+        found, missing = master_data.lookup(sap, entity, codes)
+        sap.logout()
+        
+        return codec.dumps({
+            "success": True,
+            "entity": entity,
+            "results": found,
+            "not_found": missing
+        })
+        
+    except Exception as e:
+        return codec.dumps({
+            "error": f"Error consultando datos maestros: {str(e)}"
+        })
+
+
+def find_code_by_name(entity: str, name: str, limit: int = 5) -> str:
+    """
+    Buscar el código de un vendedor o cliente por su nombre (completo o parcial)
+    en el índice local de nombres, sin consultar SAP
+    
+    Args:
+        entity: 'sales_persons' o 'customers'
+        name: Nombre o parte del nombre (ej: 'JEAN MORENO', 'ferreteria oriente')
+        limit: Cantidad máxima de candidatos (default: 5)
+    
+    Returns:
+        JSON string con los candidatos ordenados por similitud
+    """
+    try:
+        if entity not in name_index.INDEXED_KINDS:
+            return codec.dumps({
+                "error": f"Tipo '{entity}' no válido",
+                "valid_entities": list(name_index.INDEXED_KINDS)
+            })
+        
+        sap = SAPServiceLayer()
+        index = name_index.get_index(sap, entity)
+        sap.logout()
+        
+        candidates = index.search(name, limit=int(limit or 5))
+        return codec.dumps({
+            "success": True,
+            "entity": entity,
+            "query": name,
+            "candidates": [
+                {"code": code, "name": display, "score": score}
+                for code, display, score in candidates
+            ]
+        })
+        
+    except Exception as e:
+        return codec.dumps({
+            "error": f"Error buscando por nombre: {str(e)}"
+        })
+
+
+def create_export_link(entity: str, filters: str = "", select: str = "", format: str = "csv") -> str:
+    """
+    Enlace de descarga (CSV o Parquet) con TODOS los registros de una consulta,
+    para listas demasiado grandes para mostrarlas en el chat
+    
+    El enlace está firmado y vence a las EXPORT_LINK_MAX_AGE segundos; la
+    consulta se ejecuta (o se toma de la caché de la sesión) al descargarlo.
+    
+    Args:
+        entity: Nombre de la entidad (Invoices, Items, BusinessPartners, etc.)
+        filters: Filtros OData (opcional)
+        select: Campos a exportar, en orden (opcional, recomendado)
+        format: 'csv' o 'parquet'
+    
+    Returns:
+        JSON string con la URL de descarga
+    """
+    try:
+        if format not in export.FORMATS:
+            return codec.dumps({
+                "error": f"Formato '{format}' no válido",
+                "valid_formats": list(export.FORMATS)
+            })
+        if format == 'parquet' and not export.parquet_available():
+            return codec.dumps({
+                "error": "La exportación a Parquet no está disponible en este servidor, usa format='csv'"
+            })
+        
+        sap = SAPServiceLayer()
+        if not sap.get_endpoint_info(entity):
+            return codec.dumps({
+                "error": f"Entidad '{entity}' no encontrada",
+                "available_entities": sap.list_available_endpoints()
+            })
+        
+        _setup_django()
+        from django.urls import reverse
+        
+        token = export.sign({
+            "entity": entity,
+            "filters": filters or "",
+            "select": select or "",
+            "format": format,
+            "session_id": get_session_id()
+        })
+        return codec.dumps({
+            "success": True,
+            "url": f"{reverse('export')}?{urlencode({'q': token})}",
+            "format": format,
+            "entity": entity,
+            "expires_in_minutes": export.LINK_MAX_AGE // 60
+        })
+        
+    except Exception as e:
+        return codec.dumps({
+            "error": f"Error creando el enlace de exportación: {str(e)}"
+        })
+
+
+def create_table_view(entity: str, filters: str = "", select: str = "", title: str = "") -> str:
+    """
+    Tabla navegable (paginada, ordenable y con búsqueda) con TODOS los
+    registros de una consulta, sin pegarlos en la respuesta
+    
+    La consulta completa queda en QueryCache (o se reutiliza si la sesión ya
+    la tiene) y se devuelve un marcador [[tabla:...]] que el chat muestra como
+    tabla; las páginas se piden a /table/.
+    
+    Args:
+        entity: Nombre de la entidad (Invoices, Items, BusinessPartners, etc.)
+        filters: Filtros OData (opcional)
+        select: Columnas de la tabla, en orden (opcional, recomendado)
+        title: Título de la tabla (opcional)
+    
+    Returns:
+        JSON string con el marcador, el total de filas y la primera página
+    """
+    try:
+        sap = SAPServiceLayer()
+        endpoint_info = sap.get_endpoint_info(entity)
+        if not endpoint_info:
+            return codec.dumps({
+                "error": f"Entidad '{entity}' no encontrada",
+                "available_entities": sap.list_available_endpoints()
+            })
+        
+        _setup_django()
+        filters = filters or ""
+        select = select or ""
+        session_id = get_session_id()
+        query_id = query_reuse.find_complete(session_id, entity, filters, select)
+        if query_id is None:
+            print(f"📋 Preparando tabla de {entity}")
+            result = sap.query(endpoint_info['endpoint'], filters or None, select or None, top=None)
+            sap.logout()
+            if not result.get('success'):
+                return codec.dumps({"error": f"Error consultando {entity}: {result.get('error')}"})
+            _save_query_cache(entity, filters, select, None, result, codec.dumps(result))
+            # La tabla lee de QueryCache: esperar la escritura diferida
+            write_behind.flush(timeout=5)
+            query_id = query_reuse.find_complete(session_id, entity, filters, select)
+            if query_id is None:
+                return codec.dumps({"error": "No se pudo guardar el resultado para la tabla"})
+        
+        token = table_handles.sign({
+            "query_id": query_id,
+            "columns": table_handles.columns_of(select, None if select else table_handles.first_record(query_id)),
+            "title": title or entity
+        })
+        first_page = table_handles.page(table_handles.load(token))
+        
+        return codec.dumps({
+            "success": True,
+            "marker": table_handles.marker(token),
+            "instructions": "Incluye el marcador tal cual en tu respuesta; el chat lo muestra como tabla navegable",
+            "entity": entity,
+            "total_rows": first_page["total_rows"],
+            "columns": first_page["columns"],
+            "first_rows": first_page["rows"][:5]
+        })
+        
+    except Exception as e:
+        return codec.dumps({
+            "error": f"Error creando la tabla: {str(e)}"
+        })
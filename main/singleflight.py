@@ -0,0 +1,91 @@
+"""
+Coalescencia de consultas idénticas en curso (single-flight)
+
+Si dos peticiones piden la misma consulta mientras la primera todavía se está
+ejecutando, la segunda no lanza otra paginación completa contra el Service
+Layer: espera a la primera y recibe el mismo resultado.
+
+El resultado se comparte entre todos los que esperaban, así que quien lo
+reciba debe tratarlo como de sólo lectura. Sólo se coalescen llamadas
+simultáneas dentro del mismo proceso; no es una caché.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class Group:
+    """Grupo de llamadas en curso indexadas por clave"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Ejecutar func() salvo que ya haya una llamada en curso con la misma clave
+
+        Returns:
+            (resultado, compartido) — compartido es True si el resultado se
+            entregó a más de un llamador
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, call.waiters > 0
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+def _normalize_list(value: Optional[str]) -> str:
+    """'A, B ,C' -> 'A,B,C' (el orden de $select no cambia el resultado)"""
+    if not value:
+        return ''
+    return ','.join(sorted(part.strip() for part in value.split(',') if part.strip()))
+
+
+def query_key(base_url: str, endpoint: str, filters: Optional[str] = None,
+              select: Optional[str] = None, top: Optional[int] = None,
+              fields: Optional[dict] = None) -> tuple:
+    """Clave canónica de una consulta al Service Layer"""
+    return (
+        base_url.rstrip('/'),
+        endpoint,
+        ' '.join((filters or '').split()),
+        _normalize_list(select),
+        top or None,
+        tuple(sorted((name, tuple(sub) if sub is not None else None)
+                     for name, sub in (fields or {}).items())),
+    )
@@ -0,0 +1,170 @@
+"""
+Tablas paginadas ligadas a una consulta guardada en QueryCache
+
+Una respuesta con miles de filas no se pega en el chat: la herramienta
+create_table_view deja el resultado en QueryCache y devuelve un marcador
+[[tabla:<token>]] que el modelo incluye en su respuesta. ChatMessage guarda
+sólo el marcador, /send/ agrega la primera página de cada tabla que aparece
+en la respuesta y /table/ entrega las páginas siguientes ordenadas y
+filtradas en el servidor.
+
+En SQLite las filas se ordenan, filtran y paginan con json_each sobre
+result_data, sin cargar el resultado completo en Python.
+
+Variables de entorno:
+    TABLE_HANDLE_MAX_AGE   validez en segundos de un marcador (default 86400)
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from django.core import signing
+
+from . import codec
+
+HANDLE_MAX_AGE = int(os.environ.get('TABLE_HANDLE_MAX_AGE', 24 * 3600))
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+MARKER_RE = re.compile(r'\[\[tabla:([A-Za-z0-9_\-:.]+)\]\]')
+_FIELD_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_SALT = 'main.table_handles'
+
+
+class TableGone(Exception):
+    """La consulta de la tabla ya no está en QueryCache (retención)"""
+
+
+def sign(spec: Dict[str, Any]) -> str:
+    return signing.dumps(spec, salt=_SALT, compress=True)
+
+
+def load(token: str) -> Dict[str, Any]:
+    """Spec de un token; lanza signing.BadSignature si es inválido o venció"""
+    return signing.loads(token, salt=_SALT, max_age=HANDLE_MAX_AGE)
+
+
+def marker(token: str) -> str:
+    return f"[[tabla:{token}]]"
+
+
+def tokens_in(text: str) -> List[str]:
+    """Tokens de los marcadores de tabla de un texto, sin repetir"""
+    return list(dict.fromkeys(MARKER_RE.findall(text or '')))
+
+
+def columns_of(select: str, record: Optional[Dict[str, Any]]) -> List[str]:
+    fields = [name.strip() for name in (select or '').split(',') if name.strip()]
+    if fields:
+        return fields
+    return [name for name in record if name != 'odata.etag'] if record else []
+
+
+def first_record(query_id: int) -> Optional[Dict[str, Any]]:
+    """Primer registro de una consulta guardada (para deducir las columnas)"""
+    from django.db import connection
+    from main.models import QueryCache
+
+    if connection.vendor != 'sqlite':
+        result = QueryCache.objects.filter(id=query_id).values_list('result_data', flat=True).first() or {}
+        return (result.get('data') or [None])[0]
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT json_extract(result_data, '$.data[0]') FROM {QueryCache._meta.db_table} "
+                       f"WHERE id = %s", [query_id])
+        row = cursor.fetchone()
+    return codec.loads(row[0]) if row and row[0] else None
+
+
+def _sqlite_page(spec: Dict[str, Any], page: int, page_size: int, sort: str, descending: bool,
+                 search: str) -> Dict[str, Any]:
+    from django.db import connection
+    from main.models import QueryCache
+
+    source = (f"FROM {QueryCache._meta.db_table} AS query, json_each(query.result_data, '$.data') AS item "
+              f"WHERE query.id = %s")
+    params: List[Any] = [spec['query_id']]
+    if search:
+        # Texto de las columnas de la tabla (no de las claves del JSON)
+        haystack = " || char(31) || ".join(
+            f"COALESCE(json_extract(item.value, '$.\"{name}\"'), '')" for name in spec['columns'])
+        source += f" AND lower({haystack}) LIKE %s ESCAPE '\\'"
+        escaped = search.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params.append(f"%{escaped}%")
+    order = "item.key"
+    if sort:
+        order = f"json_extract(item.value, '$.\"{sort}\"') {'DESC' if descending else 'ASC'}, item.key"
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT json_array_length(result_data, '$.data') FROM {QueryCache._meta.db_table} "
+                       f"WHERE id = %s", [spec['query_id']])
+        row = cursor.fetchone()
+        if row is None:
+            raise TableGone()
+        total_rows = row[0] or 0
+        if search:
+            cursor.execute(f"SELECT COUNT(*) {source}", params)
+            matches = cursor.fetchone()[0]
+        else:
+            matches = total_rows
+        cursor.execute(f"SELECT item.value {source} ORDER BY {order} LIMIT %s OFFSET %s",
+                       params + [page_size, (page - 1) * page_size])
+        records = [codec.loads(value) for value, in cursor.fetchall()]
+    return {"total_rows": total_rows, "matches": matches, "records": records}
+
+
+def _python_page(spec: Dict[str, Any], page: int, page_size: int, sort: str, descending: bool,
+                 search: str) -> Dict[str, Any]:
+    from main.models import QueryCache
+
+    result = QueryCache.objects.filter(id=spec['query_id']).values_list('result_data', flat=True).first()
+    if result is None:
+        raise TableGone()
+    records = result.get('data', [])
+    total_rows = len(records)
+    if search:
+        needle = search.lower()
+        records = [record for record in records
+                   if needle in '\x1f'.join(str(record.get(name, '')) for name in spec['columns']).lower()]
+    if sort:
+        # None al final (como NULL en SQLite al ordenar de forma descendente)
+        records = sorted(records, key=lambda record: (record.get(sort) is not None, record.get(sort)),
+                         reverse=descending)
+    start = (page - 1) * page_size
+    return {"total_rows": total_rows, "matches": len(records), "records": records[start:start + page_size]}
+
+
+def page(spec: Dict[str, Any], page: int = 1, page_size: int = PAGE_SIZE, sort: str = '',
+         descending: bool = False, search: str = '') -> Dict[str, Any]:
+    """
+    Una página de la tabla
+
+    Raises:
+        ValueError: columna de orden inválida
+        TableGone: la consulta ya no está en QueryCache
+    """
+    from django.db import connection
+
+    page = max(1, int(page))
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+    sort = (sort or '').strip()
+    if sort and (sort not in spec['columns'] or not _FIELD_RE.match(sort)):
+        raise ValueError(f"Columna de orden inválida: {sort}")
+    search = (search or '').strip()
+    columns = [name for name in spec['columns'] if _FIELD_RE.match(name)]
+    spec = dict(spec, columns=columns)
+
+    fetch = _sqlite_page if connection.vendor == 'sqlite' else _python_page
+    result = fetch(spec, page, page_size, sort, descending, search)
+    return {
+        "success": True,
+        "title": spec.get('title', ''),
+        "columns": columns,
+        "rows": [[record.get(name) for name in columns] for record in result["records"]],
+        "page": page,
+        "page_size": page_size,
+        "pages": max(1, -(-result["matches"] // page_size)),
+        "matches": result["matches"],
+        "total_rows": result["total_rows"],
+        "sort": sort,
+        "descending": bool(sort and descending),
+        "search": search,
+    }
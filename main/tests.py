@@ -1,3 +1,950 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.test import Client, SimpleTestCase
+from django.utils import timezone
+
+from . import (codec, concurrency, document_cache, document_snapshot, export, intent_router, inventory, master_data, metrics,
+               name_index, odata_batch, query_reuse, retention, sap_service_layer,
+               singleflight, table_handles, write_behind)
+from .sap_mock_server import fetch_mock_stats, spawn_mock_server
+
+TODAY = date(2026, 10, 19)  # lunes
+
+
+class FakeSAP:
+    """Service Layer en memoria: endpoint -> registros"""
+
+    def __init__(self, base_url, records):
+        self.base_url = base_url
+        self.records = records
+        self.queries = []
+
+    def query(self, endpoint, filters=None, select=None, top=None, **kwargs):
+        self.queries.append((endpoint, filters))
+        return {"success": True, "data": list(self.records.get(endpoint, []))}
+
+
+class DateRangeTests(SimpleTestCase):
+    """Expresiones de fecha del docstring de intent_router.parse_date_range"""
+
+    CASES = [
+        ("del 1 al 31 de enero", date(2026, 1, 1), date(2026, 1, 31)),
+        ("del 15 de enero al 15 de febrero de 2026", date(2026, 1, 15), date(2026, 2, 15)),
+        ("del 15 de diciembre al 15 de enero", date(2025, 12, 15), date(2026, 1, 15)),
+        ("del 01/01/2026 al 05/01/2026", date(2026, 1, 1), date(2026, 1, 5)),
+        ("de 2026-01-01 a 2026-01-31", date(2026, 1, 1), date(2026, 1, 31)),
+        ("en enero", date(2026, 1, 1), date(2026, 1, 31)),
+        ("en noviembre", date(2025, 11, 1), date(2025, 11, 30)),
+        ("enero 2025", date(2025, 1, 1), date(2025, 1, 31)),
+        ("enero de 2025", date(2025, 1, 1), date(2025, 1, 31)),
+        ("el 5 de enero", date(2026, 1, 5), date(2026, 1, 5)),
+        ("ayer", date(2026, 10, 18), date(2026, 10, 18)),
+        ("hoy", TODAY, TODAY),
+        ("esta semana", TODAY, TODAY),
+        ("la semana pasada", date(2026, 10, 12), date(2026, 10, 18)),
+        ("este mes", date(2026, 10, 1), TODAY),
+        ("el mes pasado", date(2026, 9, 1), date(2026, 9, 30)),
+        ("este ano", date(2026, 1, 1), TODAY),
+        ("del ano 2025", date(2025, 1, 1), date(2025, 12, 31)),
+        ("el ano pasado", date(2025, 1, 1), date(2025, 12, 31)),
+        ("ultimos 7 dias", date(2026, 10, 13), TODAY),
+    ]
+
+    def test_expressions(self):
+        for text, start, end in self.CASES:
+            with self.subTest(text=text):
+                self.assertEqual(intent_router.parse_date_range(text, TODAY), (start, end))
+
+    def test_without_dates(self):
+        for text in ("hola", "articulos con stock", "del 31 al 1 de enero"):
+            with self.subTest(text=text):
+                self.assertIsNone(intent_router.parse_date_range(text, TODAY))
+
+
+class RouteTests(SimpleTestCase):
+    """Reglas de intent_router.route que no necesitan buscar nombres en SAP"""
+
+    CASES = [
+        ("top 5 productos más vendidos del 1 al 31 de enero", 'get_top_selling_products',
+         {"date_from": "2026-01-01", "date_to": "2026-01-31", "top": 5}),
+        ("los 10 clientes que más compraron en febrero", 'get_top_customers',
+         {"date_from": "2026-02-01", "date_to": "2026-02-28", "top": 10}),
+        ("desempeño del vendedor 1522 en enero", 'get_sales_person_performance',
+         {"sales_person_code": "1522", "date_from": "2026-01-01", "date_to": "2026-01-31"}),
+        ("top 5 productos del año 2025", 'get_top_selling_products',
+         {"date_from": "2025-01-01", "date_to": "2025-12-31", "top": 5}),
+        ("ranking de vendedores en enero", 'get_sales_leaderboard',
+         {"date_from": "2026-01-01", "date_to": "2026-01-31"}),
+        ("qué vendedores vendieron más el mes pasado", 'get_sales_leaderboard',
+         {"date_from": "2026-09-01", "date_to": "2026-09-30"}),
+    ]
+
+    NOT_ROUTED = [
+        "hola",
+        "top 5 productos",
+        "top 5 productos de enero 2020 y febrero 2021",
+        "top 5 clientes que no compraron en enero",
+        "top 5 clientes sin notas de credito en enero",
+        "top 5 productos del grupo ferreteria en enero",
+        "compara las ventas de enero con febrero",
+        "top 10 productos mas vendidos en marzo para el cliente C0001",
+        "top 5 clientes que mas compraron el articulo A1 en enero",
+    ]
+
+    def test_routed(self):
+        for message, tool, args in self.CASES:
+            with self.subTest(message=message):
+                intent = intent_router.route(message, TODAY)
+                self.assertIsNotNone(intent)
+                self.assertEqual((intent.tool, intent.args), (tool, args))
+
+    def test_not_routed(self):
+        for message in self.NOT_ROUTED:
+            with self.subTest(message=message):
+                self.assertIsNone(intent_router.route(message, TODAY))
+
+    def test_sales_person_name(self):
+        cases = [
+            ("desempeno de jean moreno en enero", "jean moreno"),
+            ("desempeno del vendedor jean moreno en enero", "jean moreno"),
+            ("en enero desempeno de jean moreno", "jean moreno"),
+            ("rendimiento de maria del carmen perez del 1 al 15 de enero", "maria del carmen perez"),
+            ("desempeno de 1522 jean moreno en enero", "1522 jean moreno"),
+        ]
+        for text, name in cases:
+            with self.subTest(text=text):
+                _, _, span = intent_router.find_date_range(text, TODAY)
+                self.assertEqual(intent_router.sales_person_name(text, span), name)
+
+    def test_date_numbers_are_not_codes(self):
+        with mock.patch.object(intent_router, '_search_sales_persons',
+                               return_value=[("1522", "JEAN MORENO", 1.0)]) as search:
+            intent = intent_router.route("desempeno de jean moreno del 5 de enero al 10 de enero", TODAY)
+            # El nombre no se busca hasta resolver la intención
+            search.assert_not_called()
+            self.assertEqual(intent.notes, {"sales_person_query": "jean moreno"})
+            intent = intent_router.resolve(intent)
+        search.assert_called_once_with("jean moreno")
+        self.assertEqual(intent.args, {"sales_person_code": "1522", "date_from": "2026-01-05", "date_to": "2026-01-10"})
+        self.assertEqual(intent.notes, {"sales_person_name": "JEAN MORENO"})
+
+    def test_ambiguous_name_is_not_resolved(self):
+        intent = intent_router.route("desempeno de jean en enero", TODAY)
+        with mock.patch.object(intent_router, '_search_sales_persons',
+                               return_value=[("1522", "JEAN MORENO", 0.9), ("7", "JEAN PEREZ", 0.88)]):
+            self.assertIsNone(intent_router.resolve(intent))
+
+
+class QueryReuseTests(SimpleTestCase):
+    """Filtros conjuntivos y reutilización por subconjunto de query_reuse"""
+
+    def test_parse_filters(self):
+        cases = [
+            ("", []),
+            ("DocDate ge '2026-01-01' and DocDate le '2026-01-31'",
+             [("DocDate", "ge", "2026-01-01"), ("DocDate", "le", "2026-01-31")]),
+            ("CardName eq 'O''BRIEN' AND DocTotal gt 10.5", [("CardName", "eq", "O'BRIEN"), ("DocTotal", "gt", 10.5)]),
+            ("SalesPersonCode eq -1 and Cancelled eq false", [("SalesPersonCode", "eq", -1), ("Cancelled", "eq", False)]),
+            ("CardType eq 'C' or CardType eq 'S'", None),
+            ("substringof('ACME', CardName)", None),
+            ("(DocTotal gt 1)", None),
+        ]
+        for filters, expected in cases:
+            with self.subTest(filters=filters):
+                self.assertEqual(query_reuse.parse_filters(filters), expected)
+
+    def test_implies(self):
+        cases = [
+            (("F", "eq", 5), ("F", "eq", 5), True),
+            (("F", "eq", 5), ("F", "eq", 6), False),
+            (("F", "eq", 5), ("F", "ne", 6), True),
+            (("F", "ne", 6), ("F", "ne", 6), True),
+            (("F", "ge", 10), ("F", "gt", 5), True),
+            (("F", "ge", 5), ("F", "gt", 5), False),
+            (("F", "gt", 5), ("F", "ge", 5), True),
+            (("F", "le", "2026-01-10"), ("F", "le", "2026-01-31"), True),
+            (("F", "lt", "2026-01-31"), ("F", "lt", "2026-01-10"), False),
+            (("F", "eq", 5), ("F", "le", 5), True),
+            (("F", "gt", 5), ("F", "le", 9), False),
+            (("F", "eq", "c00007"), ("F", "eq", "C00007"), True),
+            (("F", "eq", "5"), ("F", "eq", 5), False),
+        ]
+        for condition, required, expected in cases:
+            with self.subTest(condition=condition, required=required):
+                self.assertIs(query_reuse._implies(condition, required), expected)
+
+    def test_subsumes(self):
+        month = query_reuse.parse_filters("DocDate ge '2026-01-01' and DocDate le '2026-01-31'")
+        cases = [
+            ([], month, True),
+            (month, query_reuse.parse_filters("DocDate ge '2026-01-01' and DocDate le '2026-01-10'"), True),
+            (month, query_reuse.parse_filters(
+                "DocDate ge '2026-01-05' and DocDate le '2026-01-10' and CardCode eq 'C1'"), True),
+            (month, query_reuse.parse_filters("DocDate ge '2025-12-25' and DocDate le '2026-01-10'"), False),
+            (month, query_reuse.parse_filters("DocDate ge '2026-01-05'"), False),
+        ]
+        for cached, requested, expected in cases:
+            with self.subTest(cached=cached, requested=requested):
+                self.assertIs(query_reuse.subsumes(cached, requested), expected)
+
+    def test_matches(self):
+        record = {"CardCode": "C00007", "DocDate": "2026-01-05T00:00:00Z", "DocTotal": 150.0}
+        cases = [
+            ("CardCode eq 'c00007'", True),
+            ("CardCode ne 'C00007'", False),
+            ("DocDate ge '2026-01-05' and DocDate le '2026-01-05'", True),
+            ("DocDate gt '2026-01-05'", False),
+            ("DocTotal gt 100 and DocTotal le 150", True),
+            ("SalesPersonCode eq 1", False),
+        ]
+        for filters, expected in cases:
+            with self.subTest(filters=filters):
+                self.assertIs(query_reuse._matches(record, query_reuse.parse_filters(filters)), expected)
+
+    def test_locally_comparable(self):
+        self.assertTrue(query_reuse._locally_comparable(query_reuse.parse_filters(
+            "DocDate ge '2026-01-01' and CardCode eq 'C1' and DocTotal gt 5")))
+        self.assertFalse(query_reuse._locally_comparable(query_reuse.parse_filters("CardName ge 'M'")))
+
+
+class DocumentSnapshotTests(SimpleTestCase):
+    """Instantáneas columnares de document_snapshot"""
+
+    def test_round_trip(self):
+        month = date(2026, 2, 1)
+        days = [[] for _ in document_snapshot.month_days(month)]
+        days[0] = [{"DocEntry": 1, "DocNum": 10, "CardCode": "C00001", "DocDate": "2026-02-01", "DocTotal": 150.5,
+                    "SalesPersonCode": -1, "DocumentLines": [
+                        {"ItemCode": "A1", "Quantity": 2.0, "Price": 50.0, "LineTotal": 100.0},
+                        {"ItemCode": "Ñ2", "Quantity": 1.0, "Price": None, "LineTotal": 50.5}]}]
+        days[27] = [{"DocEntry": 2, "DocNum": 11, "CardCode": None, "DocDate": "2026-02-28", "DocTotal": 0,
+                     "SalesPersonCode": None, "DocumentLines": []}]
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(document_snapshot, 'SNAPSHOT_DIR', directory):
+            self.assertTrue(document_snapshot.write('http://sap', '/Invoices', month, days))
+            snapshot = document_snapshot.load('http://sap', '/Invoices', month)
+            self.assertIsNone(document_snapshot.load('http://sap', '/CreditNotes', month))
+            for day, documents in zip(document_snapshot.month_days(month), days):
+                with self.subTest(day=day):
+                    self.assertEqual([dict(document, DocumentLines=[dict(line) for line in document['DocumentLines']])
+                                      for document in snapshot.day(day)], documents)
+
+    def test_delete_and_replace(self):
+        february, march = date(2026, 2, 1), date(2026, 3, 1)
+
+        def month(month_start, doc_entry):
+            days = [[] for _ in document_snapshot.month_days(month_start)]
+            days[0] = [{"DocEntry": doc_entry, "DocumentLines": []}]
+            return days
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(document_snapshot, 'SNAPSHOT_DIR', directory):
+            document_snapshot.write('http://sap', '/Invoices', february, month(february, 1))
+            document_snapshot.write('http://other', '/Invoices', february, month(february, 2))
+            document_snapshot.write('http://sap', '/Invoices', march, month(march, 3))
+            self.assertEqual(document_snapshot.load('http://sap', '/Invoices', february).day(february)[0]['DocEntry'], 1)
+
+            # Otro worker reemplaza el archivo: se vuelve a mapear
+            path = document_snapshot._path('http://sap', '/Invoices', february)
+            with open(path + '.new', 'wb') as f:
+                f.write(document_snapshot._encode(month(february, 4)))
+            os.replace(path + '.new', path)
+            self.assertEqual(document_snapshot.load('http://sap', '/Invoices', february).day(february)[0]['DocEntry'], 4)
+
+            document_cache.clear()
+            self.assertEqual(len(os.listdir(directory)), 3)
+            self.assertTrue(document_snapshot.delete('http://sap', '/Invoices', february))
+            self.assertFalse(document_snapshot.delete('http://sap', '/Invoices', february))
+            self.assertIsNone(document_snapshot.load('http://sap', '/Invoices', february))
+            self.assertIsNotNone(document_snapshot.load('http://other', '/Invoices', february))
+            self.assertIsNotNone(document_snapshot.load('http://sap', '/Invoices', march))
+
+    def test_closed(self):
+        with mock.patch.object(document_snapshot, 'GRACE_DAYS', 7):
+            self.assertTrue(document_snapshot.is_closed(date(2026, 9, 1), TODAY))
+            self.assertFalse(document_snapshot.is_closed(date(2026, 10, 1), TODAY))
+            self.assertFalse(document_snapshot.is_closed(date(2026, 9, 1), date(2026, 10, 7)))
+
+
+class DocumentCacheTests(SimpleTestCase):
+    """Fragmentos por día de document_cache y el filtro de get_documents_for"""
+
+    def setUp(self):
+        patcher = mock.patch.object(document_snapshot, 'SNAPSHOT_DIR', '')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(document_cache.clear)
+
+    def test_chunks(self):
+        days = [date(2026, 1, day) for day in (1, 2, 3, 4, 5, 6, 7, 8, 9, 12, 13)]
+        self.assertEqual(document_cache._chunks(days), [
+            (date(2026, 1, 1), date(2026, 1, 7)),
+            (date(2026, 1, 8), date(2026, 1, 9)),
+            (date(2026, 1, 12), date(2026, 1, 13)),
+        ])
+
+    def test_documents_for_cold_filters_on_server(self):
+        sap = FakeSAP('http://documents-cold', {'/Invoices': []})
+        result = document_cache.get_documents_for(sap, '/Invoices', '2026-01-01', '2026-01-31', 'CardCode', "O'BRIEN")
+        self.assertTrue(result["success"])
+        self.assertEqual(sap.queries, [
+            ('/Invoices', "DocDate ge '2026-01-01' and DocDate le '2026-01-31' and CardCode eq 'O''BRIEN'")])
+
+        result = document_cache.get_documents_for(sap, '/Invoices', '2026-01-01', '2026-01-31',
+                                                  "CardCode eq 'x' or DocTotal", 1)
+        self.assertFalse(result["success"])
+        self.assertEqual(len(sap.queries), 1)
+
+    def test_documents_for_warm_filters_locally(self):
+        sap = FakeSAP('http://documents-warm', {'/Invoices': [
+            {"DocEntry": 1, "DocDate": "2026-01-02", "SalesPersonCode": 7},
+            {"DocEntry": 2, "DocDate": "2026-01-03", "SalesPersonCode": 8},
+        ]})
+        self.assertEqual(document_cache.get_documents(sap, '/Invoices', '2026-01-01', '2026-01-05')["count"], 2)
+        result = document_cache.get_documents_for(sap, '/Invoices', '2026-01-02', '2026-01-04', 'SalesPersonCode', '7')
+        self.assertEqual([document["DocEntry"] for document in result["data"]], [1])
+        self.assertEqual(len(sap.queries), 1)
+
+
+class InventoryTests(SimpleTestCase):
+    """Filtros, agregación y top-k de inventory.query"""
+
+    def setUp(self):
+        def warehouse(code, in_stock, committed=0.0, ordered=0.0):
+            return {"WarehouseCode": code, "InStock": in_stock, "Committed": committed, "Ordered": ordered}
+
+        self.snapshot = inventory.Snapshot([
+            {"ItemCode": "A1", "ItemsGroupCode": 100,
+             "ItemWarehouseInfoCollection": [warehouse("01", 10, 2), warehouse("02", 5, 0, 4)]},
+            {"ItemCode": "A2", "ItemsGroupCode": 101,
+             "ItemWarehouseInfoCollection": [warehouse("01", 30), warehouse("02", 0)]},
+            {"ItemCode": "A3", "ItemsGroupCode": 100, "ItemWarehouseInfoCollection": [warehouse("02", 1)]},
+        ])
+
+    def rows(self, **kwargs):
+        result = inventory.query(self.snapshot, **kwargs)
+        return [(self.snapshot.item_codes[item], values) for (item, _), values in result["rows"]]
+
+    def test_totals_per_item(self):
+        self.assertEqual(self.rows(), [("A2", [30, 0, 0, 30]), ("A1", [15, 2, 4, 17]), ("A3", [1, 0, 0, 1])])
+
+    def test_filters(self):
+        self.assertEqual([code for code, _ in self.rows(warehouse="02", group="100")], ["A1", "A3"])
+        self.assertEqual([code for code, _ in self.rows(item_codes=["A3", "A9"])], ["A3"])
+        self.assertEqual([code for code, _ in self.rows(warehouse="02", min_quantity=1)], ["A1", "A3"])
+
+    def test_sort_and_top(self):
+        self.assertEqual([code for code, _ in self.rows(sort_by="available", ascending=True, top=2)], ["A3", "A1"])
+        result = inventory.query(self.snapshot, per_warehouse=True, top=1)
+        (item, warehouse), _ = result["rows"][0]
+        self.assertEqual((self.snapshot.item_codes[item], self.snapshot.warehouses[warehouse]), ("A2", "01"))
+        self.assertEqual(result["matches"], 5)
+        with self.assertRaises(ValueError):
+            inventory.query(self.snapshot, sort_by="price")
+
+
+class TableHandleTests(SimpleTestCase):
+    """Marcadores y páginas de table_handles"""
+
+    spec = {"query_id": 7, "columns": ["DocNum", "CardCode", "DocTotal"], "title": "Facturas"}
+
+    def test_markers(self):
+        token = table_handles.sign(self.spec)
+        self.assertEqual(table_handles.load(token), self.spec)
+        text = f"Aquí está:\n{table_handles.marker(token)}\nY otra vez {table_handles.marker(token)}"
+        self.assertEqual(table_handles.tokens_in(text), [token])
+        with self.assertRaises(table_handles.signing.BadSignature):
+            table_handles.load(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+
+    def test_columns(self):
+        self.assertEqual(table_handles.columns_of(" DocNum, CardCode ", {"X": 1}), ["DocNum", "CardCode"])
+        self.assertEqual(table_handles.columns_of("", {"odata.etag": "x", "ItemCode": "A1"}), ["ItemCode"])
+        self.assertEqual(table_handles.columns_of("", None), [])
+
+    def test_python_page(self):
+        records = [{"DocNum": i, "CardCode": f"C{i % 3}", "DocTotal": None if i == 4 else i * 10.0} for i in range(1, 8)]
+        with mock.patch('main.models.QueryCache.objects') as objects:
+            objects.filter.return_value.values_list.return_value.first.return_value = {"data": records}
+            page = table_handles._python_page(self.spec, 2, 2, "DocTotal", True, "c1")
+            self.assertEqual((page["total_rows"], page["matches"]), (7, 3))
+            self.assertEqual([record["DocNum"] for record in page["records"]], [4])
+
+            objects.filter.return_value.values_list.return_value.first.return_value = None
+            with self.assertRaises(table_handles.TableGone):
+                table_handles._python_page(self.spec, 1, 2, "", False, "")
+
+    def test_invalid_sort(self):
+        with self.assertRaises(ValueError):
+            table_handles.page(self.spec, sort="ItemName")
+        with self.assertRaises(ValueError):
+            table_handles.page(dict(self.spec, columns=["a') --"]), sort="a') --")
+
+
+class ImportTimeTests(SimpleTestCase):
+    """Presupuesto de arranque (python -X importtime) de las URLs, que importan las vistas"""
+
+    RUNS = 3
+    # Microsegundos acumulados, el mejor de RUNS arranques. Antes de cargar el SDK
+    # de Gemini en el primer uso, Damasco.urls tomaba ~600 ms y google.genai ~450 ms
+    BUDGETS = {'Damasco.urls': 300_000, 'main.views': 250_000}
+    LAZY_MODULES = ('google.genai',)
+
+    def import_times(self):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import django; django.setup(); import Damasco.urls'],
+            cwd=settings.BASE_DIR, env=dict(os.environ, DJANGO_SETTINGS_MODULE='Damasco.settings'),
+            capture_output=True, text=True, timeout=120
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        times = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+        return times
+
+    def test_startup_budget(self):
+        runs = [self.import_times() for _ in range(self.RUNS)]
+        for name in self.LAZY_MODULES:
+            with self.subTest(lazy=name):
+                self.assertNotIn(name, runs[0])
+        for name, budget in self.BUDGETS.items():
+            with self.subTest(module=name):
+                best = min(times[name] for times in runs)
+                self.assertLessEqual(best, budget, f"{name} tarda {best / 1000:.0f} ms en importarse")
+
+
+class MasterDataTests(SimpleTestCase):
+    """Directorio de datos maestros, su índice de nombres y las sesiones de las analíticas"""
+
+    def tearDown(self):
+        master_data.clear()
+
+    def test_clear_empties_name_index(self):
+        sap = FakeSAP('http://names', {'/SalesPersons': [
+            {"SalesEmployeeCode": 1522, "SalesEmployeeName": "JEAN MORENO", "Active": "tYES"},
+            {"SalesEmployeeCode": 7, "SalesEmployeeName": "ANA PEREZ", "Active": "tYES"}]})
+        self.assertEqual(name_index.get_index(sap, 'sales_persons').search("jean moreno")[0][0], "1522")
+        sap.records['/SalesPersons'] = sap.records['/SalesPersons'][1:]
+        master_data.clear()
+        self.assertEqual(name_index.get_index(sap, 'sales_persons').search("jean moreno"), [])
+        self.assertEqual(master_data.name(sap, 'sales_persons', 7), "ANA PEREZ")
+
+    def test_analytics_log_out_after_names(self):
+        invoice = {"DocEntry": 1, "CardCode": "C1", "DocTotal": 100.0, "SalesPersonCode": 1,
+                   "DocumentLines": [{"ItemCode": "A1", "Quantity": 2.0, "Price": 50.0, "LineTotal": 100.0}]}
+        calls = mock.Mock()
+        calls.login.return_value = True
+        calls.name.return_value = "Artículo"
+        with mock.patch.object(sap_service_layer, 'SAPServiceLayer', return_value=calls), \
+                mock.patch.object(sap_service_layer.master_data, 'name', calls.name), \
+                mock.patch.object(sap_service_layer.document_cache, 'get_documents',
+                                  side_effect=lambda sap, endpoint, *args: {
+                                      "success": True, "data": [invoice] if endpoint == '/Invoices' else []}):
+            for tool in (sap_service_layer.get_top_selling_products, sap_service_layer.get_top_customers,
+                         sap_service_layer.get_sales_leaderboard):
+                with self.subTest(tool=tool.__name__):
+                    calls.reset_mock()
+                    self.assertTrue(codec.loads(tool('2026-01-01', '2026-01-31'))["success"])
+                    names = [call[0] for call in calls.mock_calls if call[0] in ('name', 'logout')]
+                    self.assertEqual(names[-1], 'logout')
+                    self.assertIn('name', names)
+                    self.assertEqual(names.count('logout'), 1)
+
+
+class ConcurrencyTests(SimpleTestCase):
+    """Límite AIMD de concurrency y reintentos del cliente del Service Layer"""
+
+    def limiter(self, initial=4):
+        return concurrency.AIMDLimiter('test', initial=initial, max_limit=8)
+
+    def fill(self, limiter):
+        for _ in range(int(limiter.limit)):
+            limiter.acquire()
+
+    def test_additive_increase(self):
+        limiter = self.limiter()
+        self.fill(limiter)
+        for _ in range(4):
+            limiter.release(0.1, key='/Invoices')
+            limiter.acquire()
+        self.assertAlmostEqual(limiter.limit, 5, delta=0.1)
+
+    def test_multiplicative_decrease(self):
+        limiter = self.limiter()
+        self.fill(limiter)
+        limiter.release(0.1, overloaded=True)
+        self.assertEqual(limiter.limit, 2)
+        # Como mucho una reducción por intervalo
+        limiter.release(0.1, overloaded=True)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_baseline_per_key(self):
+        limiter = self.limiter()
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(0.01, key='/SalesPersons')
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(1.0, key='/Invoices')
+        self.assertEqual(limiter.limit, 4)
+        limiter.acquire()
+        limiter.release(5.0, key='/Invoices')
+        self.assertEqual(limiter.limit, 2)
+
+    def test_login_retries_overload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sap_config.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({"service_layer": {"base_url": "http://sap.test/b1s/v1", "username": "u@DB",
+                                             "password": "p"}, "endpoints": {}}, f)
+            sap = sap_service_layer.SAPServiceLayer(path)
+        login = sap.session.get_adapter("http://sap.test/b1s/v1/Login").max_retries
+        query = sap.session.get_adapter("http://sap.test/b1s/v1/Invoices").max_retries
+        self.assertIn(503, login.status_forcelist)
+        self.assertIn(429, login.status_forcelist)
+        self.assertNotIn(503, query.status_forcelist)
+
+
+class ComparePeriodsTests(SimpleTestCase):
+    """Comparación de períodos sobre una sola descarga"""
+
+    @staticmethod
+    def invoice(doc_date, card_code, line_total, price=10.0):
+        return {"DocDate": doc_date, "CardCode": card_code, "SalesPersonCode": 1,
+                "DocumentLines": [{"ItemCode": "A1", "Quantity": 1.0, "Price": price, "LineTotal": line_total}]}
+
+    def test_deltas_against_first_period(self):
+        documents = {
+            '/Invoices': [self.invoice('2026-01-10', 'C1', 100.0), self.invoice('2026-02-10', 'C1', 150.0),
+                          self.invoice('2026-02-11', 'C2', 50.0), self.invoice('2026-02-12', 'C2', 2.0, price=2.0)],
+            '/CreditNotes': [self.invoice('2026-02-20', 'C1', 30.0)],
+        }
+        fetches = []
+
+        def get_documents(sap, endpoint, start, end):
+            fetches.append((endpoint, start, end))
+            return {"success": True, "data": [d for d in documents[endpoint] if start <= d["DocDate"] <= end]}
+
+        sap = mock.Mock()
+        sap.login.return_value = True
+        with mock.patch.object(sap_service_layer, 'SAPServiceLayer', return_value=sap), \
+                mock.patch.object(sap_service_layer.master_data, 'name', return_value=""), \
+                mock.patch.object(sap_service_layer.document_cache, 'get_documents', side_effect=get_documents):
+            result = codec.loads(sap_service_layer.compare_periods([
+                {"date_from": "2026-01-01", "date_to": "2026-01-31"},
+                {"date_from": "2026-02-01", "date_to": "2026-02-28"}]))
+
+        # Enero y febrero son contiguos: un solo tramo por endpoint
+        self.assertEqual(fetches, [('/Invoices', '2026-01-01', '2026-02-28'),
+                                   ('/CreditNotes', '2026-01-01', '2026-02-28')])
+        self.assertEqual([period["net_sales"] for period in result["periods"]], [100.0, 170.0])
+        self.assertEqual(result["periods"][1]["delta_vs_first"], 70.0)
+        self.assertEqual(result["periods"][1]["growth_percent_vs_first"], 70.0)
+        customers = {row["code"]: row for row in result["customers"]}
+        self.assertEqual(customers["C1"]["deltas"], [20.0])
+        self.assertEqual(customers["C2"]["growth_percent"], [None])
+        self.assertEqual(result["customers"][0]["code"], "C2")
+        sap.logout.assert_called_once()
+
+
+class RetentionTests(SimpleTestCase):
+    """Poda de QueryCache sobre la base de pruebas (migrada)"""
+    databases = {'default'}
+
+    def setUp(self):
+        from .models import QueryCache
+        self.model = QueryCache
+        now = timezone.now()
+        rows = [("old", now - timedelta(days=30), 10)]
+        rows += [("busy", now - timedelta(minutes=i), 10) for i in range(5)]
+        rows += [("big", now - timedelta(hours=1), 3 * 1024 * 1024)]
+        for session_id, timestamp, size in rows:
+            QueryCache.objects.create(session_id=session_id, query_type="Invoices", query_description="",
+                                      query_params={}, result_data=[], result_size=size, timestamp=timestamp)
+
+    def tearDown(self):
+        self.model.objects.all().delete()
+
+    def test_enforce_rules(self):
+        removed = retention.enforce(max_age_hours=24, max_rows_per_session=3, max_total_mb=1)
+        self.assertEqual((removed["age"], removed["session_rows"], removed["total_size"]), (1, 2, 1))
+        remaining = self.model.objects.order_by('-timestamp').values_list('session_id', flat=True)
+        self.assertEqual(list(remaining), ["busy"] * 3)
+
+    def test_migrated_database_vacuums_incrementally(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA auto_vacuum')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+
+class MetricsTests(SimpleTestCase):
+    """Exposición en formato de texto de Prometheus"""
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Prueba', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, stage='sap_get')
+        self.assertEqual(histogram.collect().splitlines(), [
+            '# HELP test_seconds Prueba',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{stage="sap_get",le="0.1"} 1',
+            'test_seconds_bucket{stage="sap_get",le="1"} 2',
+            'test_seconds_bucket{stage="sap_get",le="+Inf"} 3',
+            'test_seconds_sum{stage="sap_get"} 5.550000',
+            'test_seconds_count{stage="sap_get"} 3',
+        ])
+
+    def test_label_values_are_escaped(self):
+        counter = metrics.Counter('test_total', 'Prueba')
+        counter.inc(endpoint='/Items("A\\1")\n')
+        counter.inc(2, endpoint='/Items("A\\1")\n')
+        self.assertEqual(counter.collect().splitlines()[-1],
+                         'test_total{endpoint="/Items(\\"A\\\\1\\")\\n"} 3')
+
+    def test_request_accumulates_pages(self):
+        before = metrics.CHAT_REQUESTS._values.get((('status', 'ok'),), 0)
+        stats = metrics.begin_request()
+        metrics.record_sap_page('/Invoices', 1000)
+        metrics.record_sap_page('/Invoices', 500)
+        self.assertEqual((stats.pages, stats.bytes), (2, 1500))
+        metrics.end_request()
+        self.assertIsNone(metrics.current_request())
+        self.assertEqual(metrics.CHAT_REQUESTS._values[(('status', 'ok'),)], before + 1)
+        self.assertTrue(metrics.render().endswith('\n'))
+
+
+class CodecTests(SimpleTestCase):
+    """Decodificación de páginas con proyección de campos"""
+
+    PAGE = ('{"odata.metadata": "x", "value": [ {"DocEntry": 1, "CardCode": "C\\u00d11", "Comments": "a, b]",\n'
+            '"DocumentLines": [{"ItemCode": "A1", "Price": 5.5, "FreeText": "}"}]}, {"DocEntry": 2, "Extra": {"k": [1]}}\n'
+            ' ], "@odata.nextLink": "Invoices?$skip=2"}')
+    FIELDS = codec.fields_from_select('DocEntry,CardCode', {"DocumentLines": ("ItemCode", "Price")})
+    EXPECTED = {
+        "odata.metadata": "x",
+        "value": [{"DocEntry": 1, "CardCode": "CÑ1", "DocumentLines": [{"ItemCode": "A1", "Price": 5.5}]},
+                  {"DocEntry": 2}],
+        "@odata.nextLink": "Invoices?$skip=2",
+    }
+
+    def test_incremental_decoder(self):
+        records, extra = codec._iter_stdlib_page(self.PAGE, self.FIELDS)
+        self.assertEqual(dict(extra, value=records), self.EXPECTED)
+
+    def test_parse_page_matches_backend(self):
+        self.assertEqual(codec.parse_page(self.PAGE.encode('utf-8'), self.FIELDS), self.EXPECTED)
+        self.assertEqual(codec.parse_page(self.PAGE)["value"][1]["Extra"], {"k": [1]})
+
+    def test_raw_json_is_stored_verbatim(self):
+        encoder = codec.CodecJSONEncoder()
+        self.assertEqual(encoder.encode(codec.RawJSON('{"a":1}')), '{"a":1}')
+        self.assertEqual(codec.loads(encoder.encode({"ñ": [1, 2]})), {"ñ": [1, 2]})
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Coalescencia de consultas idénticas en curso"""
+
+    def test_concurrent_calls_share_one_execution(self):
+        group = singleflight.Group()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"value": [1]}
+
+        leader = threading.Thread(target=lambda: results.append(group.do('k', fetch)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(group.do('k', fetch)))
+        follower.start()
+        while group._calls['k'].waiters == 0:
+            follower.join(0.01)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [({"value": [1]}, True)] * 2)
+        self.assertEqual(group.in_flight(), 0)
+
+    def test_error_is_not_cached(self):
+        group = singleflight.Group()
+        with self.assertRaises(ValueError):
+            group.do('k', lambda: int('x'))
+        self.assertEqual(group.do('k', lambda: 1), (1, False))
+
+    def test_query_key_is_canonical(self):
+        self.assertEqual(
+            singleflight.query_key('http://sap/', '/Items', "ItemCode  eq 'A'", 'ItemName, ItemCode'),
+            singleflight.query_key('http://sap', '/Items', "ItemCode eq 'A'", 'ItemCode,ItemName'))
+
+
+class MockServerTestCase(SimpleTestCase):
+    """Service Layer simulado en otro proceso y una sesión por prueba"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.config_path = os.path.join(cls.directory.name, 'sap_config.json')
+        cls.server = spawn_mock_server(cls.config_path, documents=1200, days=10)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.kill()
+        cls.server.wait()
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.sap = sap_service_layer.SAPServiceLayer(self.config_path)
+        self.assertTrue(self.sap.login())
+        fetch_mock_stats(self.sap.base_url, reset=True)
+
+    def tearDown(self):
+        self.sap.logout()
+
+
+class PaginationTests(MockServerTestCase):
+    """Paginación contra el Service Layer simulado"""
+
+    def test_documents_use_keyset_cursor(self):
+        with mock.patch.object(self.sap.session, 'get', wraps=self.sap.session.get) as get:
+            result = self.sap.query('/Invoices', select='DocEntry,DocDate')
+        self.assertEqual(result["count"], 1200)
+        self.assertEqual(len({record["DocEntry"] for record in result["data"]}), 1200)
+        filters = [call.kwargs["params"].get('$filter', '') for call in get.call_args_list]
+        self.assertEqual(filters[0], '')
+        self.assertTrue(all(f.startswith('DocEntry gt ') for f in filters[1:]), filters)
+        self.assertEqual(fetch_mock_stats(self.sap.base_url)["pages"], 3)
+
+    def test_page_size_is_negotiated(self):
+        self.sap.session.headers['Prefer'] = "odata.maxpagesize=100000"
+        result = self.sap.query('/Items', select='ItemCode')
+        self.assertTrue(result["success"])
+        self.assertEqual(self.sap.page_size, 5000)
+        self.assertEqual(fetch_mock_stats(self.sap.base_url)["pages"], 1)
+
+
+class NameIndexTests(SimpleTestCase):
+    """Búsqueda por trigramas en el índice de nombres"""
+
+    def setUp(self):
+        self.index = name_index.NameIndex()
+        self.index.update({"1522": "JEAN MORENO", "1523": "JUAN MORENO", "7": "MARÍA PÉREZ",
+                           "C0001": "FERRETERÍA EL CLAVO, C.A."})
+
+    def test_ranking(self):
+        results = self.index.search("jean moreno")
+        self.assertEqual([code for code, _, _ in results[:2]], ["1522", "1523"])
+        self.assertGreater(results[0][2], results[1][2])
+        self.assertEqual(self.index.search("maria perez", limit=1), [("7", "MARÍA PÉREZ", 1.0)])
+        self.assertEqual(self.index.search("ferreteria clavo")[0][0], "C0001")
+        self.assertEqual(self.index.search("xyz"), [])
+
+    def test_exact_code_wins(self):
+        self.assertEqual(self.index.search("1523 jean moreno")[0], ("1523", "JUAN MORENO", 1.0))
+        self.assertEqual(self.index.search("C0001")[0][2], 1.0)
+
+    def test_incremental_update(self):
+        self.index.update({"1522": "PEDRO GOMEZ"}, removed=["1523"])
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search("moreno"), [])
+        self.assertEqual(self.index.search("pedro gomez")[0][0], "1522")
+
+
+class BatchTests(MockServerTestCase):
+    """Peticiones OData $batch"""
+
+    def test_encode_decode_round_trip(self):
+        content_type, body = odata_batch.encode(["/b1s/v2/Items?$top=2", "/b1s/v2/Orders"], {"Prefer": "x"})
+        boundary = content_type.split('boundary=')[1]
+        parts = body.decode('utf-8').split(f"--{boundary}")
+        self.assertEqual(parts[-1], "--\r\n")
+        self.assertIn("GET /b1s/v2/Items?$top=2 HTTP/1.1\r\nPrefer: x\r\n", parts[1])
+        # Respuesta con LF en lugar de CRLF y cuerpos vacíos
+        response = (b"--r\nContent-Type: application/http\n\nHTTP/1.1 200 OK\nContent-Type: application/json\n\n"
+                    b'{"value":[]}\n--r\nContent-Type: application/http\n\nHTTP/1.1 404 Not Found\n\n\n--r--\n')
+        self.assertEqual(odata_batch.decode('multipart/mixed; boundary="r"', response), [
+            (200, {"content-type": "application/json"}, b'{"value":[]}'),
+            (404, {}, b''),
+        ])
+
+    def test_bounded_queries_share_one_post(self):
+        queries = [{"endpoint": '/Items', "select": 'ItemCode', "top": 3},
+                   {"endpoint": '/Invoices', "filters": "DocEntry le 5", "select": 'DocEntry', "top": 700},
+                   {"endpoint": '/Nothing', "top": 1}]
+        with mock.patch.object(self.sap.session, 'post', wraps=self.sap.session.post) as post:
+            results = self.sap.batch(queries)
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual([len(result.get("data", [])) for result in results], [3, 5, 0])
+        self.assertFalse(results[2]["success"])
+        self.assertEqual(fetch_mock_stats(self.sap.base_url)["pages"], 2)
+
+
+class WriteBehindTests(SimpleTestCase):
+    """Escritura diferida en la base de pruebas"""
+    databases = {'default'}
+
+    def setUp(self):
+        from .models import ChatMessage, QueryCache
+        self.ChatMessage, self.QueryCache = ChatMessage, QueryCache
+        patcher = mock.patch.multiple(write_behind, ENABLED=True, WRITE_RETRIES=1, RETRY_CYCLE_DELAY=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        write_behind.flush(5)
+        self.ChatMessage.objects.all().delete()
+        self.QueryCache.objects.all().delete()
+
+    def test_flush_writes_pending_rows(self):
+        write_behind.add(self.ChatMessage(role='user', message='hola'))
+        self.assertTrue(write_behind.flush(5))
+        self.assertEqual(write_behind.pending(self.ChatMessage), [])
+        self.assertEqual(list(self.ChatMessage.objects.values_list('message', flat=True)), ['hola'])
+
+    def test_locked_database_keeps_chat_and_drops_cache(self):
+        manager_class = type(self.ChatMessage.objects)
+        real_bulk_create = manager_class.bulk_create
+        attempts = []
+
+        def bulk_create(manager, objs, **kwargs):
+            attempts.append(manager.model)
+            if manager.model is self.QueryCache or attempts.count(self.ChatMessage) == 1:
+                raise OperationalError("database is locked")
+            return real_bulk_create(manager, objs, **kwargs)
+
+        with mock.patch.object(manager_class, 'bulk_create', bulk_create):
+            write_behind.add(self.QueryCache(session_id='s', query_type='Items', query_description='',
+                                             query_params={}, result_data=[]))
+            write_behind.add(self.ChatMessage(role='user', message='reintento'))
+            # La fila de QueryCache se descarta; el mensaje vuelve a la cola y se escribe en el siguiente ciclo
+            self.assertFalse(write_behind.flush(5))
+        self.assertEqual(attempts.count(self.ChatMessage), 2)
+        self.assertEqual(list(self.ChatMessage.objects.values_list('message', flat=True)), ['reintento'])
+        self.assertFalse(self.QueryCache.objects.exists())
+
+
+class ExportTests(MockServerTestCase):
+    """Exportación CSV en streaming"""
+
+    def test_csv_is_written_page_by_page(self):
+        fetched = []
+
+        def pages():
+            for number in (1, 2):
+                fetched.append(number)
+                yield [{"ItemCode": f"A{number}", "Lines": [{"q": 1}], "ItemName": "no seleccionado"}]
+
+        chunks = export._csv_chunks({"select": "ItemCode,Lines"}, pages())
+        self.assertEqual(next(chunks), '\ufeffItemCode,Lines\r\n')
+        self.assertEqual(next(chunks), 'A1,"[{""q"":1}]"\r\n')
+        self.assertEqual(fetched, [1])
+        self.assertEqual(list(chunks), ['A2,"[{""q"":1}]"\r\n'])
+        # Sin registros igual se escribe la cabecera
+        self.assertEqual(list(export._csv_chunks({"select": "ItemCode"}, iter([]))), ['\ufeffItemCode\r\n'])
+
+    def test_open_stream_from_service_layer(self):
+        spec = {"entity": 'Invoices', "select": 'DocEntry,CardCode', "filters": 'DocEntry le 1100', "format": 'csv'}
+        with mock.patch.dict(os.environ, {'SAP_CONFIG_PATH': self.config_path}):
+            content_type, filename, chunks = export.open_stream(spec)
+            body = ''.join(chunks)
+        self.assertEqual(content_type, 'text/csv; charset=utf-8')
+        self.assertTrue(filename.startswith('Invoices_') and filename.endswith('.csv'))
+        lines = body.lstrip('\ufeff').splitlines()
+        self.assertEqual(lines[0], 'DocEntry,CardCode')
+        self.assertEqual(len(lines), 1101)
+        self.assertEqual(fetch_mock_stats(self.sap.base_url)["pages"], 3)
+        self.assertEqual(export.load(export.sign(spec)), spec)
+
+
+class LeaderboardTests(SimpleTestCase):
+    """El ranking de una pasada coincide con el desempeño de cada vendedor"""
+
+    DOCUMENTS = {
+        '/Invoices': [
+            {"DocEntry": 1, "CardCode": "C1", "SalesPersonCode": 1,
+             "DocumentLines": [{"ItemCode": "A1", "Quantity": 2.0, "Price": 50.0, "LineTotal": 100.0},
+                               {"ItemCode": "A2", "Quantity": 1.0, "Price": 2.0, "LineTotal": 2.0}]},
+            {"DocEntry": 2, "CardCode": "C2", "SalesPersonCode": 1,
+             "DocumentLines": [{"ItemCode": "A2", "Quantity": 10.0, "Price": 5.0, "LineTotal": 50.0}]},
+            {"DocEntry": 3, "CardCode": "C1", "SalesPersonCode": 2,
+             "DocumentLines": [{"ItemCode": "A1", "Quantity": 4.0, "Price": 50.0, "LineTotal": 200.0}]},
+        ],
+        '/CreditNotes': [
+            {"DocEntry": 9, "CardCode": "C1", "SalesPersonCode": 2,
+             "DocumentLines": [{"ItemCode": "A1", "Quantity": 1.0, "Price": 40.0, "LineTotal": 40.0}]},
+        ],
+    }
+
+    def call(self, tool, *args):
+        sap = mock.Mock()
+        sap.login.return_value = True
+        with mock.patch.object(sap_service_layer, 'SAPServiceLayer', return_value=sap), \
+                mock.patch.object(sap_service_layer.master_data, 'name', side_effect=lambda s, kind, code: f"N{code}"), \
+                mock.patch.object(sap_service_layer.document_cache, 'get_documents',
+                                  side_effect=lambda s, endpoint, *dates: {
+                                      "success": True, "data": self.DOCUMENTS[endpoint]}), \
+                mock.patch.object(sap_service_layer.document_cache, 'get_documents_for',
+                                  side_effect=lambda s, endpoint, date_from, date_to, field, value: {
+                                      "success": True,
+                                      "data": [d for d in self.DOCUMENTS[endpoint] if str(d[field]) == str(value)]}):
+            return codec.loads(tool(*args))
+
+    def test_matches_performance(self):
+        result = self.call(sap_service_layer.get_sales_leaderboard, '2026-01-01', '2026-01-31')
+        self.assertEqual([row["SalesPersonCode"] for row in result["leaderboard"]], ["2", "1"])
+        self.assertEqual([row["rank"] for row in result["leaderboard"]], [1, 2])
+        self.assertEqual(result["total_net_sales"], 310.0)
+        self.assertEqual([row["share_percent"] for row in result["leaderboard"]], [51.61, 48.39])
+        for row in result["leaderboard"]:
+            with self.subTest(code=row["SalesPersonCode"]):
+                summary = self.call(sap_service_layer.get_sales_person_performance,
+                                    row["SalesPersonCode"], '2026-01-01', '2026-01-31')["summary"]
+                for key in ("net_sales", "gross_sales", "returns", "return_rate_percent", "total_invoices",
+                            "total_credit_notes", "unique_customers", "unique_products_sold"):
+                    self.assertEqual(row[key], summary[key], key)
+        self.assertEqual(result["leaderboard"][1]["top_products"][0],
+                         {"ItemCode": "A1", "ItemDescription": "NA1", "NetQuantitySold": 2.0, "NetSalesAmount": 100.0})
+
+
+class ChatViewTests(SimpleTestCase):
+    """La página del chat recibe el historial como JSON"""
+    databases = {'default'}
+
+    def tearDown(self):
+        from .models import ChatMessage
+        ChatMessage.objects.all().delete()
+
+    def test_history_is_embedded_as_json(self):
+        from .models import ChatMessage
+        now = timezone.now()
+        ChatMessage.objects.create(role='user', message='</script><script>alert(1)</script>',
+                                   timestamp=now - timedelta(seconds=1))
+        ChatMessage.objects.create(role='assistant', message='| A | B |\n|---|---|\n| 1 | 2 |', timestamp=now)
+        response = Client().get('/')
+        self.assertEqual(response.status_code, 200)
+        html = response.content.decode('utf-8')
+        self.assertNotIn('<script>alert(1)', html)
+        start = html.index('<script id="chatHistory" type="application/json">') + len(
+            '<script id="chatHistory" type="application/json">')
+        history = json.loads(html[start:html.index('</script>', start)])
+        self.assertEqual(history, [
+            {"role": "user", "message": '</script><script>alert(1)</script>'},
+            {"role": "assistant", "message": '| A | B |\n|---|---|\n| 1 | 2 |'},
+        ])
@@ -5,4 +5,7 @@ urlpatterns = [
     path('', views.chat_view, name='chat'),
     path('send/', views.send_message, name='send_message'),
     path('clear/', views.clear_history, name='clear_history'),
+    path('export/', views.export_view, name='export'),
+    path('table/', views.table_view, name='table'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
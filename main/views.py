@@ -1,223 +1,507 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core import signing
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from google import genai
-from google.genai.types import Tool, FunctionDeclaration, GenerateContentConfig
 import json
 import os
+import threading
 from .models import ChatMessage, QueryCache
-from .sap_service_layer import query_sap_service_layer, get_sap_metadata, get_cached_queries, get_top_selling_products, get_top_customers, get_sales_person_performance, reset_session
+from . import answer_cache, codec, export, intent_router, metrics, profiling, table_handles, write_behind
+from .sap_service_layer import query_sap_service_layer, get_sap_metadata, get_cached_queries, get_top_selling_products, get_top_customers, get_sales_person_performance, get_sales_leaderboard, compare_periods, get_stock, lookup_master_data, find_code_by_name, query_sap_service_layer_many, create_export_link, create_table_view, reset_session
 
 # Cliente global de Vertex AI
 vertex_client = None
 
-# Definir las herramientas (Functions) para SAP Service Layer
-sap_tools = [
-    Tool(
-        function_declarations=[
-            FunctionDeclaration(
-                name="query_sap_service_layer",
-                description="""Consulta datos de SAP Business One Service Layer. 
-                
-                Entidades disponibles:
-                - Items: Maestro de artículos/productos
-                - BusinessPartners: Clientes y proveedores
-                - Orders: Pedidos de venta
-                - Invoices: Facturas de venta
-                - PurchaseOrders: Órdenes de compra
-                - InventoryGenEntries: Entradas de mercancías
-                - InventoryGenExits: Salidas de mercancías
-                - ItemGroups: Grupos de artículos
-                - Warehouses: Almacenes
-                - PriceLists: Listas de precios
-                
-                Ejemplos de filtros OData:
-                - Items activos: "Valid eq 'Y'"
-                - Items con stock: "OnHand gt 0"
-                - Clientes: "CardType eq 'C'"
-                - Documentos abiertos: "DocumentStatus eq 'O'"
-                """,
-                parameters={
-                    "type": "object",
-                    "properties": {
-                        "entity": {
-                            "type": "string",
-                            "description": "Nombre de la entidad SAP (Items, BusinessPartners, Orders, etc.)"
+# El SDK de Gemini (google.genai) y las declaraciones de herramientas se cargan
+# en el primer uso: importarlos toma más que el resto de la aplicación y urls.py
+# importa este módulo en cada comando de manage.py y al arrancar cada worker
+_sap_tools = None
+_sap_tools_lock = threading.Lock()
+
+def get_sap_tools():
+    """Herramientas (Functions) para SAP Service Layer, construidas una vez por proceso"""
+    global _sap_tools
+    if _sap_tools is None:
+        with _sap_tools_lock:
+            if _sap_tools is None:
+                _sap_tools = _build_sap_tools()
+    return _sap_tools
+
+def _build_sap_tools():
+    from google.genai.types import Tool, FunctionDeclaration
+    
+    return [
+        Tool(
+            function_declarations=[
+                FunctionDeclaration(
+                    name="query_sap_service_layer",
+                    description="""Consulta datos de SAP Business One Service Layer. 
+                
+                    Entidades disponibles:
+                    - Items: Maestro de artículos/productos
+                    - BusinessPartners: Clientes y proveedores
+                    - Orders: Pedidos de venta
+                    - Invoices: Facturas de venta
+                    - PurchaseOrders: Órdenes de compra
+                    - InventoryGenEntries: Entradas de mercancías
+                    - InventoryGenExits: Salidas de mercancías
+                    - ItemGroups: Grupos de artículos
+                    - Warehouses: Almacenes
+                    - PriceLists: Listas de precios
+                
+                    Ejemplos de filtros OData:
+                    - Items activos: "Valid eq 'Y'"
+                    - Items con stock: "OnHand gt 0" (para existencias es mejor get_stock)
+                    - Clientes: "CardType eq 'C'"
+                    - Documentos abiertos: "DocumentStatus eq 'O'"
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "entity": {
+                                "type": "string",
+                                "description": "Nombre de la entidad SAP (Items, BusinessPartners, Orders, etc.)"
+                            },
+                            "filters": {
+                                "type": "string",
+                                "description": "Filtros OData (opcional). Ejemplo: 'OnHand gt 0'"
+                            },
+                            "select": {
+                                "type": "string",
+                                "description": "Campos a seleccionar separados por coma (opcional). Ejemplo: 'ItemCode,ItemName,OnHand'"
+                            },
+                            "top": {
+                                "type": "integer",
+                                "description": "Cantidad de registros. OMITE este parámetro para obtener TODOS los registros (usa paginación automática). Solo úsalo si necesitas limitar resultados."
+                            }
+                        },
+                        "required": ["entity"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="get_sap_metadata",
+                    description="Obtiene información sobre todos los endpoints disponibles en SAP Service Layer, sus campos y filtros comunes",
+                    parameters={
+                        "type": "object",
+                        "properties": {}
+                    }
+                ),
+                FunctionDeclaration(
+                    name="get_top_selling_products",
+                    description="""Obtiene los productos más vendidos en un rango de fechas con VENTAS NETAS.
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
+                    - "productos más vendidos"
+                    - "top X productos"
+                    - "ranking de ventas por producto"
+                    - "qué productos se vendieron más"
+                
+                    🚨 IMPORTANTE: Esta función automáticamente:
+                    1. Descarga TODAS las facturas (Invoices) del período
+                    2. Descarga TODAS las notas de crédito (CreditNotes) del período
+                    3. Calcula: Ventas Netas = Facturas - Notas de Crédito
+                    4. EXCLUYE productos con precio < $3 dólares
+                    5. Suma las cantidades de cada producto (netas)
+                    6. Ordena de mayor a menor
+                    7. Retorna el top solicitado
+                
+                    Es mucho más eficiente y precisa que query_sap_service_layer para este análisis.
+                    SIEMPRE incluye el impacto de devoluciones y EXCLUYE productos baratos.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "date_from": {
+                                "type": "string",
+                                "description": "Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')"
+                            },
+                            "date_to": {
+                                "type": "string",
+                                "description": "Fecha fin en formato YYYY-MM-DD (ej: '2026-01-05')"
+                            },
+                            "top": {
+                                "type": "integer",
+                                "description": "Cantidad de productos a retornar (default: 5)"
+                            }
                         },
-                        "filters": {
-                            "type": "string",
-                            "description": "Filtros OData (opcional). Ejemplo: 'OnHand gt 0'"
+                        "required": ["date_from", "date_to"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="get_top_customers",
+                    description="""Obtiene los clientes que más compraron en un rango de fechas con VENTAS NETAS.
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
+                    - "clientes que más compraron"
+                    - "top X clientes"
+                    - "mejores clientes"
+                    - "ranking de clientes por ventas"
+                
+                    🚨 IMPORTANTE: Esta función automáticamente:
+                    1. Descarga TODAS las facturas (Invoices) del período
+                    2. Descarga TODAS las notas de crédito (CreditNotes) del período
+                    3. Calcula: Ventas Netas = Facturas - Notas de Crédito
+                    4. EXCLUYE productos con precio < $3 dólares
+                    5. Agrupa por cliente (CardCode)
+                    6. Suma montos netos por cliente
+                    7. Ordena de mayor a menor
+                    8. Retorna el top solicitado
+                
+                    Es MUCHO más eficiente que query_sap_service_layer para análisis de clientes.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "date_from": {
+                                "type": "string",
+                                "description": "Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')"
+                            },
+                            "date_to": {
+                                "type": "string",
+                                "description": "Fecha fin en formato YYYY-MM-DD (ej: '2026-01-31')"
+                            },
+                            "top": {
+                                "type": "integer",
+                                "description": "Cantidad de clientes a retornar (default: 5)"
+                            }
                         },
-                        "select": {
-                            "type": "string",
-                            "description": "Campos a seleccionar separados por coma (opcional). Ejemplo: 'ItemCode,ItemName,OnHand'"
+                        "required": ["date_from", "date_to"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="get_sales_person_performance",
+                    description="""Analiza el desempeño de un vendedor en un rango de fechas.
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
+                    - "ventas de [nombre vendedor]"
+                    - "analizar vendedor [código]"
+                    - "desempeño de [nombre]"
+                    - "evaluar ventas de [vendedor]"
+                    - "oportunidades de mejora [vendedor]"
+                
+                    🚨 IMPORTANTE: Esta función automáticamente:
+                    1. Filtra facturas por SalesPersonCode
+                    2. Calcula ventas netas (Facturas - Notas de Crédito)
+                    3. EXCLUYE productos con precio < $3 dólares
+                    4. Identifica top productos del vendedor
+                    5. Identifica top clientes del vendedor
+                    6. Calcula métricas: tasa de devolución, ticket promedio, etc.
+                    7. Sugiere oportunidades de mejora
+                
+                    Cuando el usuario menciona un código + nombre (ej: "1522 JEAN MORENO"),
+                    el código es el SalesPersonCode.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "sales_person_code": {
+                                "type": "string",
+                                "description": "Código del vendedor (ej: '1522', '-1' para sin vendedor)"
+                            },
+                            "date_from": {
+                                "type": "string",
+                                "description": "Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')"
+                            },
+                            "date_to": {
+                                "type": "string",
+                                "description": "Fecha fin en formato YYYY-MM-DD (ej: '2026-01-31')"
+                            }
                         },
-                        "top": {
-                            "type": "integer",
-                            "description": "Cantidad de registros. OMITE este parámetro para obtener TODOS los registros (usa paginación automática). Solo úsalo si necesitas limitar resultados."
-                        }
-                    },
-                    "required": ["entity"]
-                }
-            ),
-            FunctionDeclaration(
-                name="get_sap_metadata",
-                description="Obtiene información sobre todos los endpoints disponibles en SAP Service Layer, sus campos y filtros comunes",
-                parameters={
-                    "type": "object",
-                    "properties": {}
-                }
-            ),
-            FunctionDeclaration(
-                name="get_top_selling_products",
-                description="""Obtiene los productos más vendidos en un rango de fechas con VENTAS NETAS.
-                
-                ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
-                - "productos más vendidos"
-                - "top X productos"
-                - "ranking de ventas por producto"
-                - "qué productos se vendieron más"
-                
-                🚨 IMPORTANTE: Esta función automáticamente:
-                1. Descarga TODAS las facturas (Invoices) del período
-                2. Descarga TODAS las notas de crédito (CreditNotes) del período
-                3. Calcula: Ventas Netas = Facturas - Notas de Crédito
-                4. EXCLUYE productos con precio < $3 dólares
-                5. Suma las cantidades de cada producto (netas)
-                6. Ordena de mayor a menor
-                7. Retorna el top solicitado
-                
-                Es mucho más eficiente y precisa que query_sap_service_layer para este análisis.
-                SIEMPRE incluye el impacto de devoluciones y EXCLUYE productos baratos.
-                """,
-                parameters={
-                    "type": "object",
-                    "properties": {
-                        "date_from": {
-                            "type": "string",
-                            "description": "Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')"
+                        "required": ["sales_person_code", "date_from", "date_to"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="get_sales_leaderboard",
+                    description="""Ranking de TODOS los vendedores en un rango de fechas con VENTAS NETAS.
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
+                    - "ranking de vendedores"
+                    - "mejores vendedores del mes"
+                    - "compara a todos los vendedores"
+                    - "qué vendedor vendió más"
+                
+                    🚨 IMPORTANTE: Descarga facturas y notas de crédito UNA sola vez y calcula
+                    para cada vendedor: ventas netas, tasa de devolución, ticket promedio,
+                    clientes y productos distintos, participación y sus productos principales.
+                    EXCLUYE productos con precio < $3 dólares.
+                    NO llames get_sales_person_performance una vez por vendedor para comparar.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "date_from": {
+                                "type": "string",
+                                "description": "Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')"
+                            },
+                            "date_to": {
+                                "type": "string",
+                                "description": "Fecha fin en formato YYYY-MM-DD (ej: '2026-01-31')"
+                            },
+                            "top_products": {
+                                "type": "integer",
+                                "description": "Productos principales por vendedor (default: 3)"
+                            }
                         },
-                        "date_to": {
-                            "type": "string",
-                            "description": "Fecha fin en formato YYYY-MM-DD (ej: '2026-01-05')"
+                        "required": ["date_from", "date_to"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="compare_periods",
+                    description="""Compara VENTAS NETAS entre dos o más períodos en una sola llamada.
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
+                    - "enero vs diciembre"
+                    - "compara las ventas de este mes con el mes pasado"
+                    - "cómo crecieron las ventas respecto a ..."
+                    - "qué productos/clientes/vendedores cambiaron más entre ..."
+                
+                    🚨 IMPORTANTE: Descarga una sola vez los documentos de todos los períodos y
+                    retorna los totales de cada período y, por producto, cliente y vendedor,
+                    el monto de cada período, la diferencia y el crecimiento (%) contra el
+                    PRIMER período de la lista (pon primero el período base).
+                    EXCLUYE productos con precio < $3 dólares.
+                    NO llames get_top_selling_products una vez por período para comparar.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "periods": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {
+                                        "date_from": {
+                                            "type": "string",
+                                            "description": "Fecha inicio YYYY-MM-DD"
+                                        },
+                                        "date_to": {
+                                            "type": "string",
+                                            "description": "Fecha fin YYYY-MM-DD"
+                                        }
+                                    },
+                                    "required": ["date_from", "date_to"]
+                                },
+                                "description": "Períodos a comparar (al menos dos); el primero es la base"
+                            },
+                            "top": {
+                                "type": "integer",
+                                "description": "Productos, clientes y vendedores con mayor variación a retornar (default: 10)"
+                            }
                         },
-                        "top": {
-                            "type": "integer",
-                            "description": "Cantidad de productos a retornar (default: 5)"
+                        "required": ["periods"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="get_stock",
+                    description="""Existencias por artículo y almacén (en stock, comprometido, pedido y disponible).
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
+                    - "artículos con stock" / "qué hay en inventario"
+                    - "stock del almacén 01"
+                    - "productos con menos stock del grupo 105"
+                    - "cuánto hay disponible de A000123"
+                
+                    Responde desde una foto del inventario en memoria (se refresca cada pocos
+                    minutos; "as_of" indica su hora), en milisegundos y sin descargar /Items.
+                    NO uses query_sap_service_layer sobre Items con OnHand para esto.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "warehouse": {
+                                "type": "string",
+                                "description": "Código de almacén (ej: '01'); vacío = todos"
+                            },
+                            "group": {
+                                "type": "string",
+                                "description": "Grupo de artículos ItemsGroupCode (ej: '105'); vacío = todos"
+                            },
+                            "item_codes": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "Artículos específicos (ej: ['A000123'])"
+                            },
+                            "per_warehouse": {
+                                "type": "boolean",
+                                "description": "Una fila por artículo y almacén (default: false, suma los almacenes)"
+                            },
+                            "sort_by": {
+                                "type": "string",
+                                "enum": ["in_stock", "committed", "ordered", "available"],
+                                "description": "Columna para ordenar (default: in_stock)"
+                            },
+                            "ascending": {
+                                "type": "boolean",
+                                "description": "De menor a mayor, para 'menos stock' (default: false)"
+                            },
+                            "min_quantity": {
+                                "type": "number",
+                                "description": "Mínimo de la columna sort_by (ej: 0.01 para 'con stock')"
+                            },
+                            "top": {
+                                "type": "integer",
+                                "description": "Cantidad de filas a retornar (default: 20)"
+                            }
                         }
-                    },
-                    "required": ["date_from", "date_to"]
-                }
-            ),
-            FunctionDeclaration(
-                name="get_top_customers",
-                description="""Obtiene los clientes que más compraron en un rango de fechas con VENTAS NETAS.
-                
-                ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
-                - "clientes que más compraron"
-                - "top X clientes"
-                - "mejores clientes"
-                - "ranking de clientes por ventas"
-                
-                🚨 IMPORTANTE: Esta función automáticamente:
-                1. Descarga TODAS las facturas (Invoices) del período
-                2. Descarga TODAS las notas de crédito (CreditNotes) del período
-                3. Calcula: Ventas Netas = Facturas - Notas de Crédito
-                4. EXCLUYE productos con precio < $3 dólares
-                5. Agrupa por cliente (CardCode)
-                6. Suma montos netos por cliente
-                7. Ordena de mayor a menor
-                8. Retorna el top solicitado
-                
-                Es MUCHO más eficiente que query_sap_service_layer para análisis de clientes.
-                """,
-                parameters={
-                    "type": "object",
-                    "properties": {
-                        "date_from": {
-                            "type": "string",
-                            "description": "Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')"
+                    }
+                ),
+                FunctionDeclaration(
+                    name="lookup_master_data",
+                    description="""Resuelve códigos de artículos, clientes o vendedores a sus nombres.
+                
+                    Usa un directorio en memoria (no consulta SAP en cada llamada), así que es
+                    mucho más rápido que query_sap_service_layer sobre Items, BusinessPartners
+                    o SalesPersons cuando solo necesitas el nombre de uno o varios códigos.
+                
+                    Retorna para cada código:
+                    - items: ItemName, ItemsGroupCode
+                    - customers: CardName, CardType
+                    - sales_persons: SalesEmployeeName, Active
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "entity": {
+                                "type": "string",
+                                "enum": ["items", "customers", "sales_persons"],
+                                "description": "Tipo de dato maestro"
+                            },
+                            "codes": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "Códigos a buscar (ej: ['A000123', 'A000456'])"
+                            }
                         },
-                        "date_to": {
-                            "type": "string",
-                            "description": "Fecha fin en formato YYYY-MM-DD (ej: '2026-01-31')"
+                        "required": ["entity", "codes"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="find_code_by_name",
+                    description="""Busca el código de un vendedor o cliente por su nombre (completo, parcial o con errores).
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario nombra a un vendedor o cliente SIN dar su código,
+                    antes de get_sales_person_performance o de filtrar por CardCode.
+                    Es instantánea (índice local), NO uses substringof() sobre BusinessPartners para esto.
+                
+                    Retorna candidatos ordenados por similitud (score de 0 a 1). Si el primero tiene
+                    un score claramente mayor que el segundo, úsalo; si no, pregunta al usuario.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "entity": {
+                                "type": "string",
+                                "enum": ["sales_persons", "customers"],
+                                "description": "Buscar entre vendedores o clientes"
+                            },
+                            "name": {
+                                "type": "string",
+                                "description": "Nombre o parte del nombre (ej: 'JEAN MORENO')"
+                            },
+                            "limit": {
+                                "type": "integer",
+                                "description": "Cantidad máxima de candidatos (default: 5)"
+                            }
                         },
-                        "top": {
-                            "type": "integer",
-                            "description": "Cantidad de clientes a retornar (default: 5)"
-                        }
-                    },
-                    "required": ["date_from", "date_to"]
-                }
-            ),
-            FunctionDeclaration(
-                name="get_sales_person_performance",
-                description="""Analiza el desempeño de un vendedor en un rango de fechas.
-                
-                ⚠️ USA ESTA FUNCIÓN cuando el usuario pregunte por:
-                - "ventas de [nombre vendedor]"
-                - "analizar vendedor [código]"
-                - "desempeño de [nombre]"
-                - "evaluar ventas de [vendedor]"
-                - "oportunidades de mejora [vendedor]"
-                
-                🚨 IMPORTANTE: Esta función automáticamente:
-                1. Filtra facturas por SalesPersonCode
-                2. Calcula ventas netas (Facturas - Notas de Crédito)
-                3. EXCLUYE productos con precio < $3 dólares
-                4. Identifica top productos del vendedor
-                5. Identifica top clientes del vendedor
-                6. Calcula métricas: tasa de devolución, ticket promedio, etc.
-                7. Sugiere oportunidades de mejora
-                
-                Cuando el usuario menciona un código + nombre (ej: "1522 JEAN MORENO"),
-                el código es el SalesPersonCode.
-                """,
-                parameters={
-                    "type": "object",
-                    "properties": {
-                        "sales_person_code": {
-                            "type": "string",
-                            "description": "Código del vendedor (ej: '1522', '-1' para sin vendedor)"
+                        "required": ["entity", "name"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="create_export_link",
+                    description="""Crea un enlace de descarga (CSV o Parquet) con TODOS los registros de una consulta.
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario pide una lista completa o un archivo
+                    (ej: "todas las facturas de enero", "exporta los clientes a Excel") y el resultado
+                    tiene cientos o miles de registros: NO los pegues en el chat.
+                    La consulta se ejecuta al descargar, así que no hace falta consultar antes.
+                
+                    Responde con el enlace en formato Markdown: [Descargar archivo](url)
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "entity": {
+                                "type": "string",
+                                "description": "Nombre de la entidad (Invoices, Items, BusinessPartners, etc.)"
+                            },
+                            "filters": {
+                                "type": "string",
+                                "description": "Filtros OData (ej: \"DocDate ge '2026-01-01' and DocDate le '2026-01-31'\")"
+                            },
+                            "select": {
+                                "type": "string",
+                                "description": "Columnas del archivo, en orden (ej: 'DocNum,DocDate,CardCode,CardName,DocTotal')"
+                            },
+                            "format": {
+                                "type": "string",
+                                "enum": ["csv", "parquet"],
+                                "description": "Formato del archivo (default: csv, se abre en Excel)"
+                            }
                         },
-                        "date_from": {
-                            "type": "string",
-                            "description": "Fecha inicio en formato YYYY-MM-DD (ej: '2026-01-01')"
+                        "required": ["entity"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="create_table_view",
+                    description="""Crea una tabla navegable en el chat (paginada, ordenable y con búsqueda) con TODOS los registros de una consulta.
+                
+                    ⚠️ USA ESTA FUNCIÓN cuando el usuario quiere VER una lista larga en el chat
+                    (ej: "muéstrame todas las facturas de enero", "lista de clientes") y el resultado
+                    tiene más de 20-30 registros: NO pegues cientos de filas en una tabla Markdown.
+                    Para descargar un archivo usa create_export_link.
+                
+                    Retorna un marcador [[tabla:...]]: inclúyelo TAL CUAL, en su propia línea, en tu
+                    respuesta; el chat lo reemplaza por la tabla. Puedes comentar first_rows y total_rows.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "entity": {
+                                "type": "string",
+                                "description": "Nombre de la entidad (Invoices, Items, BusinessPartners, etc.)"
+                            },
+                            "filters": {
+                                "type": "string",
+                                "description": "Filtros OData (ej: \"DocDate ge '2026-01-01' and DocDate le '2026-01-31'\")"
+                            },
+                            "select": {
+                                "type": "string",
+                                "description": "Columnas de la tabla, en orden (ej: 'DocNum,DocDate,CardCode,CardName,DocTotal')"
+                            },
+                            "title": {
+                                "type": "string",
+                                "description": "Título de la tabla (ej: 'Facturas de enero 2026')"
+                            }
                         },
-                        "date_to": {
-                            "type": "string",
-                            "description": "Fecha fin en formato YYYY-MM-DD (ej: '2026-01-31')"
-                        }
-                    },
-                    "required": ["sales_person_code", "date_from", "date_to"]
-                }
-            ),
-            FunctionDeclaration(
-                name="get_cached_queries",
-                description="""Obtiene todas las consultas SAP que has ejecutado en esta sesión.
-                
-                Útil para:
-                - Revisar investigaciones previas
-                - Hacer resúmenes consolidados de múltiples consultas
-                - Evitar consultas duplicadas
-                - Analizar patrones en los datos consultados
-                
-                Puedes investigar libremente haciendo múltiples consultas y luego usar esta función para generar un resumen completo.
-                """,
-                parameters={
-                    "type": "object",
-                    "properties": {
-                        "summary_only": {
-                            "type": "boolean",
-                            "description": "Si True, solo retorna descripciones de consultas. Si False, incluye datos completos."
+                        "required": ["entity"]
+                    }
+                ),
+                FunctionDeclaration(
+                    name="get_cached_queries",
+                    description="""Obtiene todas las consultas SAP que has ejecutado en esta sesión.
+                
+                    Útil para:
+                    - Revisar investigaciones previas
+                    - Hacer resúmenes consolidados de múltiples consultas
+                    - Evitar consultas duplicadas
+                    - Analizar patrones en los datos consultados
+                
+                    Puedes investigar libremente haciendo múltiples consultas y luego usar esta función para generar un resumen completo.
+                    """,
+                    parameters={
+                        "type": "object",
+                        "properties": {
+                            "summary_only": {
+                                "type": "boolean",
+                                "description": "Si True, solo retorna descripciones de consultas. Si False, incluye datos completos."
+                            }
                         }
                     }
-                }
-            )
-        ]
-    )
-]
+                )
+            ]
+        )
+    ]
 
 # Configurar Vertex AI con Service Account
 def configure_gemini():
@@ -225,6 +509,8 @@ def configure_gemini():
     global vertex_client
     
     try:
+        from google import genai
+        
         # Configurar credenciales
         credentials_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS', 'credentials.json')
         project_id = os.environ.get('GOOGLE_CLOUD_PROJECT', 'sap-b1-ai-integration')
@@ -260,18 +546,162 @@ def configure_gemini():
 
 def chat_view(request):
     """Vista principal del chat"""
-    # Obtener historial de mensajes
-    messages = ChatMessage.objects.all().order_by('timestamp')
+    # Obtener historial de mensajes (con las escrituras diferidas ya hechas)
+    write_behind.flush(timeout=2)
+    # Se entrega como JSON: la página sólo monta en el DOM los mensajes visibles
+    messages = list(ChatMessage.objects.order_by('timestamp').values('role', 'message'))
     return render(request, 'chat.html', {
         'messages': messages
     })
 
+def _build_query_log(func_name, func_args):
+    """Entrada del log de consultas que se muestra en el chat (None si la herramienta no consulta SAP)"""
+    if func_name == "query_sap_service_layer":
+        return {
+            "entity": func_args.get("entity", ""),
+            "filters": func_args.get("filters", ""),
+            "select": func_args.get("select", ""),
+            "top": func_args.get("top", "Sin límite")
+        }
+    if func_name == "get_top_selling_products":
+        return {
+            "entity": "TopSellingProducts",
+            "filters": f"{func_args.get('date_from', '')} al {func_args.get('date_to', '')}",
+            "select": f"Top {func_args.get('top', 5)} productos",
+            "top": "Análisis completo"
+        }
+    if func_name == "get_top_customers":
+        return {
+            "entity": "TopCustomers",
+            "filters": f"{func_args.get('date_from', '')} al {func_args.get('date_to', '')}",
+            "select": f"Top {func_args.get('top', 5)} clientes",
+            "top": "Análisis completo"
+        }
+    if func_name == "get_sales_person_performance":
+        return {
+            "entity": "SalesPersonPerformance",
+            "filters": f"Vendedor {func_args.get('sales_person_code', '')} - {func_args.get('date_from', '')} al {func_args.get('date_to', '')}",
+            "select": "Análisis completo de desempeño",
+            "top": "Ventas, clientes, productos, oportunidades"
+        }
+    if func_name == "get_sales_leaderboard":
+        return {
+            "entity": "SalesLeaderboard",
+            "filters": f"{func_args.get('date_from', '')} al {func_args.get('date_to', '')}",
+            "select": "Ranking de vendedores",
+            "top": "Todos los vendedores"
+        }
+    if func_name == "get_stock":
+        return {
+            "entity": "Stock",
+            "filters": f"Almacén {func_args.get('warehouse') or 'todos'} - Grupo {func_args.get('group') or 'todos'}",
+            "select": f"Ordenado por {func_args.get('sort_by', 'in_stock')}",
+            "top": func_args.get('top', 20)
+        }
+    if func_name == "compare_periods":
+        return {
+            "entity": "PeriodComparison",
+            "filters": " vs ".join(f"{period.get('date_from', '')} al {period.get('date_to', '')}"
+                                   for period in func_args.get('periods') or []),
+            "select": "Variación por producto, cliente y vendedor",
+            "top": f"Top {func_args.get('top', 10)} variaciones"
+        }
+    if func_name == "create_table_view":
+        return {
+            "entity": func_args.get("entity", ""),
+            "filters": func_args.get("filters", ""),
+            "select": func_args.get("select", ""),
+            "top": "Tabla paginada"
+        }
+    return None
+
+def _dispatch_tool(func_name, func_args):
+    """Ejecutar una herramienta por nombre; devuelve su resultado JSON (string)"""
+    with metrics.span('tool_dispatch', tool=func_name):
+        if func_name == "query_sap_service_layer":
+            return query_sap_service_layer(**func_args)
+        elif func_name == "get_sap_metadata":
+            return get_sap_metadata()
+        elif func_name == "get_cached_queries":
+            return get_cached_queries(**func_args)
+        elif func_name == "get_top_selling_products":
+            return get_top_selling_products(**func_args)
+        elif func_name == "get_top_customers":
+            return get_top_customers(**func_args)
+        elif func_name == "get_sales_person_performance":
+            return get_sales_person_performance(**func_args)
+        elif func_name == "get_sales_leaderboard":
+            return get_sales_leaderboard(**func_args)
+        elif func_name == "compare_periods":
+            return compare_periods(**func_args)
+        elif func_name == "get_stock":
+            return get_stock(**func_args)
+        elif func_name == "lookup_master_data":
+            return lookup_master_data(**func_args)
+        elif func_name == "find_code_by_name":
+            return find_code_by_name(**func_args)
+        elif func_name == "create_export_link":
+            return create_export_link(**func_args)
+        elif func_name == "create_table_view":
+            return create_table_view(**func_args)
+        return codec.dumps({"error": f"Función {func_name} no encontrada"})
+
+def _tool_failed(result):
+    """¿El resultado (JSON) de una herramienta es un error?"""
+    try:
+        data = codec.loads(result)
+    except codec.DecodeError:
+        return True
+    return isinstance(data, dict) and (bool(data.get('error')) or data.get('success') is False)
+
+def _table_pages(text):
+    """Primera página de cada tabla [[tabla:...]] de una respuesta, para mostrarla sin otra petición"""
+    tables = {}
+    for token in table_handles.tokens_in(text):
+        try:
+            tables[token] = table_handles.page(table_handles.load(token))
+        except (signing.BadSignature, table_handles.TableGone, ValueError):
+            # El chat pide la tabla a /table/ y muestra el error
+            continue
+    return tables
+
+def _route_message(intent):
+    """
+    Responder sin el modelo una pregunta que el enrutador reconoció
+
+    Returns:
+        (respuesta Markdown, query_log) o None si la pregunta debe ir al modelo
+    """
+    if intent is None:
+        return None
+    intent = intent_router.resolve(intent)
+    if intent is None:
+        print("↩️ No se resolvió el vendedor con confianza, la pregunta pasa al modelo")
+        return None
+    print(f"🧭 Enrutada sin modelo: {intent.tool}({intent.args}) confianza {intent.confidence:.2f}")
+    result = _dispatch_tool(intent.tool, intent.args)
+    try:
+        text = intent_router.render(intent, codec.loads(result))
+    except (codec.DecodeError, KeyError, TypeError, ValueError) as e:
+        print(f"⚠️ No se pudo formatear la respuesta enrutada: {e}")
+        text = None
+    if text is None:
+        print("↩️ La herramienta falló, la pregunta pasa al modelo")
+        return None
+    return text, _build_query_log(intent.tool, intent.args)
+
 @csrf_exempt
 def send_message(request):
     """API endpoint para enviar mensajes a Gemini"""
+    metrics.begin_request()
+    response = profiling.maybe_profile(request, _send_message)
+    metrics.end_request('ok' if response.status_code == 200 else str(response.status_code))
+    return response
+
+def _send_message(request):
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = codec.loads(request.body)
             user_message = data.get('message', '')
             
             if not user_message:
@@ -279,15 +709,64 @@ def send_message(request):
                     'error': 'El mensaje no puede estar vacío'
                 }, status=400)
             
-            # Guardar mensaje del usuario
-            ChatMessage.objects.create(
+            # Guardar mensaje del usuario (en segundo plano)
+            write_behind.add(ChatMessage(
                 role='user',
                 message=user_message
+            ))
+            
+            # Obtener historial de conversación (últimos 10 mensajes, incluidos los que
+            # todavía esperan su escritura diferida)
+            stored_messages = list(ChatMessage.objects.all().order_by('-timestamp')[:10])
+            stored_ids = {msg.pk for msg in stored_messages}
+            pending_messages = [msg for msg in write_behind.pending(ChatMessage) if msg.pk not in stored_ids]
+            history_messages = sorted(stored_messages + pending_messages, key=lambda msg: msg.timestamp)[-10:]
+            
+            # El enrutador también decide si la pregunta se entiende sin la conversación
+            intent = None
+            if intent_router.enabled():
+                with metrics.span('intent_router'):
+                    intent = intent_router.route(user_message)
+            
+            # Preguntas repetidas: la misma pregunta sobre el mismo período ya se respondió.
+            # Si el enrutador no la entiende sola, la respuesta puede depender de la conversación
+            answer_key = answer_cache.question_key(
+                user_message,
+                context=None if intent else [f"{msg.role}:{msg.message}" for msg in history_messages[:-1]]
             )
+            cached_answer = answer_cache.get(answer_key)
+            if cached_answer:
+                assistant_message, query_logs = cached_answer
+                print(f"⚡ Respuesta desde la caché: {answer_key[0]}")
+                write_behind.add(ChatMessage(
+                    role='assistant',
+                    message=assistant_message
+                ))
+                return JsonResponse({
+                    'success': True,
+                    'response': assistant_message,
+                    'query_logs': query_logs,
+                    'tables': _table_pages(assistant_message),
+                    'cached': True
+                })
             
-            # Obtener historial de conversación (últimos 10 mensajes)
-            history_messages = ChatMessage.objects.all().order_by('-timestamp')[:10]
-            history_messages = list(reversed(history_messages))
+            # Preguntas frecuentes: responder directamente con la herramienta
+            routed = _route_message(intent)
+            if routed:
+                assistant_message, query_log = routed
+                query_logs = [query_log] if query_log else []
+                answer_cache.put(answer_key, assistant_message, query_logs)
+                write_behind.add(ChatMessage(
+                    role='assistant',
+                    message=assistant_message
+                ))
+                return JsonResponse({
+                    'success': True,
+                    'response': assistant_message,
+                    'query_logs': query_logs,
+                    'tables': _table_pages(assistant_message),
+                    'routed': True
+                })
             
             # Construir historial para Gemini
             conversation_history = []
@@ -316,6 +795,8 @@ def send_message(request):
             
             # Enviar mensaje a Gemini en Vertex AI con herramientas SAP
             try:
+                from google.genai.types import GenerateContentConfig
+                
                 # Probar modelos disponibles
                 model_names = ["gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-pro"]
                 
@@ -333,6 +814,11 @@ Herramientas disponibles:
 1. query_sap_service_layer(entity, filters, select, top) - Consulta datos de SAP
 2. get_sap_metadata() - Lista todos los endpoints disponibles
 3. get_cached_queries(summary_only) - Recupera consultas previas de esta sesión
+4. lookup_master_data(entity, codes) - Nombres de artículos, clientes o vendedores por código (instantáneo)
+5. find_code_by_name(entity, name) - Código de un vendedor o cliente a partir de su nombre (instantáneo)
+6. create_export_link(entity, filters, select, format) - Enlace de descarga CSV/Parquet para listas completas grandes
+7. get_stock(warehouse, group, item_codes, sort_by, top) - Existencias por artículo y almacén (instantáneo)
+8. create_table_view(entity, filters, select, title) - Tabla navegable en el chat para listas largas (incluye su marcador [[tabla:...]] tal cual)
 
 🎯 ESTRATEGIA DE INVESTIGACIÓN ACUMULATIVA:
 
@@ -365,16 +851,19 @@ Cuando el usuario menciona un código + nombre (ej: "1522 JEAN MORENO"):
 - El número (1522) es el SalesPersonCode
 - El nombre (JEAN MORENO) es el nombre del vendedor
 - USA get_sales_person_performance() para analizar ese vendedor específico
+- Para comparar o rankear a TODOS los vendedores USA get_sales_leaderboard() (una sola descarga)
 - Ejemplos de preguntas sobre vendedores:
   * "evalúa las ventas de 1522 JEAN MORENO"
   * "desempeño del vendedor 1522 en enero"
   * "oportunidades de mejora para JEAN MORENO"
+- Si el usuario solo da el nombre (sin código), llama primero find_code_by_name(entity="sales_persons", name=...)
 
 🚨 REGLA CRÍTICA DE VENTAS NETAS:
 ⚠️ SIEMPRE que analices ventas, facturas, productos vendidos o cualquier métrica de venta:
 - Las VENTAS NETAS = Facturas (Invoices) - Notas de Crédito (CreditNotes)
 - Las notas de crédito son DEVOLUCIONES que deben RESTARSE
 - USA la función get_top_selling_products() que automáticamente calcula ventas netas
+- Para comparar períodos (ej: "enero vs diciembre") USA compare_periods() con ambos períodos en una sola llamada
 - Si consultas manualmente, SIEMPRE resta las notas de crédito del mismo período
 
 🚨 REGLA CRÍTICA DE PRECIOS:
@@ -451,7 +940,7 @@ IMPORTANTE:
                         
                         # Configurar con herramientas
                         config = GenerateContentConfig(
-                            tools=sap_tools,
+                            tools=get_sap_tools(),
                             system_instruction=system_instruction
                         )
                         
@@ -462,11 +951,12 @@ IMPORTANTE:
                         }]
                         
                         # Primera llamada al modelo con historial
-                        response = client.models.generate_content(
-                            model=model_name,
-                            contents=contents,
-                            config=config
-                        )
+                        with metrics.span('gemini_call', model=model_name):
+                            response = client.models.generate_content(
+                                model=model_name,
+                                contents=contents,
+                                config=config
+                            )
                         
                         model_used = model_name
                         print(f"✅ Usando modelo: {model_name} (con historial de {len(conversation_history)} mensajes)")
@@ -483,6 +973,8 @@ IMPORTANTE:
                 max_iterations = 5
                 iteration = 0
                 assistant_message = None
+                model_answered = False
+                tool_results = []
                 query_logs = []  # Lista para rastrear queries ejecutados
                 
                 while iteration < max_iterations:
@@ -493,6 +985,7 @@ IMPORTANTE:
                     try:
                         if hasattr(response, 'text') and response.text:
                             assistant_message = response.text
+                            model_answered = True
                             print(f"📝 Respuesta con texto: {assistant_message[:100]}...")
                             break
                     except:
@@ -518,67 +1011,36 @@ IMPORTANTE:
                     print(f"🔧 Ejecutando {len(function_calls)} función(es)...")
                     function_responses = []
                     
-                    for fc in function_calls:
+                    # Varias consultas SAP en el mismo turno: una sesión y un solo $batch
+                    batched_results = {}
+                    sap_calls = [i for i, fc in enumerate(function_calls) if fc.name == "query_sap_service_layer"]
+                    if len(sap_calls) > 1:
+                        with metrics.span('tool_dispatch', tool='query_sap_service_layer_many'):
+                            results = query_sap_service_layer_many(
+                                [dict(function_calls[i].args) if function_calls[i].args else {} for i in sap_calls]
+                            )
+                        batched_results = dict(zip(sap_calls, results))
+                    
+                    for call_index, fc in enumerate(function_calls):
                         func_name = fc.name
                         func_args = dict(fc.args) if fc.args else {}
                         
                         print(f"   → {func_name}({func_args})")
                         
                         # Guardar query log si es una consulta SAP
-                        if func_name == "query_sap_service_layer":
-                            query_log = {
-                                "entity": func_args.get("entity", ""),
-                                "filters": func_args.get("filters", ""),
-                                "select": func_args.get("select", ""),
-                                "top": func_args.get("top", "Sin límite")
-                            }
-                            query_logs.append(query_log)
-                            print(f"   📊 Log guardado: {query_log}")
-                        elif func_name == "get_top_selling_products":
-                            query_log = {
-                                "entity": "TopSellingProducts",
-                                "filters": f"{func_args.get('date_from', '')} al {func_args.get('date_to', '')}",
-                                "select": f"Top {func_args.get('top', 5)} productos",
-                                "top": "Análisis completo"
-                            }
-                            query_logs.append(query_log)
-                            print(f"   📊 Log guardado: {query_log}")
-                        elif func_name == "get_top_customers":
-                            query_log = {
-                                "entity": "TopCustomers",
-                                "filters": f"{func_args.get('date_from', '')} al {func_args.get('date_to', '')}",
-                                "select": f"Top {func_args.get('top', 5)} clientes",
-                                "top": "Análisis completo"
-                            }
-                            query_logs.append(query_log)
-                            print(f"   📊 Log guardado: {query_log}")
-                        elif func_name == "get_sales_person_performance":
-                            query_log = {
-                                "entity": "SalesPersonPerformance",
-                                "filters": f"Vendedor {func_args.get('sales_person_code', '')} - {func_args.get('date_from', '')} al {func_args.get('date_to', '')}",
-                                "select": "Análisis completo de desempeño",
-                                "top": "Ventas, clientes, productos, oportunidades"
-                            }
+                        query_log = _build_query_log(func_name, func_args)
+                        if query_log:
                             query_logs.append(query_log)
                             print(f"   📊 Log guardado: {query_log}")
                         
                         # Ejecutar la función
-                        if func_name == "query_sap_service_layer":
-                            result = query_sap_service_layer(**func_args)
-                        elif func_name == "get_sap_metadata":
-                            result = get_sap_metadata()
-                        elif func_name == "get_cached_queries":
-                            result = get_cached_queries(**func_args)
-                        elif func_name == "get_top_selling_products":
-                            result = get_top_selling_products(**func_args)
-                        elif func_name == "get_top_customers":
-                            result = get_top_customers(**func_args)
-                        elif func_name == "get_sales_person_performance":
-                            result = get_sales_person_performance(**func_args)
+                        if call_index in batched_results:
+                            result = batched_results[call_index]
                         else:
-                            result = json.dumps({"error": f"Función {func_name} no encontrada"})
+                            result = _dispatch_tool(func_name, func_args)
                         
                         print(f"   ✅ Resultado: {result[:200] if isinstance(result, str) else str(result)[:200]}...")
+                        tool_results.append(result)
                         
                         function_responses.append({
                             "name": func_name,
@@ -610,11 +1072,12 @@ IMPORTANTE:
                         {"role": "user", "parts": parts_response}
                     ]
                     
-                    response = client.models.generate_content(
-                        model=model_used,
-                        contents=full_conversation,
-                        config=config
-                    )
+                    with metrics.span('gemini_call', model=model_used):
+                        response = client.models.generate_content(
+                            model=model_used,
+                            contents=full_conversation,
+                            config=config
+                        )
                 
                 # Si no hay mensaje después de las iteraciones
                 if not assistant_message:
@@ -649,21 +1112,26 @@ IMPORTANTE:
                     'error': f'Error en Vertex AI: {error_msg}'
                 }, status=500)
             
+            # No cachear disculpas del modelo por una herramienta que falló (ej: SAP caído)
+            if model_answered and answer_key and not any(_tool_failed(result) for result in tool_results):
+                answer_cache.put(answer_key, assistant_message, query_logs)
+            
             # Guardar respuesta del asistente
-            ChatMessage.objects.create(
+            write_behind.add(ChatMessage(
                 role='assistant',
                 message=assistant_message
-            )
+            ))
             
             print(f"📤 Enviando respuesta con {len(query_logs)} query log(s)")
             
             return JsonResponse({
                 'success': True,
                 'response': assistant_message,
-                'query_logs': query_logs
+                'query_logs': query_logs,
+                'tables': _table_pages(assistant_message)
             })
             
-        except json.JSONDecodeError:
+        except codec.DecodeError:
             return JsonResponse({
                 'error': 'Formato JSON inválido'
             }, status=400)
@@ -681,11 +1149,15 @@ def clear_history(request):
     """Endpoint para limpiar el historial del chat y el caché de consultas"""
     if request.method == 'POST':
         try:
+            # Terminar las escrituras diferidas para que no reaparezcan tras borrar
+            write_behind.flush()
+            
             # Limpiar mensajes
             ChatMessage.objects.all().delete()
             
             # Limpiar caché de consultas
             QueryCache.objects.all().delete()
+            answer_cache.clear()
             
             # Resetear session ID
             reset_session()
@@ -704,3 +1176,54 @@ def clear_history(request):
     return JsonResponse({
         'error': 'Método no permitido'
     }, status=405)
+
+def metrics_view(request):
+    """Métricas del pipeline en formato de exposición de Prometheus"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def export_view(request):
+    """Descarga (streaming) de una consulta completa a partir de un enlace de create_export_link"""
+    try:
+        spec = export.load(request.GET.get('q', ''))
+    except signing.BadSignature:
+        return JsonResponse({
+            'error': 'Enlace de exportación inválido o vencido, pide uno nuevo en el chat'
+        }, status=400)
+    
+    try:
+        content_type, filename, chunks = export.open_stream(spec)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({
+            'error': f'Error preparando la exportación: {str(e)}'
+        }, status=502)
+    
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def table_view(request):
+    """Página de una tabla creada con create_table_view (orden y búsqueda en el servidor)"""
+    try:
+        spec = table_handles.load(request.GET.get('h', ''))
+    except signing.BadSignature:
+        return JsonResponse({
+            'error': 'Tabla inválida o vencida, pídela de nuevo en el chat'
+        }, status=400)
+    
+    try:
+        return JsonResponse(table_handles.page(
+            spec,
+            page=request.GET.get('page', 1),
+            page_size=request.GET.get('page_size', table_handles.PAGE_SIZE),
+            sort=request.GET.get('sort', ''),
+            descending=request.GET.get('desc', '') in ('1', 'true'),
+            search=request.GET.get('q', '')
+        ))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except table_handles.TableGone:
+        return JsonResponse({
+            'error': 'Los datos de esta tabla ya no están guardados, pídela de nuevo en el chat'
+        }, status=410)
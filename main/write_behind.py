@@ -0,0 +1,207 @@
+"""
+Escritura diferida (write-behind) de ChatMessage y QueryCache
+
+Guardar el mensaje del usuario, la respuesta y cada resultado de SAP (que
+puede pesar varios MB) dentro de la petición suma la escritura a la latencia
+y, con SQLite, serializa a todos los usuarios detrás de un único escritor.
+Con add() las instancias se encolan y un hilo las inserta en lote con
+bulk_create cada FLUSH_INTERVAL segundos, en una sola transacción.
+
+Cada modelo se escribe en su propia transacción: una fila inválida de
+QueryCache no arrastra a los mensajes del chat. Si la base sigue bloqueada
+tras WRITE_RETRIES intentos, los mensajes del chat vuelven a la cola y se
+reintentan en el siguiente ciclo (hasta KEEP_CYCLES veces); las filas de
+QueryCache, que son sólo una caché, se descartan.
+
+Mientras no se escriben, las instancias siguen visibles con pending() (el
+historial del chat y la reutilización de consultas las consideran) y flush()
+espera a que todo lo encolado hasta ese momento esté en la base (devuelve
+False si alguna fila se descartó o venció el timeout). Otros
+módulos pueden reaccionar a cada lote escrito con add_listener() (la
+retención de QueryCache lo usa para podar de forma oportunista).
+
+Variables de entorno:
+    WRITE_BEHIND            0 para escribir de forma síncrona (default 1)
+    WRITE_BEHIND_INTERVAL   segundos entre escrituras en lote (default 0.2)
+"""
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, List, Optional, Tuple, Type
+
+from . import metrics
+
+ENABLED = os.environ.get('WRITE_BEHIND', '1') != '0'
+FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.2))
+BATCH_SIZE = 500
+WRITE_RETRIES = 3
+KEEP_CYCLES = 10
+RETRY_CYCLE_DELAY = 2.0
+# Modelos cuyas filas se reintentan en vez de descartarse si la base no responde
+KEEP_ON_FAILURE = ('main.ChatMessage',)
+
+_queue: list = []
+_cond = threading.Condition()
+_enqueued = 0
+_processed = 0
+_dropped = 0
+_retrying = 0
+_flush_requested = False
+_thread: Optional[threading.Thread] = None
+# listener(modelo, instancias escritas), llamado desde el hilo de escritura
+_listeners: List[Callable[[Type, list], None]] = []
+
+
+def add_listener(listener: Callable[[Type, list], None]):
+    """Recibir cada lote escrito (por modelo)"""
+    _listeners.append(listener)
+
+
+def add(instance):
+    """Encolar una instancia nueva para insertarla en segundo plano"""
+    global _enqueued, _thread
+    if not ENABLED:
+        instance.save()
+        _notify(type(instance), [instance])
+        return
+    with _cond:
+        _queue.append(instance)
+        _enqueued += 1
+        metrics.WRITE_BEHIND_PENDING.set(len(_queue))
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name='write-behind', daemon=True)
+            _thread.start()
+        _cond.notify_all()
+
+
+def pending(model: Type) -> List:
+    """Instancias de un modelo que todavía no se escribieron (en orden de llegada)"""
+    with _cond:
+        return [instance for instance in _queue if isinstance(instance, model)]
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    """Esperar a que se escriba todo lo encolado hasta ahora; False si venció timeout o se descartaron filas"""
+    global _flush_requested
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _cond:
+        target = _enqueued
+        dropped = _dropped
+        _flush_requested = True
+        _cond.notify_all()
+        while _processed < target or _retrying:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if _thread is None or not _thread.is_alive():
+                return False
+            _cond.wait(remaining)
+        return _dropped == dropped
+
+
+def _write_model(model: Type, instances: list) -> Tuple[list, list]:
+    """
+    Escribir las filas de un modelo en una transacción
+
+    Returns:
+        (filas escritas, filas a reintentar en el próximo ciclo)
+    """
+    from django.db import OperationalError, transaction
+
+    for attempt in range(WRITE_RETRIES):
+        try:
+            with metrics.span('write_behind_flush'), transaction.atomic():
+                model.objects.bulk_create(instances, batch_size=BATCH_SIZE)
+            return instances, []
+        except OperationalError as e:
+            # "database is locked" a pesar del busy timeout: reintentar el lote del modelo
+            print(f"⚠️ Escritura diferida de {model.__name__} falló (intento {attempt + 1}): {e}")
+            time.sleep(0.5 * (attempt + 1))
+        except Exception as e:
+            # Alguna fila inválida: escribir de a una para descartar sólo esa
+            print(f"⚠️ Escritura diferida de {model.__name__} falló, reintentando fila por fila: {e}")
+            written = []
+            for instance in instances:
+                try:
+                    with transaction.atomic():
+                        instance.save(force_insert=True)
+                    written.append(instance)
+                except Exception as row_error:
+                    print(f"❌ Fila de {model.__name__} descartada: {row_error}")
+            return written, []
+
+    if model._meta.label in KEEP_ON_FAILURE:
+        kept = [instance for instance in instances if _bump_attempts(instance) < KEEP_CYCLES]
+        if len(kept) < len(instances):
+            print(f"❌ {len(instances) - len(kept)} filas de {model.__name__} descartadas tras {KEEP_CYCLES} ciclos")
+        return [], kept
+    print(f"❌ Escritura diferida descartada tras {WRITE_RETRIES} intentos ({len(instances)} filas de {model.__name__})")
+    return [], []
+
+
+def _bump_attempts(instance) -> int:
+    attempts = getattr(instance, '_write_behind_cycles', 0) + 1
+    instance._write_behind_cycles = attempts
+    return attempts
+
+
+def _write(batch: list) -> Tuple[int, list]:
+    """Escribir un lote; devuelve (filas escritas, filas a reintentar)"""
+    by_model = defaultdict(list)
+    for instance in batch:
+        by_model[type(instance)].append(instance)
+
+    written_count = 0
+    kept = []
+    for model, instances in by_model.items():
+        written, retry = _write_model(model, instances)
+        written_count += len(written)
+        kept += retry
+        if written:
+            _notify(model, written)
+    return written_count, kept
+
+
+def _notify(model: Type, instances: list):
+    for listener in _listeners:
+        try:
+            listener(model, instances)
+        except Exception as e:
+            print(f"⚠️ Error notificando escritura diferida: {e}")
+
+
+def _run():
+    global _processed, _dropped, _retrying, _flush_requested
+    from django.db import connection
+
+    while True:
+        with _cond:
+            while not _queue:
+                _cond.wait()
+            # Juntar lo que llegue durante FLUSH_INTERVAL (salvo que alguien espere en flush)
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while not _flush_requested and time.monotonic() < deadline:
+                _cond.wait(deadline - time.monotonic())
+            _flush_requested = False
+            batch = list(_queue)
+        written, kept = 0, []
+        try:
+            written, kept = _write(batch)
+        finally:
+            connection.close_if_unusable_or_obsolete()
+            with _cond:
+                del _queue[:len(batch)]
+                # Las filas a reintentar vuelven al frente de la cola (y siguen en pending())
+                _queue[:0] = kept
+                _retrying = len(kept)
+                _processed += len(batch) - len(kept)
+                _dropped += len(batch) - written - len(kept)
+                metrics.WRITE_BEHIND_PENDING.set(len(_queue))
+                _cond.notify_all()
+        if kept:
+            time.sleep(RETRY_CYCLE_DELAY)
+
+
+atexit.register(flush, 10)